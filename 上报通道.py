@@ -0,0 +1,231 @@
+"""员工端与服务器之间的持久通道（WebSocket）
+
+一条连接同时承担：
+- 上行：数据变化时上报完整数据，数据没变化时只定期发送心跳（保持在线状态）
+- 下行：接收管理端发送的消息（代替 /poll_messages 长轮询）
+
+连接断开后自动重连。未连接时 send_report 返回False，调用方改用HTTP /report 上报。
+服务器一个心跳间隔没有发来任何数据时发送WebSocket ping，超过 LIVENESS_TIMEOUT 仍然没有任何响应（包括pong）
+时认为连接已经半断开（NAT超时、服务器主机重启等），主动断开并重连，期间上报改走HTTP。
+
+连接后先协商协议版本：服务器支持v2时只发送变化的字段（安装了msgpack时使用二进制编码），
+旧版服务器不认识hello时退回v1（每次变化发送完整数据）。
+
+不依赖Windows接口，可以在Linux上直接运行测试：
+    python 上报通道.py http://127.0.0.1:9999 测试员工
+"""
+import json, threading, time
+from urllib.parse import quote
+import websocket  # websocket-client  # pyright: ignore[reportMissingImports]
+
+try:
+    import msgpack  # pyright: ignore[reportMissingImports]
+except ImportError:
+    msgpack = None  # 未安装时使用JSON编码
+
+HEARTBEAT_INTERVAL = 10  # 数据没变化时的心跳间隔（秒），需小于服务器的离线判定时间（60秒）
+RECONNECT_DELAY = 3      # 断开后重连的等待时间（秒）
+CONNECT_TIMEOUT = 5      # 建立连接（含协议协商）的超时时间（秒）
+PROTOCOL_VERSION = 2     # 支持的最高协议版本
+LIVENESS_TIMEOUT = 2 * HEARTBEAT_INTERVAL  # 超过该时间（秒）没有收到服务器的任何帧（包括pong）即断开重连
+
+
+class ReportChannel:
+    def __init__(self, server_url, employee_id, on_messages=None):
+        """
+        server_url: 服务器地址，如 http://101.42.32.73:9999
+        employee_id: 员工ID
+        on_messages: 收到管理端消息时的回调，参数为消息列表 [{"message": ..., "timestamp": ...}, ...]（在通道线程中调用）
+        """
+        ws_base = server_url.replace("https://", "wss://", 1).replace("http://", "ws://", 1)
+        self.url = f"{ws_base}/ws/employee/{quote(employee_id, safe='')}"
+        self.employee_id = employee_id
+        self.on_messages = on_messages
+        self.connected = False
+        self.protocol = 1  # 协商后的协议版本
+        self.encoding = "json"  # 协商后的编码（json/msgpack）
+
+        self._ws = None
+        self._send_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._last_report = None  # 上次发送的上报数据（不含时间戳），用于判断数据是否变化
+        self._last_send_time = 0
+        self._seq = 0  # 协议v2：上次发送的序号
+        self._last_received = 0  # 最近一次收到服务器任何帧（包括pong）的时间
+
+    def start(self):
+        """启动通道线程（后台自动连接和重连）"""
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        self._close()
+
+    def send_report(self, report):
+        """发送一次上报：数据变化时发送完整数据，没变化时按心跳间隔发送心跳
+
+        返回是否已经由通道处理（未连接或发送失败时返回False，调用方应改用HTTP上报）
+        """
+        if not self.connected:
+            return False
+
+        comparable = {k: v for k, v in report.items() if k != "report_timestamp"}
+        now = time.time()
+        with self._send_lock:
+            if comparable == self._last_report:
+                if now - self._last_send_time < HEARTBEAT_INTERVAL:
+                    return True
+                frame = {"type": "heartbeat"}
+            elif self.protocol >= 2:
+                frame = self._delta_frame(comparable, report.get("report_timestamp", now))
+            else:
+                frame = {"type": "report", "data": report}
+            try:
+                self._send(frame)
+            except Exception as e:
+                print(f"[通道] 发送失败: {e}")
+                self._close()
+                return False
+            self._last_report = comparable
+            self._last_send_time = now
+        return True
+
+    def _delta_frame(self, comparable, timestamp):
+        """协议v2：只包含相对上次发送变化了的字段（没有基准时发送完整数据，base=0）
+
+        同一连接上的帧按顺序到达服务器，所以基准是上次发送（而不必等确认）的数据；
+        服务器合并失败时会回复resync，下一次改为发送完整数据。
+        """
+        if self._last_report is None:
+            base, fields = 0, dict(comparable)
+        else:
+            base = self._seq
+            fields = {k: v for k, v in comparable.items() if self._last_report.get(k) != v}
+        fields.pop("employee_name", None)
+        self._seq += 1
+        return {"type": "delta", "seq": self._seq, "base": base, "ts": timestamp, "fields": fields}
+
+    def _send(self, frame):
+        if self.encoding == "msgpack":
+            self._ws.send_binary(msgpack.packb(frame))
+        else:
+            self._ws.send(json.dumps(frame, ensure_ascii=False))
+
+    def _recv(self):
+        """读取下一条数据帧（ping/pong 只刷新 _last_received）"""
+        while True:
+            opcode, raw = self._ws.recv_data(control_frame=True)
+            self._last_received = time.time()
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                raise ConnectionError("服务器关闭了连接")
+            if opcode in (websocket.ABNF.OPCODE_PING, websocket.ABNF.OPCODE_PONG):
+                continue
+            if opcode == websocket.ABNF.OPCODE_BINARY:
+                return msgpack.unpackb(raw)
+            return json.loads(raw.decode("utf-8"))
+
+    def _negotiate(self):
+        """协商协议版本和编码（旧版服务器回复error时使用v1）
+
+        一直读取到hello或error回复为止；期间收到的管理端消息（旧版服务器连接后立即推送）交给消息回调。
+        """
+        encodings = ["msgpack", "json"] if msgpack is not None else ["json"]
+        self.protocol, self.encoding = 1, "json"
+        self._send({"type": "hello", "version": PROTOCOL_VERSION, "encodings": encodings})
+        while True:
+            reply = self._recv()
+            reply_type = reply.get("type")
+            if reply_type == "hello":
+                self.protocol = reply.get("version", 1)
+                self.encoding = reply.get("encoding", "json")
+                break
+            if reply_type == "error":
+                break
+            if reply_type == "messages" and self.on_messages:
+                self.on_messages(reply.get("messages", []))
+        print(f"[通道] 协议v{self.protocol}，编码 {self.encoding}")
+
+    def _close(self):
+        self.connected = False
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._ws = websocket.create_connection(self.url, timeout=CONNECT_TIMEOUT)
+                with self._send_lock:
+                    self._negotiate()
+                    self._last_report = None  # 重连后先上报一次完整数据
+                    self._seq = 0
+                # 协商完成后按心跳间隔等待服务器消息，超时时检查连接是否还活着（见 _receive_loop）
+                self._ws.settimeout(HEARTBEAT_INTERVAL)
+                self.connected = True
+                print(f"[通道] 已连接: {self.url}")
+                self._receive_loop()
+            except Exception as e:
+                if not self._stopped.is_set():
+                    print(f"[通道] 连接断开: {e}")
+            finally:
+                self._close()
+            self._stopped.wait(RECONNECT_DELAY)
+
+    def _receive_loop(self):
+        while not self._stopped.is_set():
+            try:
+                frame = self._recv()
+            except websocket.WebSocketTimeoutException:
+                if time.time() - self._last_received > LIVENESS_TIMEOUT:
+                    raise ConnectionError(f"{LIVENESS_TIMEOUT}秒没有收到服务器响应")
+                with self._send_lock:
+                    self._ws.ping()
+                continue
+            frame_type = frame.get("type")
+            if frame_type == "messages":
+                if self.on_messages:
+                    self.on_messages(frame.get("messages", []))
+            elif frame_type == "resync":
+                # 服务器上没有本员工的数据（例如服务器重启），下一次上报发送完整数据
+                with self._send_lock:
+                    self._last_report = None
+            elif frame_type == "ack":
+                if frame.get("status") != "ok":
+                    print(f"[通道] 上报被拒绝: {frame.get('message')}")
+            elif frame_type == "error":
+                print(f"[通道] 服务器错误: {frame.get('message')}")
+
+
+if __name__ == "__main__":
+    # 在Linux上对本地服务器测试：模拟一个员工每0.5秒上报一次，每5秒咨询量加1
+    import sys
+    from datetime import datetime, timedelta, timezone
+
+    server_url = sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:9999"
+    employee_id = sys.argv[2] if len(sys.argv) > 2 else "测试员工"
+
+    channel = ReportChannel(server_url, employee_id, on_messages=lambda messages: print(f"[消息] {messages}"))
+    channel.start()
+
+    start = time.time()
+    while True:
+        consult = int((time.time() - start) // 5)
+        report = {
+            "employee_name": employee_id,
+            "report_date": datetime.now(timezone(timedelta(hours=8))).strftime("%Y-%m-%d"),
+            "report_timestamp": time.time(),
+            "total_customers": 1,
+            "total_shops": 1,
+            "shops_list": ["测试店铺 (1)"],
+            "today_consult": consult,
+            "today_replied": consult,
+            "total_reply_time": consult * 10.0,
+            "avg_reply": 10 if consult else 0,
+            "online": True
+        }
+        if not channel.send_report(report):
+            print("[测试] 通道未连接")
+        time.sleep(0.5)
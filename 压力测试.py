@@ -0,0 +1,534 @@
+"""服务器压力测试工具
+
+模拟N个员工端（每0.5秒上报一次，同时保持 /poll_messages 长轮询）和M个管理端
+（轮询 /employees、/stats_by_employee、/monthly_daily_stats），
+输出各接口的吞吐量、p50/p99延迟，以及服务器在测试期间执行的数据库查询次数（来自 /metrics）。
+
+用法：
+    # 对已运行的服务器（连接本地PostgreSQL）测试
+    python 压力测试.py --url http://127.0.0.1:9999 --clients 200 --admins 5 --duration 60
+
+    # 启动一个使用空数据库替身的本地服务器进程再测试（不需要PostgreSQL，只测服务器自身开销）
+    python 压力测试.py --null-db --clients 200 --admins 5 --duration 60
+
+    # 员工端改用持久通道（WebSocket，协议v2）上报
+    python 压力测试.py --null-db --clients 200 --transport ws
+
+    # 批量配置写入：分别保存10/100/300个员工的排序、颜色、可见性，比较每次保存的数据库查询次数
+    python 压力测试.py --null-db --bulk 10,100,300
+
+    # 查询计划检查：在单独的数据库中建表、写入500个员工×3年的数据，
+    # 用 EXPLAIN ANALYZE 检查 /employees、/stats_by_employee、/monthly_daily_stats 对 daily_stats 只做仅索引扫描
+    python 压力测试.py --explain --db-name qn_stats_explain
+
+依赖：aiohttp（pip install aiohttp）；--null-db、--explain 还需要服务器端依赖（fastapi、uvicorn、asyncpg）。
+"""
+import argparse, asyncio, json, os, random, subprocess, sys, time
+from datetime import datetime, timedelta, timezone
+import aiohttp  # pyright: ignore[reportMissingImports]
+
+BEIJING_TZ = timezone(timedelta(hours=8))
+REPORT_INTERVAL = 0.5  # 与员工端一致
+ADMIN_INTERVAL = 0.5  # 与管理端实时表格一致
+ADMIN_CHART_EVERY = 20  # 管理端每轮询20次 /employees 查询一次图表接口（模拟查看历史统计）
+SHOP_NAMES = ["旗舰店", "专营店", "官方店", "折扣店", "精品店", "工厂店", "企业店", "海外店"]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LatencyStats:
+    """按接口统计请求数、错误数和延迟"""
+
+    def __init__(self):
+        self.samples = {}  # {接口: [延迟秒数, ...]}
+        self.errors = {}  # {接口: 错误数}
+
+    def record(self, name, seconds):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def error(self, name):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def print_summary(self, duration):
+        print(f"\n{'接口':<28}{'请求数':>8}{'吞吐(次/秒)':>12}{'p50(ms)':>10}{'p99(ms)':>10}{'最大(ms)':>10}{'错误':>8}")
+        for name in sorted(set(self.samples) | set(self.errors)):
+            values = sorted(self.samples.get(name, []))
+            print(
+                f"{name:<28}{len(values):>8}{len(values) / duration:>12.1f}"
+                f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 99) * 1000:>10.1f}"
+                f"{(values[-1] if values else 0) * 1000:>10.1f}{self.errors.get(name, 0):>8}"
+            )
+
+
+class SimulatedEmployee:
+    """模拟一个员工端：店铺、排队顾客和今日统计，生成与员工端格式一致的上报数据"""
+
+    def __init__(self, index):
+        self.employee_id = f"压测员工{index:04d}"
+        self.shops = random.sample(SHOP_NAMES, random.randint(1, 4))
+        self.waiting = {shop: [] for shop in self.shops}  # {店铺: [顾客进入时间, ...]}
+        self.today_consult = 0
+        self.today_replied = 0
+        self.total_reply_time = 0.0
+
+    def tick(self, now):
+        """推进一次：随机来新顾客（咨询数+1）、回复顾客（回复数+1）"""
+        for shop, customers in self.waiting.items():
+            if random.random() < 0.02:
+                customers.append(now)
+                self.today_consult += 1
+            if customers and random.random() < 0.05:
+                self.today_replied += 1
+                self.total_reply_time += now - customers.pop(0)
+
+    def build_report(self, now):
+        # 店铺列表与员工端 build_display_lines 的格式一致：等待秒数每秒都在变化
+        shops_list = []
+        for shop in sorted(self.shops):
+            waits = sorted((int(now - t) for t in self.waiting[shop]), reverse=True)
+            if waits:
+                lines = [f"{shop}-{waits[0]}秒"] + [" " * len(shop) + f"-{w}秒" for w in waits[1:8]]
+                shops_list.append("\n".join(lines))
+            else:
+                shops_list.append(shop)
+        return {
+            "employee_name": self.employee_id,
+            "report_date": datetime.now(BEIJING_TZ).strftime("%Y-%m-%d"),
+            "report_timestamp": now,
+            "total_customers": sum(len(c) for c in self.waiting.values()),
+            "total_shops": len(self.shops),
+            "shops_list": shops_list,
+            "today_consult": self.today_consult,
+            "today_replied": self.today_replied,
+            "total_reply_time": self.total_reply_time,
+            "avg_reply": round(self.total_reply_time / self.today_replied) if self.today_replied else 0,
+            "online": True
+        }
+
+
+async def timed_request(session, stats, name, method, url, **kwargs):
+    """发送一次请求并记录延迟，返回响应（状态码和JSON/None）"""
+    start = time.perf_counter()
+    try:
+        async with session.request(method, url, **kwargs) as resp:
+            body = await resp.read()
+            if resp.status >= 400:
+                stats.error(name)
+                return resp.status, None, resp.headers
+            stats.record(name, time.perf_counter() - start)
+            return resp.status, body, resp.headers
+    except Exception:
+        stats.error(name)
+        return None, None, {}
+
+
+async def run_employee_http(session, base_url, employee, stats, stop_at):
+    await asyncio.sleep(random.random() * REPORT_INTERVAL)  # 错开各员工的上报时刻
+    next_tick = time.monotonic()
+    while time.time() < stop_at:
+        now = time.time()
+        employee.tick(now)
+        await timed_request(session, stats, "POST /report", "POST", f"{base_url}/report", json=employee.build_report(now))
+        next_tick += REPORT_INTERVAL
+        await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+
+
+async def run_employee_ws(session, base_url, employee, stats, stop_at):
+    """持久通道（协议v2，JSON编码）：数据变化时发送变化的字段，否则每10秒一次心跳；按ack统计延迟"""
+    await asyncio.sleep(random.random() * REPORT_INTERVAL)
+    ws_url = base_url.replace("http://", "ws://", 1) + f"/ws/employee/{employee.employee_id}"
+    try:
+        ws = await session.ws_connect(ws_url)
+    except Exception:
+        stats.error("WS connect")
+        return
+    pending = {}  # {seq: 发送时间}
+
+    async def receive_acks():
+        async for msg in ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            frame = json.loads(msg.data)
+            if frame.get("type") == "ack" and frame.get("seq") in pending:
+                stats.record("WS report->ack", time.perf_counter() - pending.pop(frame["seq"]))
+            elif frame.get("type") == "resync":
+                last_sent.clear()
+
+    await ws.send_json({"type": "hello", "version": 2, "encodings": ["json"]})
+    await ws.receive()  # hello回复
+    receiver = asyncio.create_task(receive_acks())
+    last_sent = {}
+    seq = 0
+    last_send_time = 0
+    next_tick = time.monotonic()
+    try:
+        while time.time() < stop_at:
+            now = time.time()
+            employee.tick(now)
+            report = employee.build_report(now)
+            report.pop("report_timestamp")
+            report.pop("employee_name")
+            fields = {k: v for k, v in report.items() if last_sent.get(k) != v}
+            if fields:
+                base = seq if last_sent else 0
+                seq += 1
+                pending[seq] = time.perf_counter()
+                await ws.send_json({"type": "delta", "seq": seq, "base": base, "ts": now, "fields": fields if base else report})
+                last_sent = report
+                last_send_time = now
+                stats.record("WS delta frames", 0)
+            elif now - last_send_time >= 10:
+                await ws.send_json({"type": "heartbeat"})
+                last_send_time = now
+                stats.record("WS heartbeats", 0)
+            next_tick += REPORT_INTERVAL
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+    except Exception:
+        stats.error("WS send")
+    finally:
+        receiver.cancel()
+        await ws.close()
+
+
+async def hold_long_poll(session, base_url, employee, stats, stop_at):
+    """保持 /poll_messages 长轮询（服务器最多挂起30秒）"""
+    while time.time() < stop_at:
+        await timed_request(
+            session, stats, "GET /poll_messages", "GET", f"{base_url}/poll_messages/{employee.employee_id}",
+            timeout=aiohttp.ClientTimeout(total=35)
+        )
+
+
+async def run_admin(session, base_url, stats, stop_at):
+    today = datetime.now(BEIJING_TZ)
+    etag = None
+    polls = 0
+    next_tick = time.monotonic()
+    while time.time() < stop_at:
+        headers = {"If-None-Match": etag} if etag else {}
+        status, _, resp_headers = await timed_request(session, stats, "GET /employees", "GET", f"{base_url}/employees", headers=headers)
+        if status in (200, 304):
+            etag = resp_headers.get("ETag", etag)
+        polls += 1
+        if polls % ADMIN_CHART_EVERY == 0:
+            period = random.choice(["day", "week", "month"])
+            await timed_request(session, stats, "GET /stats_by_employee", "GET", f"{base_url}/stats_by_employee", params={"period": period})
+            await timed_request(
+                session, stats, "GET /monthly_daily_stats", "GET", f"{base_url}/monthly_daily_stats",
+                params={"year": today.year, "month": today.month}
+            )
+        next_tick += ADMIN_INTERVAL
+        await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+
+
+async def fetch_metrics(session, base_url):
+    try:
+        async with session.get(f"{base_url}/metrics") as resp:
+            return await resp.json() if resp.status == 200 else None
+    except Exception:
+        return None
+
+
+async def run_benchmark(args):
+    stats = LatencyStats()
+    connector = aiohttp.TCPConnector(limit=0)  # 每个模拟客户端都需要自己的连接
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        before = await fetch_metrics(session, args.url)
+        if before is None:
+            print(f"[压测] 无法读取 {args.url}/metrics，将不统计数据库查询次数")
+
+        employees = [SimulatedEmployee(i) for i in range(args.clients)]
+        start = time.time()
+        stop_at = start + args.duration
+        run_employee = run_employee_ws if args.transport == "ws" else run_employee_http
+        tasks = [asyncio.create_task(run_employee(session, args.url, e, stats, stop_at)) for e in employees]
+        if not args.no_long_poll and args.transport == "http":
+            tasks += [asyncio.create_task(hold_long_poll(session, args.url, e, stats, stop_at)) for e in employees]
+        tasks += [asyncio.create_task(run_admin(session, args.url, stats, stop_at)) for _ in range(args.admins)]
+        print(f"[压测] {args.clients} 个员工端（{args.transport}），{args.admins} 个管理端，持续 {args.duration} 秒...")
+
+        # 长轮询最多挂起30秒，测试时间到后不再等待
+        await asyncio.wait(tasks, timeout=args.duration + 5)
+        for task in tasks:
+            task.cancel()
+        duration = time.time() - start
+        after = await fetch_metrics(session, args.url)
+
+    stats.print_summary(duration)
+    if before and after:
+        queries = after["db_queries"] - before["db_queries"]
+        reports = len(stats.samples.get("POST /report", [])) + len(stats.samples.get("WS delta frames", []))
+        print(f"\n数据库查询: {queries} 次（{queries / duration:.1f} 次/秒"
+              + (f"，每次上报 {queries / reports:.3f} 次" if reports else "") + "）")
+        print(f"上报写库/跳过: {after['reports_persisted'] - before['reports_persisted']}"
+              f" / {after['reports_skipped'] - before['reports_skipped']}，"
+              f"写缓冲刷新 {after['buffer_flushes'] - before['buffer_flushes']} 次，"
+              f"快照重建 {after['snapshot_rebuilds'] - before['snapshot_rebuilds']} 次")
+        by_before = before["db_queries_by_statement"]
+        top = sorted(
+            ((count - by_before.get(sql, 0), sql) for sql, count in after["db_queries_by_statement"].items()),
+            reverse=True
+        )[:10]
+        print("查询次数最多的语句:")
+        for count, sql in top:
+            if count > 0:
+                print(f"  {count:>8}  {sql}")
+
+
+async def run_bulk_benchmark(args):
+    """批量配置写入接口的数据库查询次数（应与员工数量无关）
+
+    注意：会覆盖服务器上 bulk-* 测试员工的排序、颜色和可见性配置
+    """
+    sizes = [int(size) for size in args.bulk.split(",")]
+    endpoints = [
+        ("save_employee_order", lambda ids: {"orders": [{"employee_id": eid, "order": i} for i, eid in enumerate(ids)]}),
+        ("save_color_configs", lambda ids: {"colors": [{"employee_id": eid, "bar_color": "#4CAF50"} for eid in ids]}),
+        ("employee_visibility", lambda ids: {"visibility": [{"employee_id": eid, "hidden": False, "is_manual": False} for eid in ids]}),
+    ]
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+        if await fetch_metrics(session, args.url) is None:
+            raise SystemExit(f"[批量写入] 无法读取 {args.url}/metrics")
+        print(f"{'接口':<24}{'员工数':>8}{'查询次数':>10}{'影响行数':>10}{'耗时(ms)':>10}")
+        for size in sizes:
+            ids = [f"bulk-{i:04d}" for i in range(size)]
+            for path, build in endpoints:
+                before = await fetch_metrics(session, args.url)
+                started = time.perf_counter()
+                async with session.post(f"{args.url}/{path}", json=build(ids)) as resp:
+                    body = await resp.json() if resp.status == 200 else {}
+                elapsed = (time.perf_counter() - started) * 1000
+                after = await fetch_metrics(session, args.url)
+                queries = after["db_queries"] - before["db_queries"]
+                print(f"{path:<24}{size:>8}{queries:>10}{body.get('affected', '-'):>10}{elapsed:>10.1f}")
+
+
+class NullConnection:
+    """空数据库连接替身：记录查询次数，所有查询返回空结果"""
+
+    def __init__(self, count_query):
+        self._count_query = count_query
+
+    async def execute(self, query, *args):
+        self._count_query(query)
+        return "OK"
+
+    async def executemany(self, query, args):
+        self._count_query(query)
+
+    async def fetch(self, query, *args):
+        self._count_query(query)
+        return []
+
+    async def fetchrow(self, query, *args):
+        self._count_query(query)
+        return None
+
+    async def fetchval(self, query, *args):
+        self._count_query(query)
+        return None
+
+    def transaction(self):
+        return NullContext(None)
+
+
+class NullContext:
+    def __init__(self, value):
+        self._value = value
+
+    async def __aenter__(self):
+        return self._value
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class NullPool:
+    def __init__(self, count_query):
+        self._conn = NullConnection(count_query)
+
+    def acquire(self):
+        return NullContext(self._conn)
+
+    async def close(self):
+        pass
+
+
+def serve_with_null_db(port):
+    """在当前进程中运行服务器，数据库连接池替换为空替身（由 --null-db 在子进程中调用）"""
+    import importlib
+    import uvicorn  # pyright: ignore[reportMissingImports]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ["QN_LIVE_STATE_BACKEND"] = "memory"
+    server = importlib.import_module("服务器")
+
+    async def init_null_db():
+        server.db_pool = NullPool(server.count_db_query)
+
+    server.init_db = init_null_db
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def find_table_scans(plan, table_prefix):
+    """在EXPLAIN (FORMAT JSON)的计划树中找出扫描指定表（含分区）的节点"""
+    nodes = []
+    if plan.get("Relation Name", "").startswith(table_prefix):
+        nodes.append(plan)
+    for child in plan.get("Plans", []):
+        nodes.extend(find_table_scans(child, table_prefix))
+    return nodes
+
+
+async def run_explain_audit(args):
+    """查询计划检查：确认各接口查询 daily_stats 时使用仅索引扫描（Index Only Scan）"""
+    import importlib
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ["QN_LIVE_STATE_BACKEND"] = "memory"
+    server = importlib.import_module("服务器")
+
+    if args.db_name == server.DB_CONFIG["database"]:
+        raise SystemExit(f"[查询计划] 会清空 daily_stats，不能使用正式数据库 {args.db_name}，请指定其他 --db-name")
+    server.DB_CONFIG = {**server.DB_CONFIG, "database": args.db_name}
+    if args.db_host:
+        server.DB_CONFIG["host"] = args.db_host
+    if args.db_password:
+        server.DB_CONFIG["password"] = args.db_password
+
+    # 记录各接口执行的查询（语句和参数）
+    captured = []
+    count_query = server.log_db_query
+    def capture_query(record):
+        count_query(record)
+        captured.append((record.query, record.args))
+    server.log_db_query = capture_query
+
+    await server.init_db()
+    pool = server.db_pool
+    today = server.get_beijing_today()
+    first_day = today - timedelta(days=365 * 3)
+    async with pool.acquire() as conn:
+        print(f"[查询计划] 写入测试数据：{args.seed_employees} 个员工 × {(today - first_day).days + 1} 天...")
+        # 写入期间去掉汇总触发器，写完后由 init_rollups 重新创建并回填
+        await conn.execute('DROP TRIGGER IF EXISTS daily_stats_rollup_insert_delete ON daily_stats')
+        await conn.execute('DROP TRIGGER IF EXISTS daily_stats_rollup_change ON daily_stats')
+        await conn.execute('TRUNCATE daily_stats')
+        await server.ensure_partitions(conn, first_day)
+        await conn.execute('''
+            INSERT INTO daily_stats (employee_id, date, total_consultations, replied_count, total_reply_time, avg_reply)
+            SELECT 'employee_' || e, d::date, c, c, c * r, r
+            FROM generate_series(1, $1) e,
+                 generate_series($2::date, $3::date, interval '1 day') d,
+                 LATERAL (SELECT (random() * 200)::int AS c, (random() * 60)::real AS r) v
+        ''', args.seed_employees, first_day, today)
+        await server.init_rollups(conn)
+        # 更新可见性映射和统计信息，仅索引扫描才不需要回表
+        await conn.execute('VACUUM ANALYZE daily_stats')
+        await conn.execute('VACUUM ANALYZE employee_weekly_stats')
+        await conn.execute('VACUUM ANALYZE employee_monthly_stats')
+
+    checks = [
+        ("/employees", lambda: server.employee_snapshot.get()),
+        ("/stats_by_employee?period=week", lambda: server.get_stats_by_employee(period="week", start=None, end=None)),
+        ("/stats_by_employee?period=month", lambda: server.get_stats_by_employee(period="month", start=None, end=None)),
+        ("/stats_by_employee?period=custom（3年）", lambda: server.get_stats_by_employee(
+            period="custom", start=str(first_day + timedelta(days=3)), end=str(today - timedelta(days=3)))),
+        ("/monthly_daily_stats", lambda: server.get_monthly_daily_stats(year=today.year, month=today.month)),
+    ]
+    failures = 0
+    async with pool.acquire() as conn:
+        for name, call in checks:
+            captured.clear()
+            await call()
+            queries = [(q, a) for q, a in captured if "daily_stats" in q]
+            if not queries:
+                print(f"✗ {name}: 没有捕获到查询 daily_stats 的语句")
+                failures += 1
+                continue
+            for query, query_args in queries:
+                plan = json.loads(await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", *query_args))[0]
+                scans = find_table_scans(plan["Plan"], "daily_stats")
+                bad = [n for n in scans if n["Node Type"] != "Index Only Scan"]
+                detail = ", ".join(
+                    f"{n['Node Type']}({n.get('Index Name', '-')}, 回表 {n.get('Heap Fetches', 0)})" for n in scans
+                )
+                mark = "✗" if bad else "✓"
+                print(f"{mark} {name}: {plan['Execution Time']:.2f} ms  {detail}")
+                failures += bool(bad)
+    await pool.close()
+    if failures:
+        raise SystemExit(f"[查询计划] {failures} 个查询没有使用仅索引扫描")
+    print("[查询计划] 全部通过")
+
+
+def start_null_db_server(port, verbose):
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve-null-db", "--port", str(port)],
+        stdout=None if verbose else subprocess.DEVNULL,
+        stderr=None if verbose else subprocess.DEVNULL
+    )
+
+    async def wait_ready():
+        async with aiohttp.ClientSession() as session:
+            for _ in range(100):
+                try:
+                    async with session.get(f"http://127.0.0.1:{port}/") as resp:
+                        if resp.status == 200:
+                            return True
+                except Exception:
+                    pass
+                await asyncio.sleep(0.2)
+        return False
+
+    if not asyncio.run(wait_ready()):
+        process.kill()
+        raise SystemExit("[压测] 空数据库替身服务器启动失败（使用 --verbose 查看输出）")
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="客服监控服务器压力测试")
+    parser.add_argument("--url", default="http://127.0.0.1:9999", help="服务器地址")
+    parser.add_argument("--clients", type=int, default=100, help="模拟员工端数量")
+    parser.add_argument("--admins", type=int, default=3, help="模拟管理端数量")
+    parser.add_argument("--duration", type=float, default=30, help="测试时长（秒）")
+    parser.add_argument("--transport", choices=["http", "ws"], default="http", help="员工端上报方式")
+    parser.add_argument("--no-long-poll", action="store_true", help="员工端不保持 /poll_messages 长轮询")
+    parser.add_argument("--null-db", action="store_true", help="启动使用空数据库替身的本地服务器进行测试")
+    parser.add_argument("--port", type=int, default=19999, help="--null-db 时本地服务器端口")
+    parser.add_argument("--verbose", action="store_true", help="显示本地服务器输出")
+    parser.add_argument("--explain", action="store_true", help="写入测试数据并检查接口查询的执行计划")
+    parser.add_argument("--db-name", default="qn_stats_explain", help="--explain 使用的数据库（会清空其中的数据）")
+    parser.add_argument("--db-host", default=None, help="--explain 数据库地址（默认与服务器配置相同）")
+    parser.add_argument("--db-password", default=None, help="--explain 数据库密码（默认与服务器配置相同）")
+    parser.add_argument("--seed-employees", type=int, default=500, help="--explain 写入的员工数量")
+    parser.add_argument("--bulk", default=None, help="测试批量配置写入接口，参数为逗号分隔的员工数量，如 10,100,300")
+    parser.add_argument("--serve-null-db", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_null_db:
+        serve_with_null_db(args.port)
+        return
+    if args.explain:
+        asyncio.run(run_explain_audit(args))
+        return
+
+    process = None
+    if args.null_db:
+        process = start_null_db_server(args.port, args.verbose)
+        args.url = f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(run_bulk_benchmark(args) if args.bulk else run_benchmark(args))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ from PyQt5.QtWidgets import (  # pyright: ignore[reportMissingImports]
 )
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QEvent  # pyright: ignore[reportMissingImports]
 from PyQt5.QtGui import QIcon, QFont, QPixmap, QPainter, QColor  # pyright: ignore[reportMissingImports]
+from 上报通道 import ReportChannel
 
 SCAN_INTERVAL = 0.1     # 扫描间隔：0.1秒
 REPORT_INTERVAL = 0.5   # 上报间隔：0.5秒
@@ -20,6 +21,8 @@ EMPLOYEE_NAME = socket.gethostname()
 
 # 修复5：全局变量，用于判断是否成功连接到服务器
 last_report_success = False
+report_channel = None  # 持久通道（上报+接收消息），未连接时改用HTTP上报和长轮询
+http_session = requests.Session()  # HTTP后备上报复用连接
 
 # 北京时区（UTC+8）
 BEIJING_TZ = timezone(timedelta(hours=8))
@@ -348,8 +351,12 @@ def report_to_server():
         "online": True
     }
     global last_report_success
+    # 优先使用持久通道（数据没变化时只发送心跳）
+    if report_channel and report_channel.send_report(report):
+        last_report_success = True
+        return
     try:
-        resp = requests.post(f"{SERVER_URL}/report", json=report, timeout=2)
+        resp = http_session.post(f"{SERVER_URL}/report", json=report, timeout=2)
         if resp.status_code == 200:
             # 修复5：成功上报后设置连接状态
             last_report_success = True
@@ -672,8 +679,20 @@ class EmployeeMonitorGUI(QMainWindow):
             event.ignore()
     
 
+def show_messages(messages):
+    """显示管理端发送的消息（长轮询和持久通道共用）"""
+    if messages:
+        print(f"[消息轮询] 收到 {len(messages)} 条消息")
+    for msg_data in messages:
+        message = msg_data.get("message", "")
+        if message:
+            print(f"[消息] {message[:50]}...")
+            # 修复6：使用信号在主线程中显示弹窗，避免崩溃
+            if gui_instance:
+                gui_instance.show_message_signal.emit(message)
+
 def poll_messages_loop():
-    """长轮询线程，定期查询消息"""
+    """长轮询线程，定期查询消息（持久通道连接时由通道接收消息，这里暂停）"""
     global gui_instance
     print(f"[消息轮询] 已启动，员工ID: {EMPLOYEE_NAME}")
     
@@ -682,6 +701,9 @@ def poll_messages_loop():
         time.sleep(0.5)
     
     while True:
+        if report_channel and report_channel.connected:
+            time.sleep(1)
+            continue
         try:
             resp = requests.get(
                 f"{SERVER_URL}/poll_messages/{EMPLOYEE_NAME}",
@@ -689,16 +711,7 @@ def poll_messages_loop():
             )
             if resp.status_code == 200:
                 data = resp.json()
-                messages = data.get("messages", [])
-                if messages:
-                    print(f"[消息轮询] 收到 {len(messages)} 条消息")
-                    for msg_data in messages:
-                        message = msg_data.get("message", "")
-                        if message:
-                            print(f"[消息] {message[:50]}...")
-                            # 修复6：使用信号在主线程中显示弹窗，避免崩溃
-                            if gui_instance:
-                                gui_instance.show_message_signal.emit(message)
+                show_messages(data.get("messages", []))
         except requests.exceptions.Timeout:
             # 超时是正常的，继续轮询
             pass
@@ -743,6 +756,10 @@ if __name__ == "__main__":
     # 启动时从服务器加载统计数据
     load_stats_from_server()
     
+    # 建立持久通道（上报和接收消息），断开时自动重连
+    report_channel = ReportChannel(SERVER_URL, EMPLOYEE_NAME, on_messages=show_messages)
+    report_channel.start()
+    
     # 启动后台监控线程
     threading.Thread(target=main_loop, daemon=True).start()
     
@@ -1,16 +1,25 @@
-from fastapi import FastAPI, HTTPException, Query  # pyright: ignore[reportMissingImports]
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect  # pyright: ignore[reportMissingImports]
 from fastapi.middleware.cors import CORSMiddleware  # pyright: ignore[reportMissingImports]
+from fastapi.responses import StreamingResponse  # pyright: ignore[reportMissingImports]
 from pydantic import BaseModel  # pyright: ignore[reportMissingImports]
 from typing import Optional, List
 from contextlib import asynccontextmanager
 import asyncpg  # pyright: ignore[reportMissingImports]
-import threading
 import time
 from datetime import datetime, timedelta, timezone
 import asyncio
+import heapq
+import hashlib
+from abc import ABC, abstractmethod
 import signal
+import json
 import os
 
+try:
+    import msgpack  # pyright: ignore[reportMissingImports]
+except ImportError:
+    msgpack = None  # 未安装时员工端通道只使用JSON编码
+
 # 北京时区（UTC+8）
 BEIJING_TZ = timezone(timedelta(hours=8))
 
@@ -33,14 +42,646 @@ DB_CONFIG = {
 
 # 连接池
 db_pool: Optional[asyncpg.Pool] = None
-active_employees = {}
-active_employees_lock = threading.Lock()  # 线程锁保护active_employees
+DB_POOL_MIN_SIZE = int(os.environ.get("QN_DB_POOL_MIN_SIZE", "5"))
+DB_POOL_MAX_SIZE = int(os.environ.get("QN_DB_POOL_MAX_SIZE", "20"))
+
+# 员工超过该时间（秒）没有上报即视为离线
+ONLINE_TIMEOUT = 60
+
+# 实时状态后端：memory=进程内存（只能单进程运行），postgres=数据库共享（可以多个uvicorn worker）
+LIVE_STATE_BACKEND = os.environ.get("QN_LIVE_STATE_BACKEND", "memory")
+
+# 监听连接断开（例如数据库重启）后，每隔多少秒尝试重连一次
+LISTEN_RECONNECT_DELAY = float(os.environ.get("QN_LISTEN_RECONNECT_DELAY", "3"))
+
+class ListenConnection:
+    """LISTEN 专用的独占数据库连接（连接池中的连接归还时会被重置，监听也会丢失）
+
+    连接断开后自动重连并重新 LISTEN；断开期间的通知已经丢失，重连成功后调用 on_reconnect 让使用方自行补偿。
+    """
+
+    def __init__(self, listeners, on_reconnect=None):
+        self.listeners = listeners  # {channel: callback}
+        self.on_reconnect = on_reconnect
+        self.conn = None
+        self._stopped = False
+        self._reconnect_task = None
+
+    async def start(self):
+        self._stopped = False
+        await self._connect()
+
+    async def stop(self):
+        self._stopped = True
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        if self.conn:
+            conn, self.conn = self.conn, None
+            await conn.close()
+
+    async def _connect(self):
+        conn = await asyncpg.connect(**DB_CONFIG)
+        try:
+            for channel, callback in self.listeners.items():
+                await conn.add_listener(channel, callback)
+        except Exception:
+            await conn.close()
+            raise
+        conn.add_termination_listener(self._on_terminated)
+        self.conn = conn
+
+    def _on_terminated(self, connection):
+        # stop() 主动关闭时 self.conn 已经置空，不需要重连
+        if self._stopped or connection is not self.conn:
+            return
+        self.conn = None
+        print(f"[LISTEN] 监听连接已断开，{LISTEN_RECONNECT_DELAY}秒后重连: {', '.join(self.listeners)}")
+        self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while not self._stopped:
+            await asyncio.sleep(LISTEN_RECONNECT_DELAY)
+            try:
+                await self._connect()
+            except Exception as e:
+                print(f"[LISTEN] 重连失败: {e}")
+                continue
+            self._reconnect_task = None
+            print(f"[LISTEN] 监听连接已恢复: {', '.join(self.listeners)}")
+            if self.on_reconnect:
+                self.on_reconnect()
+            return
+
+class LiveStateStore(ABC):
+    """实时状态存储接口：员工在线状态、实时统计和消息队列
+
+    /report、/employees、/poll_messages 等接口只通过这些方法访问实时状态，
+    具体实现见 MemoryLiveState（进程内存）和 PostgresLiveState（多进程共享）。
+
+    version 在员工数据、在线状态或显示名称发生变化时递增，/employees 的快照缓存据此判断是否需要重建。
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.message_events = {}  # {employee_id: asyncio.Event()}，本进程内等待中的长轮询
+        self._change_event = asyncio.Event()  # version 变化时唤醒推送流
+
+    def _bump(self):
+        self.version += 1
+        # 唤醒所有等待中的推送流，再换一个新的事件给下一轮等待
+        self._change_event.set()
+        self._change_event = asyncio.Event()
+
+    async def wait_change(self, version, timeout):
+        """等待 version 不再等于给定值（最多等待timeout秒），返回是否发生了变化"""
+        if self.version != version:
+            return True
+        try:
+            await asyncio.wait_for(self._change_event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def notify_change(self):
+        """通知实时数据已变化（改名、删除员工、清空数据等不经过上报的修改）"""
+        self._bump()
+
+    def mark_changed(self):
+        """只在本进程内递增版本号（其他进程会通过各自收到的通知得知变化）"""
+        self._bump()
+
+    async def start(self):
+        """启动（数据库连接池创建之后调用）"""
+
+    async def stop(self):
+        """关闭"""
+
+    async def claim_rollover(self, current_date):
+        """跨天时争取执行数据库清理的权利（多进程时只需要一个进程执行），返回是否由本进程执行"""
+        return True
+
+    async def release_rollover(self, current_date):
+        """数据库清理失败时释放执行权（清理成功后才算真正完成）"""
+
+    @abstractmethod
+    async def record_report(self, name, record, now):
+        """保存员工上报的数据并刷新在线时间，返回数据是否发生了变化"""
+
+    @abstractmethod
+    async def touch(self, name, now):
+        """心跳：只刷新员工的 last_seen，返回服务器上是否还有该员工的数据（没有时需要重新上报完整数据）"""
+
+    @abstractmethod
+    async def snapshot(self):
+        """返回 {employee_id: record} 形式的全部实时数据"""
+
+    @abstractmethod
+    async def next_expiry(self):
+        """最早一个在线员工超时离线的时间（没有在线员工时返回None）"""
+
+    @abstractmethod
+    async def remove_inactive(self, now, timeout=ONLINE_TIMEOUT):
+        """清理超过 timeout 秒没有上报的员工，返回被清理的员工ID列表"""
+
+    @abstractmethod
+    async def reset_daily(self, current_date):
+        """跨天时清空实时数据"""
+
+    @abstractmethod
+    async def clear_today(self):
+        """手动清空今日实时数据"""
+
+    @abstractmethod
+    async def push_message(self, employee_id, message):
+        """给员工发送一条消息（唤醒等待中的长轮询）"""
+
+    @abstractmethod
+    async def pop_messages(self, employee_id):
+        """取出员工的所有待处理消息"""
+
+    @abstractmethod
+    async def requeue_messages(self, employee_id, messages):
+        """把取出后没能送达的消息放回队列最前面（保留原来的时间戳），下次连接或长轮询时重新发送"""
+
+    async def wait_messages(self, employee_id, timeout):
+        """等待员工的消息（有消息立即返回，否则最多等待timeout秒）"""
+        # 先清除事件再取消息：取消息期间（pop_messages 可能有 await 点）到达的消息会重新 set 事件，不会被漏掉
+        event = self.message_events.get(employee_id)
+        if event is None:
+            event = self.message_events[employee_id] = asyncio.Event()
+        event.clear()
+        messages = await self.pop_messages(employee_id)
+        if messages:
+            return messages
+
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return []
+        return await self.pop_messages(employee_id)
+
+class MemoryLiveState(LiveStateStore):
+    """进程内存中的实时状态（默认后端，只能单进程运行）
+
+    所有方法都只在事件循环中调用（后台任务也是asyncio任务，不再使用线程），
+    方法内部没有 await 点，天然是原子的，因此不需要任何线程锁，处理请求时不会阻塞事件循环。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.employees = {}  # {employee_id: {"employee_name": ..., "today_consult": ..., "last_seen": ...}}
+        # 超时堆 [(last_seen, employee_id)]：每次上报压入一条，旧条目不删除，出堆时和员工当前的 last_seen 比较（惰性删除）
+        self._expiry_heap = []
+        # 消息推送系统（实时消息，不存储历史）
+        self.messages = {}  # {employee_id: [{"message": "xxx", "timestamp": xxx}, ...]}
+
+    async def record_report(self, name, record, now):
+        """记录一次上报，返回数据是否发生变化
+
+        数据没变化时（心跳）只刷新 last_seen
+        """
+        previous = self.employees.get(name)
+        data_changed = previous is None or any(previous.get(k) != v for k, v in record.items())
+        if data_changed:
+            self.employees[name] = {
+                "employee_name": name,
+                **record,
+                "online": True,
+                "last_seen": now,
+                "data_changed": True
+            }
+            self._bump()
+        else:
+            previous["last_seen"] = now
+            previous["data_changed"] = False
+        self._track(name, now)
+        return data_changed
+
+    async def touch(self, name, now):
+        data = self.employees.get(name)
+        if data is None:
+            return False
+        data["last_seen"] = now
+        self._track(name, now)
+        return True
+
+    def _track(self, name, last_seen):
+        """记录员工新的 last_seen（O(log n)）"""
+        heapq.heappush(self._expiry_heap, (last_seen, name))
+        # 过期条目太多时按当前数据重建，避免堆随上报次数无限增长
+        if len(self._expiry_heap) > 4 * len(self.employees) + 64:
+            self._expiry_heap = [(data["last_seen"], eid) for eid, data in self.employees.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def _earliest(self):
+        """丢弃堆顶的过期条目，返回当前最早的 (last_seen, employee_id)（没有员工时返回None）"""
+        heap = self._expiry_heap
+        while heap:
+            last_seen, eid = heap[0]
+            data = self.employees.get(eid)
+            if data is not None and data["last_seen"] == last_seen:
+                return heap[0]
+            heapq.heappop(heap)
+        return None
+
+    async def snapshot(self):
+        """获取所有活跃员工数据的副本"""
+        return {eid: dict(data) for eid, data in self.employees.items()}
+
+    async def next_expiry(self):
+        earliest = self._earliest()
+        return earliest[0] + ONLINE_TIMEOUT if earliest else None
+
+    async def remove_inactive(self, now, timeout=ONLINE_TIMEOUT):
+        """清理超时未上报的员工（只查看堆顶，不扫描所有员工），返回被清理的员工ID列表"""
+        inactive = []
+        while (earliest := self._earliest()) and now - earliest[0] >= timeout:
+            heapq.heappop(self._expiry_heap)
+            del self.employees[earliest[1]]
+            inactive.append(earliest[1])
+        if inactive:
+            self._bump()
+        return inactive
+
+    async def reset_daily(self, current_date):
+        """跨天：清空当天的咨询数据和平均回复，保留其他数据（客户数、店铺数等）
+
+        返回 {employee_id: (旧日期, 旧咨询数)}，用于日志
+        """
+        archived = {}
+        for eid, data in self.employees.items():
+            archived[eid] = (data.get("date"), data.get("today_consult", 0))
+            data["date"] = str(current_date)
+            data["today_consult"] = 0
+            data["today_replied"] = 0
+            data["total_reply_time"] = 0.0
+            data["avg_reply"] = 0
+        self._bump()
+        return archived
+
+    async def clear_today(self):
+        """手动清空所有员工的当天统计数据，返回 (有数据被清空的员工数, 员工总数)"""
+        cleared_count = 0
+        for data in self.employees.values():
+            if data.get("today_consult", 0) > 0 or data.get("avg_reply", 0) > 0:
+                cleared_count += 1
+            data["today_consult"] = 0
+            data["today_replied"] = 0
+            data["total_reply_time"] = 0.0
+            data["avg_reply"] = 0
+        self._bump()
+        return cleared_count, len(self.employees)
+
+    async def push_message(self, employee_id, message):
+        """把消息放入员工的待处理队列，并唤醒长轮询"""
+        self.messages.setdefault(employee_id, []).append({
+            "message": message,
+            "timestamp": time.time()
+        })
+        event = self.message_events.get(employee_id)
+        if event:
+            event.set()
+
+    async def pop_messages(self, employee_id):
+        """取出员工的所有待处理消息"""
+        return self.messages.pop(employee_id, None) or []
+
+    async def requeue_messages(self, employee_id, messages):
+        self.messages[employee_id] = list(messages) + self.messages.get(employee_id, [])
+        event = self.message_events.get(employee_id)
+        if event:
+            event.set()
+
+class PostgresLiveState(LiveStateStore):
+    """数据库共享的实时状态（多个uvicorn worker之间保持一致）
+
+    在线状态和实时统计存放在 UNLOGGED 表 live_employees 中（不写WAL，重启后丢失也没关系），
+    消息存放在 live_messages 中，并通过 LISTEN/NOTIFY 唤醒各个进程里等待的长轮询。
+    数据变化时通过 qn_live_changes 通知所有进程递增 version，使各进程的快照缓存失效。
+    """
+
+    NOTIFY_CHANNEL = "qn_live_messages"
+    CHANGES_CHANNEL = "qn_live_changes"
+    TOUCH_INTERVAL = 5  # 数据没变化时，每个进程最多每5秒刷新一次数据库中的last_seen
+
+    def __init__(self):
+        super().__init__()
+        self._last_touch = {}  # {employee_id: (record, 上次写入last_seen的时间)}
+        self._listener = ListenConnection({
+            self.NOTIFY_CHANNEL: self._on_notify,
+            self.CHANGES_CHANNEL: self._on_change_notify,
+        }, on_reconnect=self._on_listen_reconnect)
+
+    async def start(self):
+        """建立监听连接（表由数据库迁移创建，见 MIGRATIONS）"""
+        await self._listener.start()
+
+    async def stop(self):
+        await self._listener.stop()
+
+    def _on_listen_reconnect(self):
+        """监听连接断开期间的通知都丢失了：让快照缓存失效，并唤醒所有长轮询重新查一次消息"""
+        self._bump()
+        for event in self.message_events.values():
+            event.set()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        """收到新消息通知（payload为员工ID），唤醒本进程中等待的长轮询"""
+        event = self.message_events.get(payload)
+        if event:
+            event.set()
 
-# 消息推送系统（实时消息，不存储历史）
-pending_messages = {}  # {employee_id: [{"message": "xxx", "timestamp": xxx}, ...]}
-pending_messages_lock = threading.Lock()
-message_events = {}  # {employee_id: asyncio.Event()}，用于长轮询唤醒
-message_events_lock = threading.Lock()
+    def _on_change_notify(self, connection, pid, channel, payload):
+        """其他进程修改了实时数据（payload为发送方的进程号，本进程发出的通知在发送时已经递增过版本号）"""
+        if payload != str(os.getpid()):
+            self._bump()
+
+    async def notify_change(self):
+        self._bump()
+        async with db_pool.acquire() as conn:
+            await conn.execute('SELECT pg_notify($1, $2)', self.CHANGES_CHANNEL, str(os.getpid()))
+
+    async def claim_rollover(self, current_date):
+        async with db_pool.acquire() as conn:
+            claimed = await conn.fetchval(
+                'INSERT INTO live_rollovers (date) VALUES ($1) ON CONFLICT (date) DO NOTHING RETURNING date',
+                current_date
+            )
+        return claimed is not None
+
+    async def release_rollover(self, current_date):
+        async with db_pool.acquire() as conn:
+            await conn.execute('DELETE FROM live_rollovers WHERE date = $1', current_date)
+
+    async def record_report(self, name, record, now):
+        cached = self._last_touch.get(name)
+        if cached and cached[0] == record and now - cached[1] < self.TOUCH_INTERVAL:
+            return False
+
+        payload = json.dumps(record, ensure_ascii=False)
+        async with db_pool.acquire() as conn:
+            # 数据库中的数据和本次上报相同时只刷新last_seen（其他进程可能已经写入了更新的数据，所以按内容比较）
+            touched = await conn.execute(
+                'UPDATE live_employees SET last_seen = $3 WHERE employee_id = $1 AND data = $2::jsonb',
+                name, payload, now
+            )
+            data_changed = touched == "UPDATE 0"
+            if data_changed:
+                await conn.execute('''
+                    WITH upserted AS (
+                        INSERT INTO live_employees (employee_id, data, last_seen)
+                        VALUES ($1, $2::jsonb, $3)
+                        ON CONFLICT (employee_id)
+                        DO UPDATE SET data = EXCLUDED.data, last_seen = EXCLUDED.last_seen
+                        RETURNING 1
+                    )
+                    SELECT pg_notify($4, $5) FROM upserted
+                ''', name, payload, now, self.CHANGES_CHANNEL, str(os.getpid()))
+        if data_changed:
+            self._bump()
+        self._last_touch[name] = (record, now)
+        return data_changed
+
+    async def touch(self, name, now):
+        async with db_pool.acquire() as conn:
+            touched = await conn.execute(
+                'UPDATE live_employees SET last_seen = $2 WHERE employee_id = $1',
+                name, now
+            )
+        return touched != "UPDATE 0"
+
+    async def snapshot(self):
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch('SELECT employee_id, data, last_seen FROM live_employees')
+        result = {}
+        for row in rows:
+            data = json.loads(row['data'])
+            data.update({"employee_name": row['employee_id'], "online": True, "last_seen": row['last_seen']})
+            result[row['employee_id']] = data
+        return result
+
+    async def next_expiry(self):
+        async with db_pool.acquire() as conn:
+            last_seen = await conn.fetchval('SELECT MIN(last_seen) FROM live_employees')
+        return last_seen + ONLINE_TIMEOUT if last_seen is not None else None
+
+    async def remove_inactive(self, now, timeout=ONLINE_TIMEOUT):
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch(
+                'DELETE FROM live_employees WHERE last_seen <= $1 RETURNING employee_id',
+                now - timeout
+            )
+        inactive = [row['employee_id'] for row in rows]
+        for eid in inactive:
+            self._last_touch.pop(eid, None)
+        if inactive:
+            await self.notify_change()
+        return inactive
+
+    async def reset_daily(self, current_date):
+        self._last_touch.clear()
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch('''
+                WITH old AS (
+                    SELECT employee_id, data->>'date' AS old_date, COALESCE((data->>'today_consult')::int, 0) AS old_consult
+                    FROM live_employees
+                    FOR UPDATE
+                )
+                UPDATE live_employees l
+                SET data = l.data || jsonb_build_object('date', $1::text, 'today_consult', 0, 'today_replied', 0, 'total_reply_time', 0, 'avg_reply', 0)
+                FROM old
+                WHERE l.employee_id = old.employee_id
+                RETURNING l.employee_id, old.old_date, old.old_consult
+            ''', str(current_date))
+        await self.notify_change()
+        return {row['employee_id']: (row['old_date'], row['old_consult']) for row in rows}
+
+    async def clear_today(self):
+        self._last_touch.clear()
+        async with db_pool.acquire() as conn:
+            row = await conn.fetchrow('''
+                WITH old AS (
+                    SELECT employee_id,
+                           COALESCE((data->>'today_consult')::int, 0) > 0 OR COALESCE((data->>'avg_reply')::int, 0) > 0 AS had_data
+                    FROM live_employees
+                    FOR UPDATE
+                ), updated AS (
+                    UPDATE live_employees l
+                    SET data = l.data || jsonb_build_object('today_consult', 0, 'today_replied', 0, 'total_reply_time', 0, 'avg_reply', 0)
+                    FROM old
+                    WHERE l.employee_id = old.employee_id
+                    RETURNING old.had_data
+                )
+                SELECT COUNT(*) FILTER (WHERE had_data) AS cleared, COUNT(*) AS total FROM updated
+            ''')
+        await self.notify_change()
+        return row['cleared'], row['total']
+
+    async def push_message(self, employee_id, message):
+        async with db_pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    'INSERT INTO live_messages (employee_id, message, timestamp) VALUES ($1, $2, $3)',
+                    employee_id, message, time.time()
+                )
+                # 事务提交时才会真正发出通知，保证被唤醒的进程一定能读到消息
+                await conn.execute('SELECT pg_notify($1, $2)', self.NOTIFY_CHANNEL, employee_id)
+
+    async def pop_messages(self, employee_id):
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch(
+                'DELETE FROM live_messages WHERE employee_id = $1 RETURNING id, message, timestamp',
+                employee_id
+            )
+        # 按时间戳排序：放回队列的消息保留原来的时间戳，排在之后新发送的消息前面
+        rows = sorted(rows, key=lambda r: (r['timestamp'], r['id']))
+        return [{"message": row['message'], "timestamp": row['timestamp']} for row in rows]
+
+    async def requeue_messages(self, employee_id, messages):
+        async with db_pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(
+                    'INSERT INTO live_messages (employee_id, message, timestamp) VALUES ($1, $2, $3)',
+                    [(employee_id, m["message"], m["timestamp"]) for m in messages]
+                )
+                await conn.execute('SELECT pg_notify($1, $2)', self.NOTIFY_CHANNEL, employee_id)
+
+def create_live_state():
+    """根据 QN_LIVE_STATE_BACKEND 创建实时状态后端"""
+    if LIVE_STATE_BACKEND == "postgres":
+        return PostgresLiveState()
+    return MemoryLiveState()
+
+live_state = create_live_state()
+
+# 上报写缓冲：/report 不再每次直接写库，按间隔批量写入（可通过环境变量调整，单位秒）
+REPORT_FLUSH_INTERVAL = float(os.environ.get("QN_REPORT_FLUSH_INTERVAL", "2.0"))
+
+# 今天的数据：直接覆盖（不使用GREATEST），确保跨天后今天的数据从0开始
+UPSERT_TODAY_SQL = '''
+    INSERT INTO daily_stats
+        (employee_id, date, total_consultations, replied_count, total_reply_time, avg_reply)
+    VALUES ($1, $2, $3, $4, $5, $6)
+    ON CONFLICT (employee_id, date)
+    DO UPDATE SET
+        total_consultations = EXCLUDED.total_consultations,
+        replied_count = EXCLUDED.replied_count,
+        total_reply_time = EXCLUDED.total_reply_time,
+        avg_reply = EXCLUDED.avg_reply
+'''
+
+# 历史数据：使用GREATEST取最大值，避免网络延迟导致的数据丢失
+UPSERT_HISTORY_SQL = '''
+    INSERT INTO daily_stats
+        (employee_id, date, total_consultations, replied_count, total_reply_time, avg_reply)
+    VALUES ($1, $2, $3, $4, $5, $6)
+    ON CONFLICT (employee_id, date)
+    DO UPDATE SET
+        total_consultations = GREATEST(daily_stats.total_consultations, EXCLUDED.total_consultations),
+        replied_count = GREATEST(daily_stats.replied_count, EXCLUDED.replied_count),
+        total_reply_time = GREATEST(daily_stats.total_reply_time, EXCLUDED.total_reply_time),
+        avg_reply = EXCLUDED.avg_reply
+'''
+
+class ReportWriteBuffer:
+    """上报写缓冲（write-behind）
+
+    同一员工同一天只保留最新的一条上报，由后台任务按 REPORT_FLUSH_INTERVAL 间隔
+    用一次 executemany 批量写入 daily_stats。数据库写入量只和刷新间隔有关，和员工数×上报频率无关。
+    """
+
+    def __init__(self):
+        # {(employee_id, date): (咨询数, 回复数, 总回复时长, 平均回复, 是否直接覆盖)}
+        self._pending = {}
+        # 最近一次登记的计数 {(employee_id, date): (咨询数, 回复数, 总回复时长)}，用于跳过未变化的上报
+        self._last_counters = {}
+        self._flush_lock = asyncio.Lock()
+        self.flush_count = 0  # 成功刷新的批次数
+        self.rows_written = 0  # 累计写入的行数
+
+    def add(self, employee_id, report_date, consult, replied, total_reply_time, avg_reply, overwrite):
+        """登记一条上报（覆盖同一员工同一天尚未写入的旧值）
+
+        计数（咨询数、回复数、总回复时长）和上次登记的相同时不写入，返回False；否则返回True
+        """
+        key = (employee_id, report_date)
+        counters = (consult, replied, total_reply_time)
+        if self._last_counters.get(key) == counters:
+            return False
+        self._last_counters[key] = counters
+        self._pending[key] = (consult, replied, total_reply_time, avg_reply, overwrite)
+        return True
+
+    def __len__(self):
+        return len(self._pending)
+
+    def get(self, employee_id, report_date):
+        """获取尚未写入数据库的最新值（没有则返回None）"""
+        return self._pending.get((employee_id, report_date))
+
+    def pending_for_date(self, report_date):
+        """获取指定日期所有尚未写入的数据 {employee_id: (...)}"""
+        return {key[0]: value for key, value in self._pending.items() if key[1] == report_date}
+
+    @asynccontextmanager
+    async def paused(self):
+        """暂停刷新：期间没有进行中的批量写入（失败的批次也已经放回缓冲）
+
+        删除员工、手动清空当天数据时在其中 discard() 并删除数据库中的行，
+        否则刷新途中的批次或失败后放回的重试数据会把刚删除的行写回数据库。
+        """
+        async with self._flush_lock:
+            yield
+
+    def discard(self, employee_id=None, report_date=None):
+        """丢弃尚未写入的数据（删除员工、手动清空当天数据时在 paused() 中使用，避免被刷新写回数据库）"""
+        for key in list(self._pending):
+            if (employee_id is None or key[0] == employee_id) and (report_date is None or key[1] == report_date):
+                del self._pending[key]
+        self.forget(employee_id, report_date)
+
+    def forget(self, employee_id=None, report_date=None):
+        """忘记已登记的计数，下次上报无论是否变化都会重新写入（数据库中的行被删除后调用）"""
+        for key in list(self._last_counters):
+            if (employee_id is None or key[0] == employee_id) and (report_date is None or key[1] == report_date):
+                del self._last_counters[key]
+
+    async def flush(self):
+        """把缓冲中的数据一次性写入数据库，返回写入的行数"""
+        async with self._flush_lock:
+            if not self._pending or not db_pool:
+                return 0
+
+            batch, self._pending = self._pending, {}
+            today_rows = []
+            history_rows = []
+            for (employee_id, report_date), (consult, replied, total_reply_time, avg_reply, overwrite) in batch.items():
+                row = (employee_id, report_date, consult, replied, total_reply_time, avg_reply)
+                (today_rows if overwrite else history_rows).append(row)
+
+            try:
+                async with db_pool.acquire() as conn:
+                    async with conn.transaction():
+                        if today_rows:
+                            await conn.executemany(UPSERT_TODAY_SQL, today_rows)
+                        if history_rows:
+                            await conn.executemany(UPSERT_HISTORY_SQL, history_rows)
+            except Exception as e:
+                print(f"[写缓冲] 批量写入失败，{len(batch)} 条数据等待下次重试: {e}")
+                # 放回缓冲，但不覆盖刷新期间收到的更新数据
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value)
+                return 0
+
+            self.flush_count += 1
+            self.rows_written += len(batch)
+            return len(batch)
+
+report_buffer = ReportWriteBuffer()
+
+# 上报计数：skipped=计数未变化、跳过写库的上报数，persisted=进入写缓冲的上报数
+report_counters = {"skipped": 0, "persisted": 0}
 
 # Pydantic模型
 class ReportData(BaseModel):
@@ -112,120 +753,559 @@ class HistoryRecord(BaseModel):
     total_consult: int
     avg_reply: int
 
+# 数据库查询计数（/metrics 输出，压力测试用来统计每个请求产生的查询数）
+db_query_stats = {"total": 0, "by_statement": {}}
+
+def count_db_query(query):
+    db_query_stats["total"] += 1
+    statement = " ".join(query.split())[:100]
+    by_statement = db_query_stats["by_statement"]
+    by_statement[statement] = by_statement.get(statement, 0) + 1
+
+def log_db_query(record):
+    count_db_query(record.query)
+
+# 常用查询：语句形状固定（变长的日期列表用数组参数），连接建立时预备一次，之后每次请求只需绑定参数执行
+QUERIES = {
+    "today_stats": 'SELECT employee_id, total_consultations, avg_reply FROM daily_stats WHERE date = $1',
+    "employee_meta": 'SELECT original_id, display_name, bar_color, line_color, sort_order FROM employee_meta',
+    "employee_visibility": 'SELECT employee_id, hidden, is_manual FROM employee_visibility',
+    "global_visibility_mode": 'SELECT show_all FROM global_visibility_mode WHERE id = 1',
+    "employee_period_stats": '''
+        SELECT employee_id,
+               SUM(consult) AS total_consult,
+               SUM(reply_sum) / SUM(day_count) AS avg_reply_time
+        FROM (
+            SELECT employee_id, total_consultations AS consult, sum_avg_reply AS reply_sum, day_count
+            FROM employee_monthly_stats WHERE month_start = ANY($1::date[])
+            UNION ALL
+            SELECT employee_id, total_consultations, sum_avg_reply, day_count
+            FROM employee_weekly_stats WHERE week_start = ANY($2::date[])
+            UNION ALL
+            SELECT employee_id, COALESCE(total_consultations, 0), COALESCE(avg_reply, 0), 1
+            FROM daily_stats WHERE date = ANY($3::date[])
+        ) parts
+        GROUP BY employee_id
+        HAVING SUM(day_count) > 0
+        ORDER BY total_consult DESC
+    ''',
+    "monthly_daily_stats": '''
+        SELECT employee_id, date, total_consultations, avg_reply
+        FROM daily_stats
+        WHERE date >= $1 AND date < $2
+        ORDER BY employee_id, date
+    ''',
+    "history_range": '''
+        SELECT date, total_consultations, avg_reply FROM daily_stats
+        WHERE date BETWEEN $1 AND $2 ORDER BY date DESC
+    ''',
+    "history_employee_range": '''
+        SELECT date, total_consultations, avg_reply FROM daily_stats
+        WHERE employee_id = $1 AND date BETWEEN $2 AND $3 ORDER BY date DESC
+    ''',
+    "history_latest": 'SELECT date, total_consultations, avg_reply FROM daily_stats ORDER BY date DESC LIMIT 30',
+    "history_employee_all": '''
+        SELECT date, total_consultations, avg_reply FROM daily_stats
+        WHERE employee_id = $1 ORDER BY date DESC
+    ''',
+}
+
+# 预备好的语句 {数据库后端进程ID: {查询名称: PreparedStatement}}（连接池返回的代理对象和原始连接的进程ID相同）
+prepared_statements = {}
+# hits=使用预备语句执行的次数，misses=连接上没有预备语句、直接按SQL执行的次数
+statement_stats = {"hits": 0, "misses": 0, "prepare_errors": 0}
+
+async def prepare_statements(conn):
+    """在新连接上预备 QUERIES 中的所有语句"""
+    pid = conn.get_server_pid()
+    statements = {}
+    for name, sql in QUERIES.items():
+        try:
+            statements[name] = await conn.prepare(sql)
+        except Exception as e:
+            # 某条语句预备失败时该语句退回直接执行，不影响连接使用
+            statement_stats["prepare_errors"] += 1
+            print(f"[数据库] 预备语句 {name} 失败: {e}")
+    prepared_statements[pid] = statements
+    conn.add_termination_listener(lambda c: prepared_statements.pop(pid, None))
+
+def prepared(conn, name):
+    """获取连接上预备好的语句（没有时返回None）"""
+    get_pid = getattr(conn, "get_server_pid", None)
+    statements = prepared_statements.get(get_pid()) if get_pid else None
+    statement = statements.get(name) if statements else None
+    statement_stats["hits" if statement else "misses"] += 1
+    return statement
+
+async def fetch_query(conn, name, *args):
+    """执行 QUERIES 中的查询，返回所有行"""
+    statement = prepared(conn, name)
+    if statement is not None:
+        return await statement.fetch(*args)
+    return await conn.fetch(QUERIES[name], *args)
+
+def pool_stats():
+    """连接池和预备语句统计（/metrics 输出）"""
+    stats = {"min_size": DB_POOL_MIN_SIZE, "max_size": DB_POOL_MAX_SIZE,
+             "prepared_connections": len(prepared_statements), "queries": len(QUERIES), **statement_stats}
+    if db_pool is not None and hasattr(db_pool, "get_size"):
+        stats["size"] = db_pool.get_size()
+        stats["idle"] = db_pool.get_idle_size()
+    return stats
+
+async def init_connection(conn):
+    """连接池中每个新连接的初始化：记录查询、预备常用语句"""
+    conn.add_query_logger(lambda record: log_db_query(record))
+    await prepare_statements(conn)
+
 # 数据库初始化
 async def init_db():
     global db_pool
-    db_pool = await asyncpg.create_pool(**DB_CONFIG, min_size=5, max_size=20)
-    
-    async with db_pool.acquire() as conn:
-        # 创建每日统计表
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS daily_stats (
-                employee_id TEXT NOT NULL,
-                date DATE NOT NULL,
-                total_consultations INTEGER DEFAULT 0,
-                replied_count INTEGER DEFAULT 0,
-                total_reply_time REAL DEFAULT 0.0,
-                avg_reply REAL DEFAULT 0.0,
-                PRIMARY KEY (employee_id, date)
-            )
-        ''')
-        
-        # 创建员工元数据表
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS employee_meta (
-                original_id TEXT PRIMARY KEY,
-                display_name TEXT NOT NULL
-            )
-        ''')
-        
-        # 添加排序字段（如果不存在）
-        try:
-            await conn.execute('ALTER TABLE employee_meta ADD COLUMN IF NOT EXISTS sort_order INTEGER DEFAULT 9999')
-        except Exception:
-            pass  # 字段可能已存在
-        
-        # 创建员工可见性表（隐藏状态）
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS employee_visibility (
-                employee_id TEXT PRIMARY KEY,
-                hidden BOOLEAN DEFAULT FALSE,
-                is_manual BOOLEAN DEFAULT TRUE,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    # 先用单独的连接完成迁移，连接池中的连接建立时表结构已经是最新的，可以直接预备语句
+    conn = await asyncpg.connect(**DB_CONFIG)
+    try:
+        await ensure_schema(conn)
+        await ensure_partitions(conn)
+    finally:
+        await conn.close()
+
+    db_pool = await asyncpg.create_pool(
+        **DB_CONFIG, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE, init=init_connection
+    )
+    print(f"[数据库] 连接池 {DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE}，已预备 {len(QUERIES)} 条常用语句")
+
+# 按周/按月汇总表：由 daily_stats 上的触发器增量维护（每行变化时把差值加到所在的周和月）
+# 保存咨询数之和、每日平均回复时长之和和天数，平均回复时长 = 之和 / 天数（与直接对每日数据求AVG一致）
+ROLLUP_DDL = '''
+    CREATE TABLE IF NOT EXISTS employee_weekly_stats (
+        employee_id TEXT NOT NULL,
+        week_start DATE NOT NULL,
+        total_consultations BIGINT NOT NULL DEFAULT 0,
+        sum_avg_reply DOUBLE PRECISION NOT NULL DEFAULT 0,
+        day_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (week_start, employee_id)
+    );
+    CREATE TABLE IF NOT EXISTS employee_monthly_stats (
+        employee_id TEXT NOT NULL,
+        month_start DATE NOT NULL,
+        total_consultations BIGINT NOT NULL DEFAULT 0,
+        sum_avg_reply DOUBLE PRECISION NOT NULL DEFAULT 0,
+        day_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (month_start, employee_id)
+    );
+
+    CREATE OR REPLACE FUNCTION apply_daily_stats_rollup(
+        p_employee_id TEXT, p_date DATE, p_consult BIGINT, p_avg_reply DOUBLE PRECISION, p_days INTEGER
+    ) RETURNS void AS $$
+    BEGIN
+        INSERT INTO employee_weekly_stats AS w (employee_id, week_start, total_consultations, sum_avg_reply, day_count)
+        VALUES (p_employee_id, date_trunc('week', p_date)::date, p_consult, p_avg_reply, p_days)
+        ON CONFLICT (week_start, employee_id) DO UPDATE SET
+            total_consultations = w.total_consultations + EXCLUDED.total_consultations,
+            sum_avg_reply = w.sum_avg_reply + EXCLUDED.sum_avg_reply,
+            day_count = w.day_count + EXCLUDED.day_count;
+        INSERT INTO employee_monthly_stats AS m (employee_id, month_start, total_consultations, sum_avg_reply, day_count)
+        VALUES (p_employee_id, date_trunc('month', p_date)::date, p_consult, p_avg_reply, p_days)
+        ON CONFLICT (month_start, employee_id) DO UPDATE SET
+            total_consultations = m.total_consultations + EXCLUDED.total_consultations,
+            sum_avg_reply = m.sum_avg_reply + EXCLUDED.sum_avg_reply,
+            day_count = m.day_count + EXCLUDED.day_count;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION daily_stats_rollup_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM apply_daily_stats_rollup(OLD.employee_id, OLD.date,
+                -COALESCE(OLD.total_consultations, 0), -COALESCE(OLD.avg_reply, 0), -1);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM apply_daily_stats_rollup(NEW.employee_id, NEW.date,
+                COALESCE(NEW.total_consultations, 0), COALESCE(NEW.avg_reply, 0), 1);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+'''
+
+async def init_rollups(conn):
+    """创建汇总表和触发器；第一次创建时根据现有的 daily_stats 回填汇总数据"""
+    async with conn.transaction():
+        # 阻止回填期间的写入，避免回填和触发器重复计算
+        await conn.execute('LOCK TABLE daily_stats IN SHARE ROW EXCLUSIVE MODE')
+        exists = await conn.fetchval(
+            "SELECT 1 FROM pg_trigger WHERE tgname = 'daily_stats_rollup_change' AND tgrelid = 'daily_stats'::regclass"
+        )
+        await conn.execute(ROLLUP_DDL)
+        if exists:
+            return
+
+        await conn.execute('TRUNCATE employee_weekly_stats, employee_monthly_stats')
+        for table, column, unit in (
+            ("employee_weekly_stats", "week_start", "week"),
+            ("employee_monthly_stats", "month_start", "month")
+        ):
+            await conn.execute(f'''
+                INSERT INTO {table} (employee_id, {column}, total_consultations, sum_avg_reply, day_count)
+                SELECT employee_id, date_trunc('{unit}', date)::date,
+                       SUM(COALESCE(total_consultations, 0)), SUM(COALESCE(avg_reply, 0)), COUNT(*)
+                FROM daily_stats
+                GROUP BY employee_id, date_trunc('{unit}', date)::date
+            ''')
+        await create_rollup_triggers(conn)
+        print("[汇总表] 已创建按周/按月汇总表并回填历史数据")
+
+async def create_rollup_triggers(conn):
+    # 只有咨询数或平均回复时长变化的更新才需要维护汇总（每次上报写库时这两个值大多没变）
+    await conn.execute('''
+        CREATE TRIGGER daily_stats_rollup_insert_delete
+        AFTER INSERT OR DELETE ON daily_stats
+        FOR EACH ROW EXECUTE FUNCTION daily_stats_rollup_trigger()
+    ''')
+    await conn.execute('''
+        CREATE TRIGGER daily_stats_rollup_change
+        AFTER UPDATE ON daily_stats
+        FOR EACH ROW
+        WHEN (OLD.total_consultations IS DISTINCT FROM NEW.total_consultations
+              OR OLD.avg_reply IS DISTINCT FROM NEW.avg_reply
+              OR OLD.date IS DISTINCT FROM NEW.date
+              OR OLD.employee_id IS DISTINCT FROM NEW.employee_id)
+        EXECUTE FUNCTION daily_stats_rollup_trigger()
+    ''')
+
+# daily_stats 按月分区（分区名 daily_stats_pYYYYMM），另有默认分区 daily_stats_default 接收超出范围的日期
+PARTITION_MONTHS_AHEAD = 3  # 提前创建未来几个月的分区
+# 保留最近几个月的分区，更早的分区从 daily_stats 分离（数据保留在独立的表中，可以另行归档）；0=全部保留
+# 分离时同时从汇总表中减去该分区的数据，/stats_by_employee、/history 和 daily_stats 保持一致（都不再包含已分离的月份）
+PARTITION_RETENTION_MONTHS = int(os.environ.get("QN_PARTITION_RETENTION_MONTHS", "0"))
+PARTITION_LOCK_ID = 5193002  # pg_advisory_xact_lock 的锁ID，多个进程同时创建/分离分区时依次执行
+
+def add_months(month_start, months):
+    year, month = divmod(month_start.month - 1 + months, 12)
+    return month_start.replace(year=month_start.year + year, month=month + 1, day=1)
+
+def partition_name(month_start):
+    return f"daily_stats_p{month_start:%Y%m}"
+
+async def is_partition(conn, name):
+    """name 当前是否是 daily_stats 的分区（持有 PARTITION_LOCK_ID 时读取，其他进程可能刚刚创建或分离）"""
+    return bool(await conn.fetchval(
+        "SELECT 1 FROM pg_inherits WHERE inhparent = 'daily_stats'::regclass AND inhrelid = to_regclass($1)", name
+    ))
+
+async def create_partition(conn, month_start):
+    """创建一个月的分区，返回是否由本次调用创建（其他进程已经创建时返回False）
+
+    默认分区中已有该月的数据时先移出，再经父表写回新分区（汇总表触发器保持一致）
+    """
+    name = partition_name(month_start)
+    next_month = add_months(month_start, 1)
+    async with conn.transaction():
+        await conn.execute('SELECT pg_advisory_xact_lock($1)', PARTITION_LOCK_ID)
+        if await is_partition(conn, name):
+            return False
+        await conn.execute(f'CREATE TEMP TABLE {name}_moving (LIKE daily_stats) ON COMMIT DROP')
+        await conn.execute(f'''
+            WITH moved AS (
+                DELETE FROM daily_stats_default WHERE date >= $1 AND date < $2 RETURNING *
             )
+            INSERT INTO {name}_moving SELECT * FROM moved
+        ''', month_start, next_month)
+        await conn.execute(
+            f"CREATE TABLE {name} PARTITION OF daily_stats FOR VALUES FROM ('{month_start}') TO ('{next_month}')"
+        )
+        await conn.execute(f'INSERT INTO daily_stats SELECT * FROM {name}_moving')
+    return True
+
+async def detach_partition(conn, name):
+    """分离一个过期的分区，并从汇总表中减去它的数据，返回是否由本次调用分离
+
+    分离不会触发行级触发器，所以逐行调用 apply_daily_stats_rollup 减去差值（与删除这些行的效果相同）
+    """
+    async with conn.transaction():
+        await conn.execute('SELECT pg_advisory_xact_lock($1)', PARTITION_LOCK_ID)
+        if not await is_partition(conn, name):
+            return False
+        await conn.execute(f'ALTER TABLE daily_stats DETACH PARTITION {name}')
+        await conn.execute(f'''
+            SELECT apply_daily_stats_rollup(employee_id, date,
+                -COALESCE(total_consultations, 0), -COALESCE(avg_reply, 0), -1)
+            FROM {name}
         ''')
-        
-        # 创建全局显示模式表
+        await conn.execute('DELETE FROM employee_weekly_stats WHERE day_count <= 0')
+        await conn.execute('DELETE FROM employee_monthly_stats WHERE day_count <= 0')
+    return True
+
+async def ensure_partitions(conn, since=None):
+    """创建从 since（默认今天）所在月份到未来 PARTITION_MONTHS_AHEAD 个月的分区，并按配置分离过期的分区
+
+    existing 只用来跳过明显不需要处理的月份；多个进程同时执行时，create_partition / detach_partition 在锁内重新检查
+    """
+    today = get_beijing_today()
+    existing = {row['relname'] for row in await conn.fetch('''
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'daily_stats'::regclass
+    ''')}
+
+    created = []
+    month = (since or today).replace(day=1)
+    last_month = add_months(today.replace(day=1), PARTITION_MONTHS_AHEAD)
+    while month <= last_month:
+        if partition_name(month) not in existing and await create_partition(conn, month):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+
+    detached = []
+    if PARTITION_RETENTION_MONTHS > 0:
+        oldest_kept = partition_name(add_months(today.replace(day=1), -PARTITION_RETENTION_MONTHS))
+        for name in sorted(existing):
+            if name.startswith("daily_stats_p") and name < oldest_kept and await detach_partition(conn, name):
+                detached.append(name)
+
+    if created:
+        print(f"[分区] 已创建分区: {', '.join(created)}")
+    if detached:
+        print(f"[分区] 已分离过期分区（数据保留在同名表中，已从汇总表中减去）: {', '.join(detached)}")
+
+async def partition_daily_stats(conn):
+    """迁移步骤：把 daily_stats 转换为按月分区的表（复制数据，汇总表数据不变）"""
+    if await conn.fetchval("SELECT relkind = 'p' FROM pg_class WHERE oid = 'daily_stats'::regclass"):
+        return
+    await conn.execute('LOCK TABLE daily_stats IN ACCESS EXCLUSIVE MODE')
+    await conn.execute('ALTER TABLE daily_stats RENAME TO daily_stats_unpartitioned')
+    await conn.execute('ALTER TABLE daily_stats_unpartitioned RENAME CONSTRAINT daily_stats_pkey TO daily_stats_unpartitioned_pkey')
+    await conn.execute('ALTER INDEX IF EXISTS idx_daily_stats_date_employee RENAME TO idx_daily_stats_unpartitioned_date_employee')
+    await conn.execute('''
+        CREATE TABLE daily_stats (
+            employee_id TEXT NOT NULL,
+            date DATE NOT NULL,
+            total_consultations INTEGER DEFAULT 0,
+            replied_count INTEGER DEFAULT 0,
+            total_reply_time REAL DEFAULT 0.0,
+            avg_reply REAL DEFAULT 0.0,
+            PRIMARY KEY (employee_id, date)
+        ) PARTITION BY RANGE (date)
+    ''')
+    await conn.execute('CREATE TABLE daily_stats_default PARTITION OF daily_stats DEFAULT')
+    # 分区表上的索引会自动在每个分区上创建（新表，不需要CONCURRENTLY）
+    await conn.execute('''
+        CREATE INDEX idx_daily_stats_date_employee
+        ON daily_stats(date, employee_id) INCLUDE (total_consultations, avg_reply)
+    ''')
+    await ensure_partitions(conn, await conn.fetchval('SELECT MIN(date) FROM daily_stats_unpartitioned'))
+    # 新表上还没有汇总表触发器，复制数据不会重复计入汇总表
+    await conn.execute('INSERT INTO daily_stats SELECT * FROM daily_stats_unpartitioned')
+    await conn.execute('DROP TABLE daily_stats_unpartitioned')
+    await create_rollup_triggers(conn)
+
+def create_index_concurrently(name, definition):
+    """迁移步骤：不锁表地创建索引（上次中断留下的无效索引先删除再重建）"""
+    async def step(conn):
+        invalid = await conn.fetchval(
+            'SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)', name
+        )
+        if invalid:
+            await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+        await conn.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}')
+    return step
+
+# 数据库迁移：(版本号, 说明, 是否在事务中执行, 步骤列表)，步骤为SQL语句或 async def step(conn)
+# 已上线的迁移不要修改，新的结构变化追加新版本。CONCURRENTLY 的步骤不能放在事务中执行。
+# 版本1~2与旧版本 init_db 建立的结构一致（IF NOT EXISTS），已有的数据库也可以直接迁移。
+MIGRATIONS = [
+    (1, "基础表", True, [
+        '''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            employee_id TEXT NOT NULL,
+            date DATE NOT NULL,
+            total_consultations INTEGER DEFAULT 0,
+            replied_count INTEGER DEFAULT 0,
+            total_reply_time REAL DEFAULT 0.0,
+            avg_reply REAL DEFAULT 0.0,
+            PRIMARY KEY (employee_id, date)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS employee_meta (
+            original_id TEXT PRIMARY KEY,
+            display_name TEXT NOT NULL
+        )
+        ''',
+        'ALTER TABLE employee_meta ADD COLUMN IF NOT EXISTS sort_order INTEGER DEFAULT 9999',
+        '''
+        CREATE TABLE IF NOT EXISTS employee_visibility (
+            employee_id TEXT PRIMARY KEY,
+            hidden BOOLEAN DEFAULT FALSE,
+            is_manual BOOLEAN DEFAULT TRUE,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS global_visibility_mode (
+            id INTEGER PRIMARY KEY DEFAULT 1,
+            show_all BOOLEAN DEFAULT FALSE,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'INSERT INTO global_visibility_mode (id, show_all) VALUES (1, FALSE) ON CONFLICT (id) DO NOTHING',
+    ]),
+    (2, "员工颜色字段", True, [
+        'ALTER TABLE employee_meta ADD COLUMN IF NOT EXISTS bar_color TEXT',
+        'ALTER TABLE employee_meta ADD COLUMN IF NOT EXISTS line_color TEXT',
+    ]),
+    (3, "多进程共享的实时状态表", True, [
+        '''
+        CREATE UNLOGGED TABLE IF NOT EXISTS live_employees (
+            employee_id TEXT PRIMARY KEY,
+            data JSONB NOT NULL,
+            last_seen DOUBLE PRECISION NOT NULL
+        )
+        ''',
+        '''
+        CREATE UNLOGGED TABLE IF NOT EXISTS live_messages (
+            id BIGSERIAL PRIMARY KEY,
+            employee_id TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timestamp DOUBLE PRECISION NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_live_messages_employee ON live_messages(employee_id)',
+        '''
+        CREATE TABLE IF NOT EXISTS live_rollovers (
+            date DATE PRIMARY KEY,
+            claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (4, "按周/按月汇总表", True, [init_rollups]),
+    # 按日期（范围）筛选、按员工分组、读取咨询数和平均回复时长的查询都可以只扫描索引
+    # （/employees、/stats_by_employee 的零散天、/monthly_daily_stats、跨天清理）
+    (5, "daily_stats覆盖索引", False, [
+        create_index_concurrently(
+            "idx_daily_stats_date_employee",
+            "daily_stats(date, employee_id) INCLUDE (total_consultations, avg_reply)"
+        ),
+    ]),
+    # 旧的单列索引已被上面的索引（date开头）和主键（employee_id开头）覆盖
+    (6, "删除多余的单列索引", False, [
+        'DROP INDEX CONCURRENTLY IF EXISTS idx_daily_stats_date',
+        'DROP INDEX CONCURRENTLY IF EXISTS idx_daily_stats_employee',
+    ]),
+    (7, "daily_stats按月分区", True, [partition_daily_stats]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+MIGRATION_LOCK_ID = 5193001  # pg_advisory_lock 的锁ID，多个进程同时启动时只有一个执行迁移
+AUTO_MIGRATE = os.environ.get("QN_AUTO_MIGRATE", "1") != "0"  # 启动时发现结构版本落后是否自动迁移
+
+async def current_schema_version(conn):
+    try:
+        return await conn.fetchval('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    except asyncpg.UndefinedTableError:
+        return 0
+
+async def run_migrations(conn):
+    """按顺序执行尚未执行的迁移"""
+    await conn.execute('SELECT pg_advisory_lock($1)', MIGRATION_LOCK_ID)
+    try:
         await conn.execute('''
-            CREATE TABLE IF NOT EXISTS global_visibility_mode (
-                id INTEGER PRIMARY KEY DEFAULT 1,
-                show_all BOOLEAN DEFAULT FALSE,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
             )
         ''')
-        
-        # 插入默认的全局显示模式（如果不存在）
-        await conn.execute('''
-            INSERT INTO global_visibility_mode (id, show_all)
-            VALUES (1, FALSE)
-            ON CONFLICT (id) DO NOTHING
-        ''')
-        
-        # 创建索引
-        await conn.execute('''
-            CREATE INDEX IF NOT EXISTS idx_daily_stats_date 
-            ON daily_stats(date)
-        ''')
-        await conn.execute('''
-            CREATE INDEX IF NOT EXISTS idx_daily_stats_employee 
-            ON daily_stats(employee_id)
-        ''')
+        # 拿到锁之后再读取，其他进程可能刚刚执行完
+        applied = {row['version'] for row in await conn.fetch('SELECT version FROM schema_version')}
+        for version, description, transactional, steps in MIGRATIONS:
+            if version in applied:
+                continue
+            print(f"[迁移] 执行 {version}: {description}")
+            started = time.time()
+            if transactional:
+                async with conn.transaction():
+                    await run_migration_steps(conn, steps)
+                    await conn.execute(
+                        'INSERT INTO schema_version (version, description) VALUES ($1, $2)', version, description
+                    )
+            else:
+                await run_migration_steps(conn, steps)
+                await conn.execute(
+                    'INSERT INTO schema_version (version, description) VALUES ($1, $2)', version, description
+                )
+            print(f"[迁移] 完成 {version}（{time.time() - started:.2f} 秒）")
+    finally:
+        await conn.execute('SELECT pg_advisory_unlock($1)', MIGRATION_LOCK_ID)
 
-async def check_daily_reset_flag():
-    """定期检查跨天重置标志文件，并执行数据库清理"""
-    import tempfile
-    flag_file = os.path.join(tempfile.gettempdir(), "qn_stats_daily_reset_flag.txt")
-    
-    while True:
-        try:
-            await asyncio.sleep(5)  # 每5秒检查一次
-            
-            if os.path.exists(flag_file):
-                try:
-                    with open(flag_file, "r", encoding="utf-8") as f:
-                        date_str = f.read().strip()
-                    
-                    current_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-                    print(f"[DAILY_RESET] 检测到跨天标志文件，开始清理数据库: {current_date}")
-                    
-                    # 执行数据库清理
-                    await clear_today_stats_async(current_date)
-                    
-                    # 删除标志文件
-                    os.remove(flag_file)
-                    print(f"[DAILY_RESET] 数据库清理完成，标志文件已删除")
-                except Exception as e:
-                    print(f"[DAILY_RESET] 处理标志文件失败: {e}")
-                    # 删除损坏的标志文件
-                    try:
-                        os.remove(flag_file)
-                    except:
-                        pass
-        except Exception as e:
-            print(f"[DAILY_RESET] 检查标志文件出错: {e}")
+async def run_migration_steps(conn, steps):
+    for step in steps:
+        if isinstance(step, str):
+            await conn.execute(step)
+        else:
+            await step(conn)
+
+async def ensure_schema(conn):
+    """启动检查：结构版本是最新时只执行一次查询，不做任何DDL"""
+    version = await current_schema_version(conn)
+    if version == SCHEMA_VERSION:
+        return
+    if version > SCHEMA_VERSION:
+        print(f"[迁移] 警告：数据库结构版本 {version} 比程序（{SCHEMA_VERSION}）新，请更新服务器程序")
+        return
+    if not AUTO_MIGRATE:
+        raise RuntimeError(f"数据库结构版本为 {version}，需要 {SCHEMA_VERSION}，请先运行：python 服务器.py migrate")
+    await run_migrations(conn)
+
+def split_rollup_range(start, end):
+    """把日期范围 [start, end] 拆成完整的月、完整的周（不跨月）和零散的天
+
+    返回 (月初日期列表, 周一日期列表, 零散日期列表)，三部分互不重叠，合起来正好覆盖整个范围。
+    """
+    months, weeks, days = [], [], []
+    d = start
+    while d <= end:
+        if d.day == 1:
+            next_month = (d + timedelta(days=32)).replace(day=1)
+            if next_month - timedelta(days=1) <= end:
+                months.append(d)
+                d = next_month
+                continue
+        week_end = d + timedelta(days=6)
+        if d.weekday() == 0 and week_end <= end and week_end.month == d.month:
+            weeks.append(d)
+            d = week_end + timedelta(days=1)
+            continue
+        days.append(d)
+        d += timedelta(days=1)
+    return months, weeks, days
+
+async def fetch_employee_period_stats(conn, start, end):
+    """按员工统计 [start, end] 范围内的咨询总数和平均回复时长
+
+    完整的月和周从汇总表读取，边缘零散的天从 daily_stats 读取，查询多年的数据和查询一个月的代价相近。
+    """
+    months, weeks, days = split_rollup_range(start, end)
+    return await fetch_query(conn, "employee_period_stats", months, weeks, days)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 启动时执行
     await init_db()
-    # 启动清理线程
-    threading.Thread(target=cleanup_inactive_sync, daemon=True).start()
-    # 启动每日重置线程
-    threading.Thread(target=daily_reset_sync, daemon=True).start()
-    # 启动跨天标志检查任务（在事件循环中）
-    asyncio.create_task(check_daily_reset_flag())
+    await live_state.start()
+    await meta_cache.start()
+    print(f"[启动] 实时状态后端: {LIVE_STATE_BACKEND}")
+    # 启动定时任务（都在事件循环中运行，不使用线程）
+    print(f"[DAILY_RESET] 服务启动，当前日期（北京时间）: {get_beijing_today()}")
+    print(f"[DAILY_RESET] 不清空数据（可能是当天重启，保留员工端已累积的数据）")
+    scheduler.at_deadlines("presence_expiry", next_presence_expiry, expire_presence)  # 在线员工超时离线
+    scheduler.every("flush_reports", REPORT_FLUSH_INTERVAL, report_buffer.flush)  # 上报写缓冲定期刷新
+    scheduler.daily("daily_rollover", daily_rollover)  # 每日00:00重置
     yield
-    # 关闭时执行
+    # 关闭时执行：先把缓冲中的上报写入数据库，再关闭连接池
+    await scheduler.stop()
+    written = await report_buffer.flush()
+    print(f"[SHUTDOWN] 写缓冲已刷新，写入 {written} 条数据")
+    await live_state.stop()
+    await meta_cache.stop()
     if db_pool:
         await db_pool.close()
 
@@ -240,130 +1320,275 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def cleanup_inactive_sync():
-    """清理1分钟无上报的员工"""
-    while True:
-        now = time.time()
-        with active_employees_lock:
-            inactive = [eid for eid, data in active_employees.items() 
-                       if now - data.get("last_seen", 0) > 60]  # 1分钟
-            for eid in inactive:
-                if eid in active_employees:
-                    del active_employees[eid]
-                    print(f"[CLEANUP] 清理离线员工: {eid}")
-        time.sleep(30)  # 每30秒检查一次
-
-def daily_reset_sync():
-    """每天00:00清空当天的咨询数据和平均回复（历史数据永久保存在数据库中）"""
-    last_reset_date = None
-    
-    # 首次启动时，记录当前日期作为基准（不清空数据，因为可能是当天重启）
-    last_reset_date = get_beijing_today()
-    print(f"[DAILY_RESET] 服务启动，当前日期（北京时间）: {last_reset_date}")
-    print(f"[DAILY_RESET] 不清空数据（可能是当天重启，保留员工端已累积的数据）")
-    
-    while True:
+SCHEDULER_MAX_SLEEP = 60     # 等待每日任务时单次最长休眠（秒），系统时间被调整后最多延迟这么久发现
+DAILY_RETRY_DELAY = 60       # 每日任务失败后重试的等待时间（秒）
+
+def next_beijing_midnight(now=None):
+    """下一个北京时间00:00（带时区的datetime）"""
+    now = now or get_beijing_now()
+    tomorrow = now.date() + timedelta(days=1)
+    return datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=BEIJING_TZ)
+
+class Scheduler:
+    """事件循环内的定时任务调度器
+
+    - every：固定间隔执行，下一次的时间按上一次的计划时间推算（执行耗时不会累积成漂移），
+      错过的周期直接跳过，不会补跑
+    - daily：在北京时间00:00准时执行（不再轮询检查日期），失败后隔一段时间重试
+    - at_deadlines：在 next_deadline() 返回的时间执行，执行后重新计算下一次的时间
+    每个任务记录执行次数、开始时间相对计划时间的延迟和执行耗时（/metrics 输出）。
+    """
+
+    def __init__(self):
+        self.jobs = {}  # 任务名 -> 统计信息
+        self._tasks = []
+
+    def every(self, name, interval, func):
+        """每 interval 秒执行一次 func()（协程函数），首次在启动后 interval 秒执行"""
+        self._start(name, self._run_interval(name, interval, func))
+
+    def daily(self, name, func):
+        """每天北京时间00:00执行 func(今天的日期)（协程函数）"""
+        self._start(name, self._run_daily(name, func))
+
+    def at_deadlines(self, name, next_deadline, func):
+        """在 next_deadline()（协程函数，返回时间戳）给出的时间执行 func()
+
+        等待期间截止时间只会推后、不会提前（否则需要调用方唤醒），最多等待 SCHEDULER_MAX_SLEEP 秒后重新计算
+        """
+        self._start(name, self._run_at_deadlines(name, next_deadline, func))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        return {name: dict(job) for name, job in self.jobs.items()}
+
+    def _start(self, name, coro):
+        self.jobs[name] = {"runs": 0, "errors": 0, "next_run": None,
+                           "last_lateness_ms": None, "max_lateness_ms": 0, "last_duration_ms": None}
+        self._tasks.append(asyncio.create_task(coro))
+
+    async def _run_job(self, name, func, lateness, *args):
+        """执行一次任务并记录统计，返回是否成功"""
+        job = self.jobs[name]
+        lateness_ms = round(max(lateness, 0) * 1000, 1)
+        job["last_lateness_ms"] = lateness_ms
+        job["max_lateness_ms"] = max(job["max_lateness_ms"], lateness_ms)
+        started = time.perf_counter()
         try:
-            # 每10秒检查一次是否跨天（更快响应）
-            time.sleep(10)
-            
-            current_date = get_beijing_today()
-            
-            # 检查是否到了新的一天（00:00之后）
-            if last_reset_date != current_date:
-                print(f"[DAILY_RESET] 检测到日期变化: {last_reset_date} -> {current_date}")
-                print(f"[DAILY_RESET] 开始归档 {last_reset_date} 的数据")
-                
-                # 1. 归档并清空内存中的统计数据
-                with active_employees_lock:
-                    for eid, data in list(active_employees.items()):
-                        old_date_str = data.get("date")
-                        
-                        # 如果员工数据还是昨天的，需要归档
-                        if old_date_str:
-                            try:
-                                old_date = datetime.strptime(old_date_str, "%Y-%m-%d").date()
-                                if old_date < current_date:
-                                    print(f"[归档] 员工 {eid} 昨天({old_date})数据: {data.get('today_consult', 0)}咨询")
-                                    # 数据库中已经实时更新了，不需要额外操作
-                            except:
-                                pass
-                        
-                        # 清空当天的咨询数据和平均回复，保留其他数据（客户数、店铺数等）
-                        data["date"] = str(current_date)
-                        data["today_consult"] = 0
-                        data["avg_reply"] = 0
-                
-                # 2. 清理工作（清除手动隐藏状态等）- 使用线程安全的标志文件方式
+            await func(*args)
+            return True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job["errors"] += 1
+            print(f"[SCHEDULER] 任务 {name} 出错: {e}")
+            return False
+        finally:
+            job["runs"] += 1
+            job["last_duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def _run_interval(self, name, interval, func):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + interval
+        while True:
+            self.jobs[name]["next_run"] = time.time() + (deadline - loop.time())
+            await asyncio.sleep(max(deadline - loop.time(), 0))
+            await self._run_job(name, func, loop.time() - deadline)
+            deadline += interval
+            now = loop.time()
+            if deadline <= now:
+                deadline += ((now - deadline) // interval + 1) * interval
+
+    async def _run_at_deadlines(self, name, next_deadline, func):
+        while True:
+            try:
+                deadline = await next_deadline()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[SCHEDULER] 任务 {name} 计算执行时间出错: {e}")
+                deadline = time.time() + SCHEDULER_MAX_SLEEP
+            self.jobs[name]["next_run"] = deadline
+            remaining = deadline - time.time()
+            if remaining > SCHEDULER_MAX_SLEEP:
+                await asyncio.sleep(SCHEDULER_MAX_SLEEP)
+                continue
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            await self._run_job(name, func, time.time() - deadline)
+
+    async def _run_daily(self, name, func):
+        deadline = next_beijing_midnight()
+        while True:
+            self.jobs[name]["next_run"] = deadline.timestamp()
+            # 分段休眠：系统时间被调整时也能在 SCHEDULER_MAX_SLEEP 秒内重新对准
+            while (remaining := (deadline - get_beijing_now()).total_seconds()) > 0:
+                await asyncio.sleep(min(remaining, SCHEDULER_MAX_SLEEP))
+            target_date = deadline.date()
+            if await self._run_job(name, func, -remaining, target_date):
+                deadline = next_beijing_midnight()
+            else:
+                # 失败后重试同一天的任务（日期已经再次变化时直接处理新的一天）
+                await asyncio.sleep(DAILY_RETRY_DELAY)
+                deadline = get_beijing_now() if get_beijing_today() == target_date else next_beijing_midnight()
+
+scheduler = Scheduler()
+
+async def next_presence_expiry():
+    """下一个在线员工超时离线的时间"""
+    expiry = await live_state.next_expiry()
+    # 没有在线员工时，之后上线的员工最早也要 ONLINE_TIMEOUT 秒后才会超时
+    return expiry if expiry is not None else time.time() + ONLINE_TIMEOUT
+
+async def expire_presence():
+    """员工超过1分钟无上报时立即转为离线（从实时状态中移除，快照随版本号变化重建）"""
+    for eid in await live_state.remove_inactive(time.time()):
+        print(f"[PRESENCE] 员工离线: {eid}")
+
+live_reset_date = None  # 本进程已经清空实时数据的日期（跨天任务重试时不再重复清空）
+rollover_claimed_date = None  # 本进程取得数据库清理执行权的日期（重试时不需要重新争取）
+rollover_cleared_date = None  # 本进程已经提交数据库清理事务的日期（重试时不再重复删除）
+
+async def daily_rollover(current_date):
+    """每天00:00清空当天的咨询数据和平均回复（历史数据永久保存在数据库中）
+
+    失败后调度器会重试整个任务：已经完成的实时数据清空和已经提交的数据库删除都不再重复执行。
+    """
+    global live_reset_date, rollover_claimed_date
+    last_date = current_date - timedelta(days=1)
+    print(f"[DAILY_RESET] 日期变化: {last_date} -> {current_date}")
+
+    # 1. 归档并清空内存中的统计数据（数据库中已经实时更新了，不需要额外操作）
+    #    重试时跳过，否则会把00:00之后新上报的实时数据再清空一次
+    if live_reset_date != current_date:
+        print(f"[DAILY_RESET] 开始归档 {last_date} 的数据")
+        archived = await live_state.reset_daily(current_date)
+        live_reset_date = current_date
+        for eid, (old_date_str, old_consult) in archived.items():
+            if old_date_str and old_date_str < str(current_date):
+                print(f"[归档] 员工 {eid} 昨天({old_date_str})数据: {old_consult}咨询")
+
+    # 2. 数据库清理（清空今天的残留数据、清除手动隐藏状态等），直接在事件循环中执行
+    #    多进程运行时只由一个进程执行，其他进程只把自己的写缓冲写入数据库
+    if rollover_claimed_date == current_date or await live_state.claim_rollover(current_date):
+        rollover_claimed_date = current_date
+        report = await clear_today_stats_async(current_date)
+        if not report["success"]:
+            # 释放执行权，让记录表示“已完成”而不是“已尝试”；释放失败时本进程仍记得执行权，重试照常进行
+            try:
+                await live_state.release_rollover(current_date)
+            except Exception as e:
+                print(f"[DAILY_RESET] 释放清理执行权失败: {e}")
+            raise RuntimeError(report.get("error"))
+    else:
+        await report_buffer.flush()
+        report_buffer.forget()
+
+    print(f"[DAILY_RESET] {current_date} - 跨天处理完成，昨天（{last_date}）的数据已永久保存，今天的数据正常接收中")
+
+# 跨天报告中是否附带 pg_class 统计信息中的历史数据行数估计（不扫描表）
+ROLLOVER_ESTIMATES = os.environ.get("QN_ROLLOVER_ESTIMATES", "0") == "1"
+last_rollover_report = None  # 最近一次跨天清理的报告（/metrics 输出）
+
+def content_digest(data):
+    """内容摘要：多进程部署时各进程对相同的内容算出相同的值（ETag 不再依赖进程内的序号）"""
+    if not isinstance(data, bytes):
+        data = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+def affected_rows(status):
+    """从 execute 返回的状态（如 "DELETE 12"）中取出影响的行数"""
+    try:
+        return int(status.split()[-1])
+    except (ValueError, IndexError, AttributeError):
+        return 0
+
+async def clear_today_stats_async(current_date):
+    """跨天后的清理工作：清空数据库中今天的数据（避免残留昨天的数据）、清除手动隐藏状态
+    
+    注意：只删除今天（current_date）的数据，历史数据（昨天及以前）不会受影响。
+    两条DELETE在一个事务中完成，提交后重试时不再执行（否则会删掉00:00之后写入的数据和管理员新设置的隐藏状态）；
+    分区维护和行数估计只是附带的维护工作，失败时记录在报告中，不影响清理是否成功。
+    行数直接取自各语句的返回结果（不再用COUNT(*)扫描表），每一步的耗时记录在跨天报告中。
+    """
+    global last_rollover_report, rollover_cleared_date
+    report = {"date": str(current_date), "steps": [], "success": False}
+    started = time.perf_counter()
+
+    def record_step(name, step_started, rows=None):
+        step = {"step": name, "ms": round((time.perf_counter() - step_started) * 1000, 1)}
+        if rows is not None:
+            step["rows"] = rows
+        report["steps"].append(step)
+
+    try:
+        # 1. 先把写缓冲中的数据（主要是昨天最后的上报）写入数据库
+        step_started = time.perf_counter()
+        written = await report_buffer.flush()
+        record_step("flush_buffer", step_started, written)
+
+        async with db_pool.acquire() as conn:
+            if rollover_cleared_date != current_date:
+                async with conn.transaction():
+                    # 2. 清空数据库中今天的数据：可能是昨天跨天瞬间写入的残留数据，会导致今天显示昨天的值
+                    #    只删除 date = current_date（今天）的数据，只涉及本月一个分区，不会影响历史数据
+                    step_started = time.perf_counter()
+                    status = await conn.execute('DELETE FROM daily_stats WHERE date = $1', current_date)
+                    record_step("delete_today", step_started, affected_rows(status))
+
+                    # 3. 清除所有手动隐藏状态（每天重置）
+                    step_started = time.perf_counter()
+                    status = await conn.execute('DELETE FROM employee_visibility WHERE is_manual = TRUE')
+                    record_step("reset_visibility", step_started, affected_rows(status))
+                rollover_cleared_date = current_date
+                # 今天的行已删除，让下一次上报重新写入（同时释放昨天及以前的计数记录）
+                report_buffer.forget()
+            else:
+                report["steps"].append({"step": "delete_today", "skipped": True})
+
+            await meta_cache.changed(conn)
+
+            # 4. 提前创建新月份的分区（失败时下次启动或明天的跨天任务会再次创建）
+            step_started = time.perf_counter()
+            try:
+                await ensure_partitions(conn)
+                record_step("ensure_partitions", step_started)
+            except Exception as e:
+                record_step("ensure_partitions", step_started)
+                report["steps"][-1]["error"] = str(e)
+                print(f"[DAILY_RESET] 分区维护失败（不影响跨天清理）: {e}")
+
+            # 5. 可选：历史数据行数估计（来自统计信息，不扫描表）
+            if ROLLOVER_ESTIMATES:
+                step_started = time.perf_counter()
                 try:
-                    # 创建标志文件，让主事件循环处理数据库清理
-                    import tempfile
-                    flag_file = os.path.join(tempfile.gettempdir(), "qn_stats_daily_reset_flag.txt")
-                    with open(flag_file, "w", encoding="utf-8") as f:
-                        f.write(str(current_date))
-                    print(f"[DAILY_RESET] 已创建清理标志文件: {flag_file}")
+                    estimate = await conn.fetchval('''
+                        SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint
+                        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                        WHERE i.inhparent = 'daily_stats'::regclass
+                    ''')
+                    record_step("estimate_history", step_started, estimate)
                 except Exception as e:
-                    print(f"[DAILY_RESET] 创建标志文件失败: {e}")
-                
-                print(f"[DAILY_RESET] {current_date} - 跨天处理完成，昨天（{last_reset_date}）的数据已永久保存，今天的数据正常接收中")
-                
-                last_reset_date = current_date
-            
-        except Exception as e:
-            print(f"[DAILY_RESET] 错误: {e}")
-            time.sleep(60)  # 出错后等待1分钟再重试
+                    record_step("estimate_history", step_started)
+                    report["steps"][-1]["error"] = str(e)
 
-async def clear_today_stats_async(current_date):
-    """跨天后的清理工作：清空数据库中今天的数据（避免残留昨天的数据）
-    
-    注意：只删除今天（current_date）的数据，历史数据（昨天及以前）不会受影响
-    """
-    try:
-        if db_pool:
-            async with db_pool.acquire() as conn:
-                # 修复：清空数据库中今天的数据（如果存在）
-                # 因为可能是昨天跨天瞬间写入的残留数据，会导致今天显示昨天的值
-                # 注意：这里只删除 date = current_date（今天）的数据，不会影响历史数据
-                
-                # 先查询一下今天有多少条数据，用于日志
-                today_count = await conn.fetchval(
-                    'SELECT COUNT(*) FROM daily_stats WHERE date = $1',
-                    current_date
-                )
-                
-                if today_count and today_count > 0:
-                    print(f"[DAILY_RESET] 检测到今天（{current_date}）有 {today_count} 条数据，开始清空...")
-                    
-                    # 安全删除：只删除今天的数据，使用参数化查询防止SQL注入，并且确保不会误删历史数据
-                    deleted_today = await conn.execute(
-                        'DELETE FROM daily_stats WHERE date = $1',
-                        current_date
-                    )
-                    print(f"[DAILY_RESET] {current_date} - 已清空数据库中今天的数据（共 {today_count} 条），历史数据未受影响")
-                else:
-                    print(f"[DAILY_RESET] {current_date} - 今天没有数据需要清空")
-                
-                # 清除所有手动隐藏状态（每天重置）
-                deleted_count = await conn.fetchval(
-                    'DELETE FROM employee_visibility WHERE is_manual = TRUE RETURNING COUNT(*)'
-                )
-                if deleted_count:
-                    print(f"[DAILY_RESET] 已清除 {deleted_count} 个手动隐藏状态")
-                
-                # 验证历史数据是否保留（查询昨天及以前的数据数量）
-                yesterday = current_date - timedelta(days=1)
-                history_count = await conn.fetchval(
-                    'SELECT COUNT(*) FROM daily_stats WHERE date < $1',
-                    current_date
-                )
-                if history_count is not None:
-                    print(f"[DAILY_RESET] ✓ 历史数据验证：昨天及以前的数据已保留（共 {history_count} 条记录）")
-                
-                print(f"[DAILY_RESET] 跨天完成，历史数据已永久保存在数据库中，今天的数据将从0开始累积")
+        await live_state.notify_change()
+        report["success"] = True
     except Exception as e:
+        report["error"] = str(e)
         print(f"[DAILY_RESET] 清理失败: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        report["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        last_rollover_report = report
+        print(f"[DAILY_RESET] 跨天报告: {json.dumps(report, ensure_ascii=False)}")
+    return report
 
 @app.post("/clear_today_manual")
 async def clear_today_manual():
@@ -372,27 +1597,21 @@ async def clear_today_manual():
         today = get_beijing_today()
         
         # 1. 清空内存中的统计数据（强制清空所有员工，不管是否在线）
-        with active_employees_lock:
-            cleared_count = 0
-            total_employees = len(active_employees)
-            for eid, data in active_employees.items():
-                # 强制清空，不管当前值是多少
-                old_consult = data.get("today_consult", 0)
-                old_reply = data.get("avg_reply", 0)
-                data["today_consult"] = 0
-                data["avg_reply"] = 0
-                if old_consult > 0 or old_reply > 0:
-                    cleared_count += 1
-            print(f"[MANUAL_CLEAR] 已清空内存中 {cleared_count}/{total_employees} 个员工的当天统计数据")
+        cleared_count, total_employees = await live_state.clear_today()
+        print(f"[MANUAL_CLEAR] 已清空内存中 {cleared_count}/{total_employees} 个员工的当天统计数据")
         
-        # 2. 清空数据库中的当天数据
+        # 2. 清空数据库中的当天数据（同时丢弃写缓冲中尚未写入的当天数据）
+        async with report_buffer.paused():
+            report_buffer.discard(report_date=today)
+            if db_pool:
+                async with db_pool.acquire() as conn:
+                    result = await conn.execute(
+                        'DELETE FROM daily_stats WHERE date = $1',
+                        today
+                    )
+                    print(f"[MANUAL_CLEAR] 已清空数据库中的当天统计数据: {result}")
         if db_pool:
-            async with db_pool.acquire() as conn:
-                result = await conn.execute(
-                    'DELETE FROM daily_stats WHERE date = $1',
-                    today
-                )
-                print(f"[MANUAL_CLEAR] 已清空数据库中的当天统计数据: {result}")
+            await live_state.notify_change()
         
         return {
             "success": True,
@@ -407,6 +1626,10 @@ async def clear_today_manual():
 @app.post("/report")
 async def receive_report(data: ReportData):
     """接收员工上报数据"""
+    return await process_report(data)
+
+async def process_report(data: ReportData):
+    """处理一次员工上报（HTTP /report 和员工端持久通道共用）"""
     name = data.employee_name
     now = time.time()
     server_today = get_beijing_today()
@@ -455,76 +1678,192 @@ async def receive_report(data: ReportData):
     else:
         final_avg_reply = 0
     
-    # 使用锁保护内存数据更新
-    with active_employees_lock:
-        previous_data = active_employees.get(name, {})
-        data_changed = (
-            previous_data.get("total_customers") != data.total_customers or
-            previous_data.get("total_shops") != data.total_shops or
-            previous_data.get("today_consult") != final_consult or
-            previous_data.get("avg_reply") != final_avg_reply or
-            previous_data.get("shops_list") != data.shops_list
-        )
-        
-        # 更新内存中的活跃员工
-        active_employees[name] = {
-            "employee_name": name,
-            "date": data.report_date,  # 记录数据日期
-            "total_customers": data.total_customers,
-            "total_shops": data.total_shops,
-            "shops_list": data.shops_list,
-            "today_consult": final_consult,
-            "avg_reply": final_avg_reply,
-            "online": True,
-            "last_seen": now,
-            "data_changed": data_changed
-        }
-        print(f"[REPORT] 员工 {name} 上报数据，日期: {report_date}, 咨询量: {final_consult}, 平均回复: {final_avg_reply}秒")
-    
-    # 实时更新数据库
+    # 更新内存中的活跃员工（数据没变化时只刷新最后上报时间）
+    await live_state.record_report(name, {
+        "date": data.report_date,  # 记录数据日期
+        "total_customers": data.total_customers,
+        "total_shops": data.total_shops,
+        "shops_list": data.shops_list,
+        "today_consult": final_consult,
+        "today_replied": data.today_replied,  # 回复数和总回复时长供 /get_stats 读取（多进程时写缓冲不共享）
+        "total_reply_time": data.total_reply_time,
+        "avg_reply": final_avg_reply
+    }, now)
+
+    # 写入写缓冲，由后台任务批量写入数据库
     # 修复：如果日期是今天，直接覆盖（不使用GREATEST），确保跨天后今天的数据从0开始
     # 历史数据（昨天及以前）使用GREATEST取最大值，避免网络延迟导致的数据丢失
-    try:
-        async with db_pool.acquire() as conn:
-            if report_date == server_today:
-                # 今天的数据：直接覆盖（不使用GREATEST），确保跨天后重置为0
-                await conn.execute('''
-                    INSERT INTO daily_stats 
-                        (employee_id, date, total_consultations, replied_count, total_reply_time, avg_reply)
-                    VALUES ($1, $2, $3, $4, $5, $6)
-                    ON CONFLICT (employee_id, date) 
-                    DO UPDATE SET 
-                        total_consultations = EXCLUDED.total_consultations,
-                        replied_count = EXCLUDED.replied_count,
-                        total_reply_time = EXCLUDED.total_reply_time,
-                        avg_reply = EXCLUDED.avg_reply
-                ''', name, report_date, final_consult, data.today_replied, data.total_reply_time, final_avg_reply)
-            else:
-                # 历史数据：使用GREATEST取最大值，避免网络延迟导致的数据丢失
-                await conn.execute('''
-                    INSERT INTO daily_stats 
-                        (employee_id, date, total_consultations, replied_count, total_reply_time, avg_reply)
-                    VALUES ($1, $2, $3, $4, $5, $6)
-                    ON CONFLICT (employee_id, date) 
-                    DO UPDATE SET 
-                        total_consultations = GREATEST(daily_stats.total_consultations, EXCLUDED.total_consultations),
-                        replied_count = GREATEST(daily_stats.replied_count, EXCLUDED.replied_count),
-                        total_reply_time = GREATEST(daily_stats.total_reply_time, EXCLUDED.total_reply_time),
-                        avg_reply = EXCLUDED.avg_reply
-                ''', name, report_date, final_consult, data.today_replied, data.total_reply_time, final_avg_reply)
-    except Exception as e:
-        print(f"DB write error: {e}")
-    
+    # 计数（咨询数、回复数、总回复时长）没有变化时不写数据库，也不打印日志
+    persisted = report_buffer.add(
+        name, report_date, final_consult, data.today_replied, data.total_reply_time, final_avg_reply,
+        overwrite=(report_date == server_today)
+    )
+    if persisted:
+        report_counters["persisted"] += 1
+        print(f"[REPORT] 员工 {name} 上报数据，日期: {report_date}, 咨询量: {final_consult}, 平均回复: {final_avg_reply}秒")
+    else:
+        report_counters["skipped"] += 1
+
     return {"status": "ok"}
 
 # /update_stats 接口已删除，功能已合并到 /report 接口
 
+CHANNEL_PROTOCOL_VERSION = 2  # 员工端通道支持的最高协议版本
+
+@app.websocket("/ws/employee/{employee_id}")
+async def employee_channel(websocket: WebSocket, employee_id: str):
+    """员工端持久通道（WebSocket）
+
+    协议v1（JSON文本帧，不发送hello的旧版员工端）：
+      上行：{"type": "report", "data": {...ReportData}} 数据变化时上报，回复 {"type": "ack", ...}；
+            {"type": "heartbeat"} 数据没变化时定期发送，只刷新在线状态，
+            服务器上没有该员工数据时回复 {"type": "resync"}，员工端随后重新上报完整数据。
+      下行：{"type": "messages", "messages": [...]} 管理端发送的消息（代替 /poll_messages 长轮询）。
+
+    协议v2（连接后先发送 {"type": "hello", "version": 2, "encodings": ["msgpack", "json"]}）：
+      服务器回复 {"type": "hello", "version": 2, "encoding": ...}，之后双方使用协商好的编码（msgpack为二进制帧）。
+      上行 {"type": "delta", "seq": n, "base": m, "ts": 时间戳, "fields": {...}} 只包含相对序号m的上报变化的字段，
+      base=0 表示完整数据。服务器合并到本连接保存的数据后按普通上报处理，回复 {"type": "ack", "seq": n, ...}；
+      base 与服务器已合并的序号不一致时回复 {"type": "resync"}，员工端随后发送完整数据。
+
+    下行消息在协商完成（回复hello）或收到旧版员工端的第一帧之后才开始推送，
+    否则排队中的消息可能先于hello回复到达，被员工端当作协商结果。
+    """
+    await websocket.accept()
+    print(f"[通道] 员工 {employee_id} 已连接")
+    send_lock = asyncio.Lock()
+    channel = {"encoding": "json"}
+    state = {}  # 协议v2：已合并的上报数据
+    applied_seq = 0  # 协议v2：已合并的序号
+
+    async def send(frame):
+        async with send_lock:
+            if channel["encoding"] == "msgpack":
+                await websocket.send_bytes(msgpack.packb(frame))
+            else:
+                await websocket.send_text(json.dumps(frame, ensure_ascii=False))
+
+    async def receive():
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        if message.get("bytes") is not None:
+            if msgpack is None:
+                raise ValueError("服务器未安装msgpack，无法解析二进制帧")
+            return msgpack.unpackb(message["bytes"])
+        return json.loads(message["text"])
+
+    async def push_messages():
+        while True:
+            messages = await live_state.wait_messages(employee_id, timeout=30.0)
+            if not messages:
+                continue
+            try:
+                await send({"type": "messages", "messages": messages})
+            except (Exception, asyncio.CancelledError) as e:
+                # 消息已经从队列中取出，发送失败（员工端在推送途中断开）时放回队列，重连或长轮询时重新发送
+                await live_state.requeue_messages(employee_id, messages)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                print(f"[通道] 员工 {employee_id} 消息推送失败，{len(messages)} 条消息已放回队列: {e}")
+                return
+
+    push_task = None
+
+    def start_push():
+        nonlocal push_task
+        if push_task is None:
+            push_task = asyncio.create_task(push_messages())
+
+    try:
+        while True:
+            frame = await receive()
+            frame_type = frame.get("type")
+            if frame_type != "hello":
+                start_push()  # 旧版员工端不发送hello，收到第一帧后开始推送
+            if frame_type == "delta":
+                seq, base = frame.get("seq", 0), frame.get("base", 0)
+                if base and base != applied_seq:
+                    await send({"type": "resync"})
+                    continue
+                merged = {**state, **frame.get("fields", {})} if base else dict(frame.get("fields", {}))
+                merged["employee_name"] = employee_id
+                merged["report_timestamp"] = frame.get("ts")
+                try:
+                    data = ReportData(**merged)
+                except Exception as e:
+                    await send({"type": "error", "message": f"数据格式错误: {e}"})
+                    continue
+                state, applied_seq = merged, seq
+                result = await process_report(data)
+                await send({"type": "ack", "seq": seq, **result})
+            elif frame_type == "report":
+                try:
+                    data = ReportData(**frame.get("data", {}))
+                except Exception as e:
+                    await send({"type": "error", "message": f"数据格式错误: {e}"})
+                    continue
+                if data.employee_name != employee_id:
+                    await send({"type": "error", "message": "员工ID与通道不一致"})
+                    continue
+                result = await process_report(data)
+                await send({"type": "ack", **result})
+            elif frame_type == "heartbeat":
+                if not await live_state.touch(employee_id, time.time()):
+                    if state:
+                        # 协议v2：用本连接保存的数据重新上报
+                        await process_report(ReportData(**{**state, "report_timestamp": time.time()}))
+                    else:
+                        await send({"type": "resync"})
+            elif frame_type == "hello":
+                version = min(int(frame.get("version", 1)), CHANNEL_PROTOCOL_VERSION)
+                encodings = frame.get("encodings", ["json"])
+                encoding = "msgpack" if msgpack is not None and "msgpack" in encodings else "json"
+                # 回复使用JSON，之后才切换编码
+                await send({"type": "hello", "version": version, "encoding": encoding})
+                channel["encoding"] = encoding
+                print(f"[通道] 员工 {employee_id} 使用协议v{version}，编码 {encoding}")
+                start_push()
+            else:
+                await send({"type": "error", "message": f"未知的消息类型: {frame_type}"})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"[通道] 员工 {employee_id} 通道错误: {e}")
+    finally:
+        if push_task is not None:
+            push_task.cancel()
+        print(f"[通道] 员工 {employee_id} 已断开")
+
 @app.get("/get_stats")
 async def get_stats(employee_name: str = Query(..., description="员工名称")):
     """获取员工当天的统计数据"""
     today = get_beijing_today()
-    
+
+    # 优先返回写缓冲中尚未写入数据库的最新数据
+    pending = report_buffer.get(employee_name, today)
+    if pending:
+        consult, replied, total_reply_time, avg_reply, _ = pending
+        return {
+            "data_date": str(today),
+            "today_consult": consult,
+            "replied_count": replied,
+            "total_reply_time": float(total_reply_time),
+            "avg_reply": int(avg_reply)
+        }
+
     try:
+        # 多进程时员工的最新数据可能还在其他进程的写缓冲中，实时状态是各进程共享的，其次使用
+        live = (await live_state.snapshot()).get(employee_name)
+        if live and live.get("date") in (None, str(today)) and "today_replied" in live:
+            return {
+                "data_date": str(today),
+                "today_consult": live["today_consult"],
+                "replied_count": live["today_replied"],
+                "total_reply_time": float(live["total_reply_time"]),
+                "avg_reply": int(live["avg_reply"])
+            }
+
         async with db_pool.acquire() as conn:
             row = await conn.fetchrow('''
                 SELECT total_consultations, replied_count, total_reply_time, avg_reply, date
@@ -572,6 +1911,8 @@ async def rename_employee(data: RenameEmployee):
                 ON CONFLICT (original_id) 
                 DO UPDATE SET display_name = EXCLUDED.display_name
             ''', data.original_id, data.new_name.strip())
+            await meta_cache.changed(conn)
+        await live_state.notify_change()
     except Exception as e:
         print(f"DB rename error: {e}")
         raise HTTPException(status_code=500, detail="数据库错误")
@@ -583,27 +1924,36 @@ async def delete_employee(data: DeleteEmployee):
     """删除员工记录"""
     if not data.employee_id or not data.employee_id.strip():
         raise HTTPException(status_code=400, detail="无效参数")
-    
+
     try:
-        async with db_pool.acquire() as conn:
+        # 暂停写缓冲刷新，丢弃该员工尚未写入的数据后再删除，避免删除后又被写回数据库
+        async with report_buffer.paused():
             if data.delete_all:
-                # 删除所有记录
-                await conn.execute(
-                    'DELETE FROM daily_stats WHERE employee_id = $1',
-                    data.employee_id.strip()
-                )
-                await conn.execute(
-                    'DELETE FROM employee_meta WHERE original_id = $1',
-                    data.employee_id.strip()
-                )
+                report_buffer.discard(employee_id=data.employee_id.strip())
             else:
-                # 只删除今日记录
-                today = get_beijing_today()
-                await conn.execute(
-                    'DELETE FROM daily_stats WHERE employee_id = $1 AND date = $2',
-                    data.employee_id.strip(), today
-                )
-                # 注意：不删除employee_meta，保留元数据
+                report_buffer.discard(employee_id=data.employee_id.strip(), report_date=get_beijing_today())
+
+            async with db_pool.acquire() as conn:
+                if data.delete_all:
+                    # 删除所有记录
+                    await conn.execute(
+                        'DELETE FROM daily_stats WHERE employee_id = $1',
+                        data.employee_id.strip()
+                    )
+                    await conn.execute(
+                        'DELETE FROM employee_meta WHERE original_id = $1',
+                        data.employee_id.strip()
+                    )
+                    await meta_cache.changed(conn)
+                else:
+                    # 只删除今日记录
+                    today = get_beijing_today()
+                    await conn.execute(
+                        'DELETE FROM daily_stats WHERE employee_id = $1 AND date = $2',
+                        data.employee_id.strip(), today
+                    )
+                    # 注意：不删除employee_meta，保留元数据
+        await live_state.notify_change()
     except Exception as e:
         print(f"DB delete error: {e}")
         raise HTTPException(status_code=500, detail=f"数据库错误: {str(e)}")
@@ -614,102 +1964,69 @@ async def delete_employee(data: DeleteEmployee):
 async def get_color_configs(employee_ids: Optional[str] = Query(default=None, description="员工ID列表，逗号分隔")):
     """获取员工颜色配置"""
     try:
-        async with db_pool.acquire() as conn:
-            # 确保字段存在
-            try:
-                await conn.execute('ALTER TABLE employee_meta ADD COLUMN IF NOT EXISTS bar_color TEXT')
-                await conn.execute('ALTER TABLE employee_meta ADD COLUMN IF NOT EXISTS line_color TEXT')
-            except Exception:
-                pass  # 字段已存在
-            
-            # 获取全局线形图颜色
-            global_record = await conn.fetchrow(
-                'SELECT line_color FROM employee_meta WHERE original_id = $1',
-                '__global__'
-            )
-            global_line_color = global_record['line_color'] if global_record and global_record.get('line_color') else '#2196F3'
-            
-            result = {"global_line_color": global_line_color, "employee_colors": {}}
-            
-            # 如果指定了员工ID列表，只查询这些员工
-            if employee_ids:
-                employee_id_list = [eid.strip() for eid in employee_ids.split(',') if eid.strip()]
-                if employee_id_list:
-                    records = await conn.fetch(
-                        'SELECT original_id, bar_color FROM employee_meta WHERE original_id = ANY($1::text[])',
-                        employee_id_list
-                    )
-                    for row in records:
-                        result["employee_colors"][row['original_id']] = {
-                            "bar_color": row.get('bar_color') or '#4CAF50'
-                        }
-            else:
-                # 查询所有员工的颜色配置
-                records = await conn.fetch('SELECT original_id, bar_color FROM employee_meta WHERE original_id != $1', '__global__')
-                for row in records:
-                    result["employee_colors"][row['original_id']] = {
-                        "bar_color": row.get('bar_color') or '#4CAF50'
-                    }
-            
-            return result
+        meta = await meta_cache.get()
+        result = {"global_line_color": meta.global_line_color or '#2196F3', "employee_colors": {}}
+        
+        # 如果指定了员工ID列表，只返回这些员工
+        if employee_ids:
+            employee_id_list = [eid.strip() for eid in employee_ids.split(',') if eid.strip()]
+            selected = [eid for eid in employee_id_list if eid in meta.bar_colors]
+        else:
+            # 所有员工的颜色配置
+            selected = [eid for eid in meta.bar_colors if eid != '__global__']
+        for employee_id in selected:
+            result["employee_colors"][employee_id] = {
+                "bar_color": meta.bar_colors[employee_id] or '#4CAF50'
+            }
+        
+        return result
     except Exception as e:
         print(f"DB get_color_configs error: {e}")
         return {"global_line_color": "#2196F3", "employee_colors": {}}
 
 @app.post("/save_color_configs")
 async def save_color_configs(data: SaveColorsRequest):
-    """保存颜色配置"""
+    """保存颜色配置（批量写入：不论员工数量多少，都只在一个事务中执行固定几条语句）"""
+    # 同一员工出现多次时以最后一次为准（一条 INSERT ... ON CONFLICT 不能修改同一行两次）
+    colors = {
+        c.employee_id: c.bar_color
+        for c in data.colors
+        if c.employee_id and c.employee_id != '__global__'
+    }
+    with_color = [(eid, color) for eid, color in colors.items() if color]
+    without_color = [eid for eid, color in colors.items() if not color]
+    affected = 0
     try:
         async with db_pool.acquire() as conn:
-            # 确保字段存在
-            try:
-                await conn.execute('ALTER TABLE employee_meta ADD COLUMN IF NOT EXISTS bar_color TEXT')
-                await conn.execute('ALTER TABLE employee_meta ADD COLUMN IF NOT EXISTS line_color TEXT')
-            except Exception:
-                pass  # 字段已存在
-            
-            # 保存全局线形图颜色
-            if data.global_line_color:
-                exists_global = await conn.fetchrow(
-                    'SELECT original_id FROM employee_meta WHERE original_id = $1',
-                    '__global__'
-                )
-                if exists_global:
-                    await conn.execute(
-                        'UPDATE employee_meta SET line_color = $1 WHERE original_id = $2',
-                        data.global_line_color, '__global__'
-                    )
-                else:
-                    await conn.execute(
-                        'INSERT INTO employee_meta (original_id, display_name, line_color) VALUES ($1, $2, $3)',
-                        '__global__', '全局设置', data.global_line_color
-                    )
-            
-            # 保存每个员工的颜色配置
-            for color_config in data.colors:
-                if not color_config.employee_id or color_config.employee_id == '__global__':
-                    continue
-                
-                exists = await conn.fetchrow(
-                    'SELECT original_id FROM employee_meta WHERE original_id = $1',
-                    color_config.employee_id
-                )
-                
-                if exists:
-                    # 更新
-                    if color_config.bar_color:
-                        await conn.execute(
-                            'UPDATE employee_meta SET bar_color = $1 WHERE original_id = $2',
-                            color_config.bar_color, color_config.employee_id
-                        )
-                else:
-                    # 插入
-                    await conn.execute(
-                        'INSERT INTO employee_meta (original_id, display_name, bar_color) VALUES ($1, $2, $3)',
-                        color_config.employee_id, color_config.employee_id, color_config.bar_color or '#4CAF50'
-                    )
-            
-            return {"success": True, "message": "颜色配置已保存"}
+            async with conn.transaction():
+                # 保存全局线形图颜色
+                if data.global_line_color:
+                    status = await conn.execute('''
+                        INSERT INTO employee_meta (original_id, display_name, line_color) VALUES ($1, $2, $3)
+                        ON CONFLICT (original_id) DO UPDATE SET line_color = EXCLUDED.line_color
+                    ''', '__global__', '全局设置', data.global_line_color)
+                    affected += affected_rows(status)
+
+                # 指定了颜色的员工：没有记录时插入，有记录时更新颜色
+                if with_color:
+                    status = await conn.execute('''
+                        INSERT INTO employee_meta (original_id, display_name, bar_color)
+                        SELECT id, id, color FROM unnest($1::text[], $2::text[]) AS t(id, color)
+                        ON CONFLICT (original_id) DO UPDATE SET bar_color = EXCLUDED.bar_color
+                    ''', [eid for eid, _ in with_color], [color for _, color in with_color])
+                    affected += affected_rows(status)
+
+                # 没有指定颜色的员工：只为没有记录的员工插入默认颜色
+                if without_color:
+                    status = await conn.execute('''
+                        INSERT INTO employee_meta (original_id, display_name, bar_color)
+                        SELECT id, id, '#4CAF50' FROM unnest($1::text[]) AS t(id)
+                        ON CONFLICT (original_id) DO NOTHING
+                    ''', without_color)
+                    affected += affected_rows(status)
+
+            await meta_cache.changed(conn)
+            return {"success": True, "message": "颜色配置已保存", "affected": affected}
     except Exception as e:
         print(f"DB save_color_configs error: {e}")
         raise HTTPException(status_code=500, detail=f"数据库错误: {str(e)}")
@@ -718,95 +2035,195 @@ async def save_color_configs(data: SaveColorsRequest):
 async def get_employee_order():
     """获取员工排序配置"""
     try:
-        async with db_pool.acquire() as conn:
-            # 确保字段存在
-            try:
-                await conn.execute('ALTER TABLE employee_meta ADD COLUMN IF NOT EXISTS sort_order INTEGER DEFAULT 9999')
-            except Exception:
-                pass
-            
-            records = await conn.fetch('SELECT original_id, sort_order FROM employee_meta WHERE sort_order IS NOT NULL ORDER BY sort_order')
-            result = [{"employee_id": row['original_id'], "order": row['sort_order']} for row in records]
-            return result
+        meta = await meta_cache.get()
+        orders = sorted(meta.sort_orders.items(), key=lambda item: item[1])
+        return [{"employee_id": employee_id, "order": order} for employee_id, order in orders]
     except Exception as e:
         print(f"DB get_employee_order error: {e}")
         return []
 
 @app.post("/save_employee_order")
 async def save_employee_order(data: SaveOrderRequest):
-    """保存员工排序配置"""
+    """保存员工排序配置（批量写入，一条语句完成）"""
+    orders = {o.employee_id: o.order for o in data.orders}  # 同一员工出现多次时以最后一次为准
     try:
         async with db_pool.acquire() as conn:
-            # 确保字段存在
-            try:
-                await conn.execute('ALTER TABLE employee_meta ADD COLUMN IF NOT EXISTS sort_order INTEGER DEFAULT 9999')
-            except Exception:
-                pass
-            
-            # 保存每个员工的排序
-            for order_info in data.orders:
-                exists = await conn.fetchrow(
-                    'SELECT original_id FROM employee_meta WHERE original_id = $1',
-                    order_info.employee_id
-                )
-                
-                if exists:
-                    # 更新排序
-                    await conn.execute(
-                        'UPDATE employee_meta SET sort_order = $1 WHERE original_id = $2',
-                        order_info.order, order_info.employee_id
-                    )
-                else:
-                    # 插入（如果没有记录，使用employee_id作为display_name）
-                    await conn.execute(
-                        'INSERT INTO employee_meta (original_id, display_name, sort_order) VALUES ($1, $2, $3)',
-                        order_info.employee_id, order_info.employee_id, order_info.order
-                    )
-            
-            return {"success": True, "message": "排序配置已保存"}
+            # 没有记录的员工使用employee_id作为display_name
+            status = await conn.execute('''
+                INSERT INTO employee_meta (original_id, display_name, sort_order)
+                SELECT id, id, sort_order FROM unnest($1::text[], $2::int[]) AS t(id, sort_order)
+                ON CONFLICT (original_id) DO UPDATE SET sort_order = EXCLUDED.sort_order
+            ''', list(orders), list(orders.values()))
+            await meta_cache.changed(conn)
+
+            return {"success": True, "message": "排序配置已保存", "affected": affected_rows(status)}
     except Exception as e:
         print(f"DB save_employee_order error: {e}")
         raise HTTPException(status_code=500, detail=f"数据库错误: {str(e)}")
 
-@app.get("/employees", response_model=List[EmployeeResponse])
-async def get_employees():
-    """获取所有员工信息"""
-    try:
+class EmployeeMetaCache:
+    """员工元数据缓存：显示名称、颜色、排序（employee_meta）、可见性（employee_visibility）和全局显示模式
+
+    启动时加载，之后读接口直接使用内存中的数据，不再每次请求都查询数据库。
+    写接口修改后调用 changed()：本进程立即失效，并通过 qn_meta_changes 通知其他进程（postgres 后端时监听）。
+    失效后下一次 get() 重新加载。
+    """
+
+    CHANNEL = "qn_meta_changes"
+
+    def __init__(self):
+        self.names = {}  # {original_id: display_name}
+        self.bar_colors = {}  # {original_id: bar_color}（没有设置颜色时为None）
+        self.global_line_color = None
+        self.sort_orders = {}  # {original_id: sort_order}（不含未设置排序的员工）
+        self.visibility = {}  # {employee_id: (hidden, is_manual)}
+        self.show_all = False  # 全局显示模式（global_visibility_mode）
+        self.load_count = 0  # 每次重新加载递增（/metrics 输出）
+        self.digest = None  # 元数据内容摘要，/dashboard 的版本号使用它标识元数据的版本
+        self._generation = 0  # 每次失效递增
+        self._loaded_generation = -1  # 当前数据加载时的 _generation
+        self._lock = asyncio.Lock()
+        self._listener = None
+
+    async def start(self):
+        """加载数据；多进程部署时监听其他进程的修改通知"""
+        if LIVE_STATE_BACKEND == "postgres":
+            self._listener = ListenConnection({self.CHANNEL: self._on_notify}, on_reconnect=self._on_listen_reconnect)
+            await self._listener.start()
+        await self.get()
+
+    async def stop(self):
+        if self._listener:
+            await self._listener.stop()
+            self._listener = None
+
+    def _on_listen_reconnect(self):
+        """断开期间其他进程的修改通知已经丢失，重新加载一次"""
+        self.invalidate()
+        live_state.mark_changed()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        """其他进程修改了元数据（payload为发送方的进程号，本进程发出的通知已经处理过）"""
+        if payload != str(os.getpid()):
+            self.invalidate()
+            live_state.mark_changed()  # 显示名称可能变化，/employees 快照需要重建
+
+    def invalidate(self):
+        self._generation += 1
+
+    async def changed(self, conn):
+        """元数据写入（并提交）后调用"""
+        self.invalidate()
+        await conn.execute('SELECT pg_notify($1, $2)', self.CHANNEL, str(os.getpid()))
+
+    async def get(self):
+        """返回最新的元数据（失效后重新加载）"""
+        if self._loaded_generation == self._generation:
+            return self
+        async with self._lock:
+            if self._loaded_generation != self._generation:
+                # 先记下失效序号再查询，查询期间的修改会让下一次 get() 重新加载
+                generation = self._generation
+                async with db_pool.acquire() as conn:
+                    meta_rows = await fetch_query(conn, "employee_meta")
+                    visibility_rows = await fetch_query(conn, "employee_visibility")
+                    mode_rows = await fetch_query(conn, "global_visibility_mode")
+                global_row = next((row for row in meta_rows if row['original_id'] == '__global__'), None)
+                self.names = {row['original_id']: row['display_name'] for row in meta_rows}
+                self.bar_colors = {row['original_id']: row['bar_color'] for row in meta_rows}
+                self.global_line_color = global_row['line_color'] if global_row else None
+                self.sort_orders = {row['original_id']: row['sort_order'] for row in meta_rows if row['sort_order'] is not None}
+                self.visibility = {row['employee_id']: (row['hidden'], row['is_manual']) for row in visibility_rows}
+                self.show_all = bool(mode_rows and mode_rows[0]['show_all'])
+                self.digest = content_digest([
+                    self.names, self.bar_colors, self.global_line_color, self.sort_orders, self.visibility, self.show_all
+                ])
+                self._loaded_generation = generation
+                self.load_count += 1
+        return self
+
+meta_cache = EmployeeMetaCache()
+
+class EmployeeSnapshotCache:
+    """/employees 的快照缓存
+
+    管理端每0.5秒轮询一次 /employees，但数据只在员工上报内容变化、上下线、改名/删除时才会改变。
+    这里把结果序列化成JSON字节缓存起来，只有 live_state.version 变化或者有在线员工即将超时离线时才重建，
+    其余请求直接返回缓存（带ETag，内容没变时返回304）。
+
+    重建时逐行比较，记录每个员工最后变化的快照序号和被移除员工的序号（墓碑），
+    /employees/changes 据此只返回某个序号之后变化过的行。
+
+    多进程部署（QN_WORKERS>1）时：
+    - ETag 是快照内容的摘要，快照只由共享的数据（数据库、live_employees）构建，
+      内容相同时各进程的 ETag 相同，请求落到哪个进程都能返回304；
+    - 快照序号只在同一进程内有意义（epoch 标识进程），请求落到其他进程时 changes_since 返回全量（full=True），
+      增量更新退化为全量更新，但结果仍然正确，管理端收到全量后替换整个表格。
+    """
+
+    MAX_TOMBSTONES = 1000  # 最多保留的移除记录数，超出后更早的序号只能返回全量
+
+    def __init__(self):
+        self.body = None  # 序列化好的JSON字节
+        self.etag = None
+        self.version = 0  # 快照序号，每次重建递增
+        self.rebuild_count = 0
+        self._state_version = -1  # 构建快照时的 live_state.version
+        self.digest = None  # 快照内容摘要（ETag）
+        self._etag_prefix = os.urandom(4).hex()  # 多进程部署时区分不同进程的快照序号
+        self._lock = asyncio.Lock()
+        self._rows = {}  # {employee_name: 行数据}
+        self._row_versions = {}  # {employee_name: 该行最后变化时的快照序号}
+        self._removed = {}  # {employee_name: 被移除时的快照序号}
+        self._delta_floor = 0  # 早于该序号的增量请求无法计算，返回全量
+
+    @property
+    def epoch(self):
+        """快照序号所属的进程标识（序号只在同一进程内可比较）"""
+        return self._etag_prefix
+
+    def _is_fresh(self):
+        # 员工超时离线时会从实时状态中移除并递增版本号，所以只需比较版本号
+        return self.body is not None and self._state_version == live_state.version
+
+    async def get(self):
+        """返回最新的快照（必要时重建）"""
+        if self._is_fresh():
+            return self
+        async with self._lock:
+            # 等锁期间可能已经被其他请求重建过了
+            if not self._is_fresh():
+                await self._rebuild()
+        return self
+
+    async def _rebuild(self):
+        # 先记下版本号再查询，查询期间发生的变化会让下一次请求重新构建
+        state_version = live_state.version
+        today = get_beijing_today()  # 使用北京时间的date对象
+        # 获取自定义名称
+        name_map = (await meta_cache.get()).names
         async with db_pool.acquire() as conn:
             # 获取今日所有有记录的员工
-            today = get_beijing_today()  # 使用北京时间的date对象
-            db_records = await conn.fetch('''
-                SELECT employee_id, total_consultations, avg_reply 
-                FROM daily_stats 
-                WHERE date = $1
-            ''', today)
-            db_records_dict = {
-                row['employee_id']: {
-                    "consult": row['total_consultations'], 
-                    "avg": int(row['avg_reply'])
-                } 
-                for row in db_records
-            }
-            
-            # 获取自定义名称
-            name_records = await conn.fetch('SELECT original_id, display_name FROM employee_meta')
-            name_map = {row['original_id']: row['display_name'] for row in name_records}
-        
+            db_records = await fetch_query(conn, "today_stats", today)
+        db_records_dict = {
+            row['employee_id']: {
+                "consult": row['total_consultations'], 
+                "avg": int(row['avg_reply'])
+            } 
+            for row in db_records
+        }
+        # 合并写缓冲中尚未写入数据库的数据（单进程时）
+        # 多进程时写缓冲是各进程私有的，合并后各进程的快照会不一致；刚上报过的员工都在线，
+        # 数据取自共享的实时状态，写缓冲只在员工离线后的一个刷新间隔内领先数据库，不合并也不会丢失数据
+        if LIVE_STATE_BACKEND != "postgres":
+            for employee_id, (consult, _, _, avg_reply, _) in report_buffer.pending_for_date(today).items():
+                db_records_dict[employee_id] = {"consult": consult, "avg": int(avg_reply)}
+
         result = []
-        now = time.time()
-        
-        # 添加活跃员工（使用锁保护）
-        with active_employees_lock:
-            employees_copy = dict(active_employees)  # 复制一份避免长时间持有锁
-        
+
+        # 添加在线员工（1分钟内有上报的员工，超时后由 presence_expiry 任务立即移除）
+        employees_copy = await live_state.snapshot()
         for name, data in employees_copy.items():
-            # 判断是否在线：1分钟内有上报即认为在线（不要求数据变化）
-            time_since_last_seen = now - data.get("last_seen", 0)
-            is_online = time_since_last_seen <= 60
-            
-            if not is_online:
-                print(f"[GET_EMPLOYEES] 员工 {name} 显示为离线，距离上次上报 {time_since_last_seen:.1f} 秒")
-            
             result.append(EmployeeResponse(
                 employee_name=name,
                 display_name=name_map.get(name, name),
@@ -815,10 +2232,10 @@ async def get_employees():
                 shops_list=data["shops_list"],
                 today_consult=data["today_consult"],
                 avg_reply=data["avg_reply"],
-                online=is_online
-            ))
+                online=True
+            ).model_dump())
             db_records_dict.pop(name, None)
-        
+
         # 添加今日有数据但已离线的员工
         for name, stats in db_records_dict.items():
             result.append(EmployeeResponse(
@@ -830,14 +2247,173 @@ async def get_employees():
                 today_consult=stats["consult"],
                 avg_reply=stats["avg"],
                 online=False
-            ))
-        
-        return result
-        
+            ).model_dump())
+
+        # 按员工排序，相同的数据在各进程中序列化出相同的字节（管理端自行排序显示）
+        result.sort(key=lambda row: row["employee_name"])
+        self.body = json.dumps(result, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.version += 1
+        self.rebuild_count += 1
+        self._record_row_changes(result)
+        self.digest = content_digest(self.body)
+        self.etag = f'"{self.digest}"'
+        self._state_version = state_version
+
+    def _record_row_changes(self, result):
+        """对比新旧快照，记录变化行和被移除行的序号"""
+        rows = {row["employee_name"]: row for row in result}
+        for name, row in rows.items():
+            if self._rows.get(name) != row:
+                self._row_versions[name] = self.version
+                self._removed.pop(name, None)
+        for name in self._rows.keys() - rows.keys():
+            self._row_versions.pop(name, None)
+            self._removed[name] = self.version
+        self._rows = rows
+
+        # 墓碑按序号递增插入，超出上限时丢弃最早的，并提高可计算增量的下限
+        while len(self._removed) > self.MAX_TOMBSTONES:
+            name = next(iter(self._removed))
+            self._delta_floor = max(self._delta_floor, self._removed.pop(name))
+
+    def changes_since(self, since, epoch=None):
+        """返回 since 之后变化的行和被移除的员工；无法计算增量时返回全量（full=True）"""
+        full = epoch != self.epoch or since < self._delta_floor or since > self.version
+        if full:
+            changed = list(self._rows.values())
+            removed = []
+        else:
+            changed = [self._rows[name] for name, version in self._row_versions.items() if version > since]
+            removed = [name for name, version in self._removed.items() if version > since]
+        return {
+            "epoch": self.epoch,
+            "version": self.version,
+            "full": full,
+            "changed": changed,
+            "removed": removed
+        }
+
+employee_snapshot = EmployeeSnapshotCache()
+
+@app.get("/employees", response_model=List[EmployeeResponse])
+async def get_employees(request: Request):
+    """获取所有员工信息（返回快照缓存，If-None-Match 命中时返回304）"""
+    try:
+        snapshot = await employee_snapshot.get()
     except Exception as e:
         print(f"DB read error in /employees: {e}")
         return []
 
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == snapshot.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+@app.get("/employees/changes")
+async def get_employee_changes(
+    since: int = Query(default=0, description="客户端已有的快照序号"),
+    epoch: Optional[str] = Query(default=None, description="客户端快照序号所属的进程标识")
+):
+    """获取指定快照序号之后变化的员工行（增量更新实时表格）"""
+    try:
+        snapshot = await employee_snapshot.get()
+    except Exception as e:
+        print(f"DB read error in /employees/changes: {e}")
+        raise HTTPException(status_code=500, detail="数据库错误")
+    return snapshot.changes_since(since, epoch)
+
+STREAM_HEARTBEAT_INTERVAL = 15  # 推送流空闲时发送心跳的间隔（秒），用于保持连接和发现断开的客户端
+
+@app.get("/employees/stream")
+async def stream_employee_changes(
+    request: Request,
+    since: int = Query(default=0, description="客户端已有的快照序号"),
+    epoch: Optional[str] = Query(default=None, description="客户端快照序号所属的进程标识")
+):
+    """推送员工数据变化（Server-Sent Events）
+
+    每当上报、上下线、改名等导致员工数据变化时推送一条 delta 事件，格式与 /employees/changes 相同；
+    第一条事件是相对 since 的增量（since 无效时为全量）。
+    """
+    async def event_stream():
+        cursor_version, cursor_epoch = since, epoch
+        last_sent = time.time()
+        while not await request.is_disconnected():
+            # 先记下版本号，获取快照期间发生的变化会让下面的等待立即返回
+            state_version = live_state.version
+            try:
+                snapshot = await employee_snapshot.get()
+                delta = snapshot.changes_since(cursor_version, cursor_epoch)
+            except Exception as e:
+                print(f"DB read error in /employees/stream: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            cursor_version, cursor_epoch = delta["version"], delta["epoch"]
+            now = time.time()
+            if delta["full"] or delta["changed"] or delta["removed"]:
+                yield f"event: delta\ndata: {json.dumps(delta, ensure_ascii=False)}\n\n"
+                last_sent = now
+            elif now - last_sent >= STREAM_HEARTBEAT_INTERVAL:
+                yield ": heartbeat\n\n"
+                last_sent = now
+
+            # 等待实时数据变化（包括员工超时离线）
+            await live_state.wait_change(state_version, STREAM_HEARTBEAT_INTERVAL)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/dashboard")
+async def get_dashboard(
+    request: Request,
+    since: int = Query(default=0, description="客户端已有的快照序号"),
+    epoch: Optional[str] = Query(default=None, description="客户端快照序号所属的进程标识")
+):
+    """管理端一次刷新需要的全部数据：实时员工行、排序、可见性、全局显示模式和颜色
+
+    employees 的格式与 /employees/changes 相同（since 有效时只包含变化的行），其余部分是全量的元数据。
+    version 由快照内容摘要和元数据内容摘要组成（与进程无关），If-None-Match 与它相同时返回304。
+    """
+    try:
+        snapshot = await employee_snapshot.get()
+        meta = await meta_cache.get()
+    except Exception as e:
+        print(f"DB read error in /dashboard: {e}")
+        raise HTTPException(status_code=500, detail="数据库错误")
+
+    version = f"{snapshot.digest}-{meta.digest}"
+    headers = {"ETag": f'"{version}"', "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    body = {
+        "version": version,
+        "employees": snapshot.changes_since(since, epoch),
+        "order": meta.sort_orders,
+        "visibility": {
+            employee_id: {"hidden": hidden, "is_manual": is_manual}
+            for employee_id, (hidden, is_manual) in meta.visibility.items()
+        },
+        "show_all": meta.show_all,
+        "colors": {
+            "global_line_color": meta.global_line_color or '#2196F3',
+            "employee_colors": {
+                employee_id: {"bar_color": color or '#4CAF50'}
+                for employee_id, color in meta.bar_colors.items()
+                if employee_id != '__global__'
+            }
+        }
+    }
+    return Response(
+        content=json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+        media_type="application/json",
+        headers=headers
+    )
+
 @app.get("/history", response_model=List[HistoryRecord])
 async def get_history(
     employee_id: str = Query(default="", description="员工ID"),
@@ -848,53 +2424,33 @@ async def get_history(
     """查询历史统计"""
     try:
         async with db_pool.acquire() as conn:
-            conditions = []
-            params = []
-            param_count = 1
-            
-            if employee_id:
-                conditions.append(f"employee_id = ${param_count}")
-                params.append(employee_id)
-                param_count += 1
-            
+            # 各周期都换算成日期范围，使用固定形状的预备语句
+            today = get_beijing_today()  # 使用北京时间的date对象
+            date_range = None
             if period == 'day':
-                target = get_beijing_today()  # 使用北京时间的date对象
-                conditions.append(f"date = ${param_count}")
-                params.append(target)
-                param_count += 1
+                date_range = (today, today)
             elif period == 'yesterday':
                 # 新增：昨日
-                yesterday = get_beijing_today() - timedelta(days=1)
-                conditions.append(f"date = ${param_count}")
-                params.append(yesterday)
-                param_count += 1
+                yesterday = today - timedelta(days=1)
+                date_range = (yesterday, yesterday)
             elif period == 'week':
-                beijing_now = get_beijing_now()
-                dates = [(beijing_now - timedelta(days=i)).date() for i in range(7)]  # 使用北京时间的date对象
-                placeholders = ','.join([f'${i}' for i in range(param_count, param_count + len(dates))])
-                conditions.append(f"date IN ({placeholders})")
-                params.extend(dates)
-                param_count += len(dates)
+                date_range = (today - timedelta(days=6), today)
             elif period == 'month':
-                beijing_now = get_beijing_now()
-                month_start = beijing_now.replace(day=1).date()  # 使用北京时间的date对象
-                next_month = (beijing_now.replace(day=1) + timedelta(days=32)).replace(day=1).date()
-                conditions.append(f"date >= ${param_count} AND date < ${param_count + 1}")
-                params.append(month_start)
-                params.append(next_month)
-                param_count += 2
+                month_start = today.replace(day=1)
+                next_month = (month_start + timedelta(days=32)).replace(day=1)
+                date_range = (month_start, next_month - timedelta(days=1))
             elif period == 'custom' and start and end:
-                conditions.append(f"date BETWEEN ${param_count} AND ${param_count + 1}")
                 # 将字符串转换为date对象
-                params.extend([datetime.strptime(start, "%Y-%m-%d").date(), datetime.strptime(end, "%Y-%m-%d").date()])
-                param_count += 2
+                date_range = (datetime.strptime(start, "%Y-%m-%d").date(), datetime.strptime(end, "%Y-%m-%d").date())
             
-            if conditions:
-                query = f"SELECT date, total_consultations, avg_reply FROM daily_stats WHERE {' AND '.join(conditions)} ORDER BY date DESC"
+            if date_range and employee_id:
+                rows = await fetch_query(conn, "history_employee_range", employee_id, *date_range)
+            elif date_range:
+                rows = await fetch_query(conn, "history_range", *date_range)
+            elif employee_id:
+                rows = await fetch_query(conn, "history_employee_all", employee_id)
             else:
-                query = "SELECT date, total_consultations, avg_reply FROM daily_stats ORDER BY date DESC LIMIT 30"
-            
-            rows = await conn.fetch(query, *params)
+                rows = await fetch_query(conn, "history_latest")
             
             return [
                 HistoryRecord(
@@ -917,71 +2473,29 @@ async def get_stats_by_employee(
 ):
     """按员工分组统计（用于图表展示）"""
     try:
+        # 获取自定义名称
+        name_map = (await meta_cache.get()).names
         async with db_pool.acquire() as conn:
-            conditions = []
-            params = []
-            param_count = 1
-            
+            today = get_beijing_today()
             if period == 'day':
-                target = get_beijing_today()
-                conditions.append(f"date = ${param_count}")
-                params.append(target)
-                param_count += 1
+                range_start = range_end = today
             elif period == 'yesterday':
                 # 新增：昨日
-                yesterday = get_beijing_today() - timedelta(days=1)
-                conditions.append(f"date = ${param_count}")
-                params.append(yesterday)
-                param_count += 1
+                range_start = range_end = today - timedelta(days=1)
             elif period == 'week':
-                beijing_now = get_beijing_now()
-                dates = [(beijing_now - timedelta(days=i)).date() for i in range(7)]
-                placeholders = ','.join([f'${i}' for i in range(param_count, param_count + len(dates))])
-                conditions.append(f"date IN ({placeholders})")
-                params.extend(dates)
-                param_count += len(dates)
+                range_start, range_end = today - timedelta(days=6), today
             elif period == 'month':
-                beijing_now = get_beijing_now()
-                month_start = beijing_now.replace(day=1).date()
-                next_month = (beijing_now.replace(day=1) + timedelta(days=32)).replace(day=1).date()
-                conditions.append(f"date >= ${param_count} AND date < ${param_count + 1}")
-                params.append(month_start)
-                params.append(next_month)
-                param_count += 2
+                range_start = today.replace(day=1)
+                range_end = (range_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
             elif period == 'custom' and start and end:
-                conditions.append(f"date BETWEEN ${param_count} AND ${param_count + 1}")
-                params.extend([datetime.strptime(start, "%Y-%m-%d").date(), datetime.strptime(end, "%Y-%m-%d").date()])
-                param_count += 2
-            
-            # 按员工分组聚合数据
-            if conditions:
-                query = f'''
-                    SELECT 
-                        employee_id,
-                        SUM(total_consultations) as total_consult,
-                        AVG(avg_reply) as avg_reply_time
-                    FROM daily_stats
-                    WHERE {' AND '.join(conditions)}
-                    GROUP BY employee_id
-                    ORDER BY total_consult DESC
-                '''
+                range_start = datetime.strptime(start, "%Y-%m-%d").date()
+                range_end = datetime.strptime(end, "%Y-%m-%d").date()
             else:
-                query = '''
-                    SELECT 
-                        employee_id,
-                        SUM(total_consultations) as total_consult,
-                        AVG(avg_reply) as avg_reply_time
-                    FROM daily_stats
-                    WHERE date >= CURRENT_DATE - INTERVAL '30 days'
-                    GROUP BY employee_id
-                    ORDER BY total_consult DESC
-                '''
+                # 默认最近30天
+                range_start, range_end = today - timedelta(days=30), today
             
-            rows = await conn.fetch(query, *params)
-            
-            # 获取自定义名称
-            name_records = await conn.fetch('SELECT original_id, display_name FROM employee_meta')
-            name_map = {row['original_id']: row['display_name'] for row in name_records}
+            # 按员工分组聚合数据（完整的月/周读汇总表，零散的天读 daily_stats）
+            rows = await fetch_employee_period_stats(conn, range_start, range_end)
             
             result = []
             for row in rows:
@@ -1028,22 +2542,11 @@ async def get_monthly_daily_stats(
         else:
             next_month = datetime(target_year, target_month + 1, 1).date()
         
+        # 获取自定义名称
+        name_map = (await meta_cache.get()).names
         async with db_pool.acquire() as conn:
             # 查询该月份所有员工的每日数据
-            rows = await conn.fetch('''
-                SELECT 
-                    employee_id,
-                    date,
-                    total_consultations,
-                    avg_reply
-                FROM daily_stats
-                WHERE date >= $1 AND date < $2
-                ORDER BY employee_id, date
-            ''', month_start, next_month)
-            
-            # 获取自定义名称
-            name_records = await conn.fetch('SELECT original_id, display_name FROM employee_meta')
-            name_map = {row['original_id']: row['display_name'] for row in name_records}
+            rows = await fetch_query(conn, "monthly_daily_stats", month_start, next_month)
             
             # 按员工分组组织数据
             result = {}
@@ -1085,9 +2588,11 @@ async def get_employee_visibility():
     """获取所有员工的可见性配置"""
     try:
         if db_pool:
-            async with db_pool.acquire() as conn:
-                rows = await conn.fetch('SELECT employee_id, hidden, is_manual FROM employee_visibility')
-                return [{"employee_id": row['employee_id'], "hidden": row['hidden'], "is_manual": row['is_manual']} for row in rows]
+            meta = await meta_cache.get()
+            return [
+                {"employee_id": employee_id, "hidden": hidden, "is_manual": is_manual}
+                for employee_id, (hidden, is_manual) in meta.visibility.items()
+            ]
         return []
     except Exception as e:
         print(f"获取员工可见性失败: {e}")
@@ -1095,19 +2600,22 @@ async def get_employee_visibility():
 
 @app.post("/employee_visibility")
 async def save_employee_visibility(request: SaveVisibilityRequest):
-    """保存员工可见性配置"""
+    """保存员工可见性配置（批量写入，一条语句完成）"""
+    items = {item.employee_id: item for item in request.visibility}  # 同一员工出现多次时以最后一次为准
     try:
         if db_pool:
             async with db_pool.acquire() as conn:
-                for item in request.visibility:
-                    await conn.execute('''
-                        INSERT INTO employee_visibility (employee_id, hidden, is_manual, updated_at)
-                        VALUES ($1, $2, $3, CURRENT_TIMESTAMP)
-                        ON CONFLICT (employee_id) 
-                        DO UPDATE SET hidden = $2, is_manual = $3, updated_at = CURRENT_TIMESTAMP
-                    ''', item.employee_id, item.hidden, item.is_manual)
-                print(f"[可见性] 已保存 {len(request.visibility)} 个员工的可见性配置")
-                return {"success": True, "message": f"已保存 {len(request.visibility)} 个配置"}
+                status = await conn.execute('''
+                    INSERT INTO employee_visibility (employee_id, hidden, is_manual, updated_at)
+                    SELECT id, hidden, is_manual, CURRENT_TIMESTAMP
+                    FROM unnest($1::text[], $2::boolean[], $3::boolean[]) AS t(id, hidden, is_manual)
+                    ON CONFLICT (employee_id)
+                    DO UPDATE SET hidden = EXCLUDED.hidden, is_manual = EXCLUDED.is_manual, updated_at = CURRENT_TIMESTAMP
+                ''', list(items), [item.hidden for item in items.values()], [item.is_manual for item in items.values()])
+                affected = affected_rows(status)
+                await meta_cache.changed(conn)
+                print(f"[可见性] 已保存 {affected} 个员工的可见性配置")
+                return {"success": True, "message": f"已保存 {affected} 个配置", "affected": affected}
         return {"success": False, "message": "数据库连接失败"}
     except Exception as e:
         print(f"保存员工可见性失败: {e}")
@@ -1118,10 +2626,8 @@ async def get_global_visibility_mode():
     """获取全局显示模式"""
     try:
         if db_pool:
-            async with db_pool.acquire() as conn:
-                row = await conn.fetchrow('SELECT show_all FROM global_visibility_mode WHERE id = 1')
-                if row:
-                    return {"show_all": row['show_all']}
+            meta = await meta_cache.get()
+            return {"show_all": meta.show_all}
         return {"show_all": False}
     except Exception as e:
         print(f"获取全局显示模式失败: {e}")
@@ -1138,6 +2644,7 @@ async def save_global_visibility_mode(request: GlobalVisibilityMode):
                     SET show_all = $1, updated_at = CURRENT_TIMESTAMP 
                     WHERE id = 1
                 ''', request.show_all)
+                await meta_cache.changed(conn)
                 mode_text = "显示所有员工" if request.show_all else "应用隐藏规则"
                 print(f"[全局显示模式] 已更新为: {mode_text}")
                 return {"success": True, "message": f"已更新为: {mode_text}"}
@@ -1156,19 +2663,8 @@ async def send_message(request: SendMessageRequest):
         if not message:
             raise HTTPException(status_code=400, detail="消息内容不能为空")
         
-        # 存储消息到待处理队列
-        with pending_messages_lock:
-            if employee_id not in pending_messages:
-                pending_messages[employee_id] = []
-            pending_messages[employee_id].append({
-                "message": message,
-                "timestamp": time.time()
-            })
-        
-        # 唤醒长轮询（如果存在）
-        with message_events_lock:
-            if employee_id in message_events:
-                message_events[employee_id].set()
+        # 存储消息到待处理队列，并唤醒长轮询（如果存在）
+        await live_state.push_message(employee_id, message)
         
         print(f"[消息推送] 发送给 {employee_id}: {message[:50]}...")
         return {"success": True, "message": "消息已发送"}
@@ -1182,46 +2678,66 @@ async def send_message(request: SendMessageRequest):
 async def poll_messages(employee_id: str):
     """员工端长轮询获取消息（30秒超时）"""
     try:
-        # 检查是否有待处理消息
-        with pending_messages_lock:
-            if employee_id in pending_messages and pending_messages[employee_id]:
-                messages = pending_messages[employee_id].copy()
-                pending_messages[employee_id] = []
-                return {"messages": messages}
-        
-        # 没有消息，创建事件等待
-        with message_events_lock:
-            if employee_id not in message_events:
-                message_events[employee_id] = asyncio.Event()
-            event = message_events[employee_id]
-        
-        # 等待30秒或直到有新消息
-        try:
-            await asyncio.wait_for(event.wait(), timeout=30.0)
-            event.clear()
-            
-            # 再次检查消息
-            with pending_messages_lock:
-                if employee_id in pending_messages and pending_messages[employee_id]:
-                    messages = pending_messages[employee_id].copy()
-                    pending_messages[employee_id] = []
-                    return {"messages": messages}
-        except asyncio.TimeoutError:
-            pass
-        
-        return {"messages": []}
+        # 有待处理消息立即返回，否则等待30秒或直到有新消息
+        messages = await live_state.wait_messages(employee_id, timeout=30.0)
+        return {"messages": messages}
     except Exception as e:
         print(f"长轮询错误: {e}")
         return {"messages": []}
 
+@app.get("/report_stats")
+async def get_report_stats():
+    """上报写入统计（跳过/写入的上报数、写缓冲状态）"""
+    return {
+        "skipped": report_counters["skipped"],
+        "persisted": report_counters["persisted"],
+        "buffered": len(report_buffer),
+        "flush_count": report_buffer.flush_count,
+        "rows_written": report_buffer.rows_written,
+        "flush_interval": REPORT_FLUSH_INTERVAL,
+        "snapshot_version": employee_snapshot.version,
+        "snapshot_rebuilds": employee_snapshot.rebuild_count
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """运行指标：数据库查询次数（按语句统计）、上报和快照统计"""
+    return {
+        "db_queries": db_query_stats["total"],
+        "db_queries_by_statement": db_query_stats["by_statement"],
+        "reports_skipped": report_counters["skipped"],
+        "reports_persisted": report_counters["persisted"],
+        "buffer_flushes": report_buffer.flush_count,
+        "buffer_rows_written": report_buffer.rows_written,
+        "snapshot_rebuilds": employee_snapshot.rebuild_count,
+        "live_state_backend": LIVE_STATE_BACKEND,
+        "scheduler": scheduler.stats(),
+        "db_pool": pool_stats(),
+        "meta_cache_loads": meta_cache.load_count,
+        "last_rollover": last_rollover_report
+    }
+
 @app.get("/")
 async def root():
     return {"message": "客服监控系统API", "version": "2.0", "database": "PostgreSQL"}
 
+async def migrate_command():
+    """命令行：python 服务器.py migrate（执行数据库迁移后退出）"""
+    conn = await asyncpg.connect(**DB_CONFIG)
+    try:
+        await run_migrations(conn)
+        print(f"[迁移] 数据库结构版本: {await current_schema_version(conn)}")
+    finally:
+        await conn.close()
+
 if __name__ == "__main__":
     import uvicorn  # pyright: ignore[reportMissingImports]
     import sys
     
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        asyncio.run(migrate_command())
+        sys.exit(0)
+    
     # 定义清理函数
     def cleanup_handler(signum=None, frame=None):
         """信号处理器：确保资源被正确清理"""
@@ -1261,8 +2777,19 @@ if __name__ == "__main__":
         print("=" * 50)
         print()
     
+    # 多进程运行（QN_WORKERS>1）需要使用数据库共享的实时状态，否则各进程的在线状态和消息互不相通
+    workers = int(os.environ.get("QN_WORKERS", "1"))
+    if workers > 1 and LIVE_STATE_BACKEND != "postgres":
+        print("[WARNING] 多进程运行需要设置 QN_LIVE_STATE_BACKEND=postgres，已改为单进程运行")
+        workers = 1
+
     try:
-        uvicorn.run(app, host="0.0.0.0", port=9999)
+        if workers > 1:
+            # 多进程模式下uvicorn需要通过模块路径导入app
+            module_name = os.path.splitext(os.path.basename(__file__))[0]
+            uvicorn.run(f"{module_name}:app", host="0.0.0.0", port=9999, workers=workers)
+        else:
+            uvicorn.run(app, host="0.0.0.0", port=9999)
     except KeyboardInterrupt:
         cleanup_handler()
     except Exception as e:
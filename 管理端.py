@@ -3,20 +3,28 @@ import requests  # pyright: ignore[reportMissingModuleSource]
 import time
 import json
 import os
+import itertools
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 # 重要：必须在导入QApplication之前导入QWebEngineWidgets
 from PyQt5.QtWebEngineWidgets import QWebEngineView  # pyright: ignore[reportMissingImports]
 
 from PyQt5.QtWidgets import (  # pyright: ignore[reportMissingImports]
-    QApplication, QMainWindow, QTableWidget, QTableWidgetItem, 
+    QApplication, QMainWindow, QTableWidget, QTableWidgetItem, QTableView,
     QPushButton, QHBoxLayout, QVBoxLayout, QWidget, QLabel,
     QHeaderView, QMessageBox, QDialog, QLineEdit, QRadioButton,
     QButtonGroup, QDateEdit, QGridLayout, QAbstractItemView,
     QInputDialog, QComboBox, QGroupBox, QColorDialog, QScrollArea, QSpinBox,
     QStackedWidget, QTextEdit, QDialogButtonBox, QListWidget, QListWidgetItem
 )
-from PyQt5.QtCore import Qt, QTimer, QDate, QUrl, pyqtSlot, QObject, QThread, pyqtSignal, QSettings  # pyright: ignore[reportMissingImports]
+from PyQt5.QtCore import (  # pyright: ignore[reportMissingImports]
+    Qt, QTimer, QDate, QUrl, pyqtSlot, QObject, QThread, pyqtSignal, QSettings,
+    QAbstractTableModel, QModelIndex
+)
 from PyQt5.QtGui import QColor, QFont  # pyright: ignore[reportMissingImports]
 
 # 尝试导入 QWebChannel，如果失败则禁用双击功能
@@ -32,6 +40,20 @@ SERVER_URL = "http://101.42.32.73:9999"
 # 网络请求超时时间（秒）
 REQUEST_TIMEOUT = 3  # 修复：减少超时时间，提高响应速度
 
+# 推送流连接时刷新 /dashboard 的间隔（秒）：员工数据由推送流更新，这里只用于同步排序、可见性和颜色的修改
+DASHBOARD_REFRESH_INTERVAL = 5
+
+# 轮询 /dashboard 的自适应间隔（秒）：有变化时回到最短间隔，没有变化（304）或失败时逐步放慢
+POLL_MIN_INTERVAL = 0.5
+POLL_MAX_INTERVAL = 5
+POLL_BACKOFF = 1.5
+
+REQUEST_WORKERS = 4  # 请求执行器的线程数
+UI_STALL_THRESHOLD_MS = 50  # 界面线程（事件循环）阻塞超过该时间（毫秒）时打印日志
+UI_STALL_WATCHDOG = os.environ.get("QN_UI_STALL_WATCHDOG", "1") != "0"  # 是否启用界面卡顿检测
+
+request_executor = None  # 共享的请求执行器（创建QApplication之后初始化）
+
 def handle_request_error(parent, error, operation="操作"):
     """统一处理网络请求错误"""
     if isinstance(error, requests.exceptions.Timeout):
@@ -41,6 +63,173 @@ def handle_request_error(parent, error, operation="操作"):
     else:
         QMessageBox.critical(parent, "错误", f"{operation}失败：{str(error)}")
 
+class RequestError(Exception):
+    """服务器返回了非200的状态码（消息优先使用服务器返回的 detail）"""
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+class RequestToken:
+    """一次异步请求的取消令牌：取消后不再调用该请求的回调"""
+    def __init__(self, key=None):
+        self.key = key
+        self.cancelled = False
+    
+    def cancel(self):
+        self.cancelled = True
+
+class RequestExecutor(QObject):
+    """共享的异步请求执行器：HTTP请求在线程池中执行，结果通过Qt信号回到界面线程后再调用回调
+
+    - 每个工作线程使用自己的 requests.Session（复用连接；Session 不保证线程安全，不在线程之间共享）
+    - 合并：相同的GET请求还在进行时不再重复发送，结果同时交给所有调用方
+    - 取消：每次提交返回一个令牌，取消后不再调用回调；指定了 key 时，同一 key 的新请求会取消旧请求
+      （例如图表查询只需要最后一次的结果，先返回的旧结果不能覆盖新结果）
+    """
+    _finished = pyqtSignal(object, object, object, str)  # (请求, 结果, 异常, 执行情况 ok/error/skipped)
+    
+    def __init__(self, max_workers=REQUEST_WORKERS):
+        super().__init__()
+        self._local = threading.local()  # 每个工作线程的 Session
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="request")
+        # 以下状态只在界面线程中读写，工作线程只通过参数和 _finished 信号交换数据
+        self._inflight = {}  # {请求标识: [(令牌, 成功回调, 失败回调), ...]}
+        self._latest = {}  # {key: 该key最后一次提交、尚未完成的令牌}
+        self._post_ids = itertools.count()
+        self.stats = {"sent": 0, "coalesced": 0, "skipped": 0, "errors": 0}
+        self._finished.connect(self._on_finished)
+    
+    def get(self, path, on_success=None, on_error=None, params=None, key=None, timeout=REQUEST_TIMEOUT):
+        return self.submit("GET", path, on_success, on_error, params=params, key=key, timeout=timeout)
+    
+    def post(self, path, json_body, on_success=None, on_error=None, key=None, timeout=REQUEST_TIMEOUT):
+        return self.submit("POST", path, on_success, on_error, json_body=json_body, key=key, timeout=timeout)
+    
+    def submit(self, method, path, on_success=None, on_error=None, params=None, json_body=None, key=None, timeout=REQUEST_TIMEOUT):
+        """提交一个请求（在界面线程中调用），返回取消令牌
+
+        on_success(结果) 收到解析好的JSON，on_error(异常) 收到请求异常或 RequestError；
+        没有 on_error 时只打印日志。回调都在界面线程中执行。
+        """
+        token = RequestToken(key)
+        if key is not None:
+            self.cancel(key)
+            self._latest[key] = token
+        waiter = (token, on_success, on_error)
+        
+        # 只合并GET：POST 是写操作，每次都要发送
+        if method == "GET":
+            request_id = (method, path, json.dumps(params, sort_keys=True, ensure_ascii=False))
+        else:
+            request_id = (method, path, next(self._post_ids))
+        waiters = self._inflight.get(request_id)
+        if waiters is not None:
+            waiters.append(waiter)
+            self.stats["coalesced"] += 1
+            return token
+        self._inflight[request_id] = [waiter]
+        self._start((request_id, params, json_body, timeout), [token])
+        return token
+    
+    def cancel(self, key):
+        """取消指定 key 的最后一次请求"""
+        token = self._latest.pop(key, None)
+        if token is not None:
+            token.cancel()
+    
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+    
+    def _start(self, call, tokens):
+        """把请求交给线程池（tokens 是提交时调用方令牌的快照，工作线程不读取 _inflight）"""
+        self._pool.submit(self._execute, call, tuple(tokens))
+    
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+    
+    def _execute(self, call, tokens):
+        """在线程池中执行请求"""
+        request_id, params, json_body, timeout = call
+        method, path, _ = request_id
+        # 开始执行前调用方都已取消时不再发送（之后合并进来的调用方由 _on_finished 重新提交）
+        if all(token.cancelled for token in tokens):
+            self._finished.emit(call, None, None, "skipped")
+            return
+        try:
+            resp = self._session().request(method, f"{SERVER_URL}{path}", params=params, json=json_body, timeout=timeout)
+            if resp.status_code != 200:
+                try:
+                    message = resp.json().get("detail") or f"服务器返回错误：{resp.status_code}"
+                except ValueError:
+                    message = f"服务器返回错误：{resp.status_code}"
+                raise RequestError(resp.status_code, message)
+            self._finished.emit(call, resp.json(), None, "ok")
+        except Exception as e:
+            self._finished.emit(call, None, e, "error")
+    
+    def _on_finished(self, call, result, error, outcome):
+        """请求完成（在界面线程中执行）：更新统计，调用所有未取消的回调"""
+        request_id = call[0]
+        method, path, _ = request_id
+        waiters = self._inflight.pop(request_id, [])
+        if outcome == "skipped":
+            self.stats["skipped"] += 1
+            # 跳过之后又合并进来、没有取消的调用方：重新提交
+            waiters = [waiter for waiter in waiters if not waiter[0].cancelled]
+            if waiters:
+                self._inflight[request_id] = waiters
+                self._start(call, [token for token, _, _ in waiters])
+            return
+        self.stats["sent"] += 1
+        if outcome == "error":
+            self.stats["errors"] += 1
+        for token, on_success, on_error in waiters:
+            if token.key is not None and self._latest.get(token.key) is token:
+                del self._latest[token.key]
+            if token.cancelled:
+                continue
+            try:
+                if error is None:
+                    if on_success:
+                        on_success(result)
+                elif on_error:
+                    on_error(error)
+                else:
+                    print(f"[请求] {method} {path} 失败: {error}")
+            except Exception as e:
+                print(f"[请求] {method} {path} 的回调出错: {e}")
+                traceback.print_exc()
+
+class UIStallWatchdog(QObject):
+    """界面卡顿检测：定时器按固定间隔触发，实际间隔比预期多出阈值以上说明事件循环被阻塞"""
+    
+    INTERVAL_MS = 200  # 检测间隔（毫秒）：只用于诊断，间隔不必太短，阻塞时间超过阈值的卡顿同样能测出
+    
+    def __init__(self, threshold_ms=UI_STALL_THRESHOLD_MS):
+        super().__init__()
+        self.threshold_ms = threshold_ms
+        self.stall_count = 0
+        self.max_stall_ms = 0
+        self._last_tick = None
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._tick)
+    
+    def start(self):
+        self._last_tick = time.perf_counter()
+        self._timer.start(self.INTERVAL_MS)
+    
+    def _tick(self):
+        now = time.perf_counter()
+        stall_ms = (now - self._last_tick) * 1000 - self.INTERVAL_MS
+        self._last_tick = now
+        if stall_ms > self.threshold_ms:
+            self.stall_count += 1
+            self.max_stall_ms = max(self.max_stall_ms, stall_ms)
+            print(f"[界面卡顿] 事件循环阻塞了约 {stall_ms:.0f}ms（累计 {self.stall_count} 次，最长 {self.max_stall_ms:.0f}ms）")
+
 class DeleteEmployeeDialog(QDialog):
     """删除员工对话框"""
     def __init__(self, parent=None, employees_list=None):
@@ -129,34 +318,36 @@ class DeleteEmployeeDialog(QDialog):
             self.delete_employee(employee_id, delete_all)
     
     def delete_employee(self, employee_id, delete_all):
-        """执行删除操作"""
-        try:
-            # 通过API删除员工
-            resp = requests.post(
-                f"{SERVER_URL}/delete_employee",
-                json={
-                    "employee_id": employee_id,
-                    "delete_all": delete_all
-                },
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            if resp.status_code == 200:
-                result = resp.json()
-                if result.get("success"):
-                    QMessageBox.information(self, "删除成功", f"员工 '{employee_id}' 的记录已删除\n\n管理端会在下次刷新时自动更新")
-                    self.accept()
-                else:
-                    QMessageBox.warning(self, "删除失败", result.get("message", "删除操作失败"))
+        """执行删除操作（请求在后台发送，完成前禁用删除按钮）"""
+        def on_success(result):
+            self.delete_btn.setEnabled(True)
+            if result.get("success"):
+                QMessageBox.information(self, "删除成功", f"员工 '{employee_id}' 的记录已删除\n\n管理端会在下次刷新时自动更新")
+                self.accept()
             else:
-                error_msg = resp.json().get("detail", "删除操作失败") if resp.text else f"服务器返回错误：{resp.status_code}"
-                QMessageBox.warning(self, "删除失败", error_msg)
-        except Exception as e:
-            handle_request_error(self, e, "删除员工")
+                QMessageBox.warning(self, "删除失败", result.get("message", "删除操作失败"))
+        
+        def on_error(e):
+            self.delete_btn.setEnabled(True)
+            if isinstance(e, RequestError):
+                QMessageBox.warning(self, "删除失败", str(e))
+            else:
+                handle_request_error(self, e, "删除员工")
+        
+        # 通过API删除员工
+        self.delete_btn.setEnabled(False)
+        request_executor.post(
+            "/delete_employee",
+            {"employee_id": employee_id, "delete_all": delete_all},
+            on_success, on_error
+        )
 
 class EmployeeManagementDialog(QDialog):
-    """员工管理对话框（颜色+排序+隐藏）"""
-    def __init__(self, parent=None, employees_list=None):
+    """员工管理对话框（颜色+排序+隐藏）
+
+    现有配置由调用方传入（主窗口从 /dashboard 同步的元数据），打开对话框时不再请求服务器。
+    """
+    def __init__(self, parent=None, employees_list=None, dashboard=None):
         super().__init__(parent)
         self.setWindowTitle("员工管理")
         self.resize(800, 600)
@@ -196,7 +387,7 @@ class EmployeeManagementDialog(QDialog):
         scroll_layout = QVBoxLayout(scroll_widget)
         
         # 加载现有颜色配置
-        self.load_color_configs()
+        self.load_color_configs(dashboard)
         
         for emp in self.employees_list:
             employee_id = emp.get("employee_name", "")
@@ -265,108 +456,49 @@ class EmployeeManagementDialog(QDialog):
         
         # 按钮
         button_layout = QHBoxLayout()
-        save_btn = QPushButton("保存")
-        save_btn.setStyleSheet("background-color: #4CAF50; color: white; font-weight: bold;")
+        self.save_btn = QPushButton("保存")
+        self.save_btn.setStyleSheet("background-color: #4CAF50; color: white; font-weight: bold;")
         cancel_btn = QPushButton("取消")
         button_layout.addStretch()
-        button_layout.addWidget(save_btn)
+        button_layout.addWidget(self.save_btn)
         button_layout.addWidget(cancel_btn)
         layout.addLayout(button_layout)
         
         self.setLayout(layout)
         
-        save_btn.clicked.connect(self.save_all_configs)
+        self.save_btn.clicked.connect(self.save_all_configs)
         cancel_btn.clicked.connect(self.reject)
     
-    def load_color_configs(self):
-        """加载现有配置（颜色+排序+隐藏）"""
-        # 1. 加载颜色配置
-        try:
-            employee_ids = [emp.get("employee_name", "") for emp in self.employees_list]
-            employee_ids_str = ",".join(employee_ids)
-            
-            resp = requests.get(
-                f"{SERVER_URL}/color_configs",
-                params={"employee_ids": employee_ids_str},
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            if resp.status_code == 200:
-                data = resp.json()
-                # 设置全局线形图颜色
-                global_line_color = data.get("global_line_color", "#FFA500")
-                self.color_configs['__global__'] = {
-                    'line': global_line_color
-                }
-                # 更新全局线形图颜色按钮
-                if hasattr(self, 'global_line_color_btn'):
-                    self.global_line_color_btn.setStyleSheet(f"background-color: {global_line_color}; min-width: 100px; min-height: 30px;")
-                
-                # 设置员工柱状图颜色
-                employee_colors = data.get("employee_colors", {})
-                for employee_id, color_data in employee_colors.items():
-                    if employee_id not in self.color_configs:
-                        self.color_configs[employee_id] = {}
-                    self.color_configs[employee_id]['bar'] = color_data.get("bar_color", "#4CAF50")
-        except Exception as e:
-            print(f"加载颜色配置错误: {e}")
-        
-        # 2. 加载排序配置
-        try:
-            resp = requests.get(f"{SERVER_URL}/employee_order", timeout=REQUEST_TIMEOUT)
-            if resp.status_code == 200:
-                order_data = resp.json()
-                for item in order_data:
-                    self.sort_orders[item['employee_id']] = item['order']
-        except Exception as e:
-            print(f"加载排序配置错误: {e}")
+    def load_color_configs(self, dashboard):
+        """加载现有配置（颜色+排序+隐藏），dashboard 为同步了 /dashboard 元数据的主窗口"""
+        if dashboard is None:
+            return
+        employee_ids = {emp.get("employee_name", "") for emp in self.employees_list}
         
-        # 3. 加载隐藏配置
-        try:
-            resp = requests.get(f"{SERVER_URL}/employee_visibility", timeout=REQUEST_TIMEOUT)
-            if resp.status_code == 200:
-                visibility_data = resp.json()
-                for item in visibility_data:
-                    self.visibility_configs[item['employee_id']] = {
-                        'hidden': item['hidden'],
-                        'is_manual': item['is_manual']
-                    }
-        except Exception as e:
-            print(f"加载隐藏配置错误: {e}")
-    
-    async def _load_colors_async(self):
-        """异步加载颜色配置（通过API）"""
-        try:
-            # 获取所有员工ID
-            employee_ids = [emp.get("employee_name", "") for emp in self.employees_list]
-            employee_ids_str = ",".join(employee_ids)
-            
-            # 通过API获取颜色配置
-            resp = requests.get(
-                f"{SERVER_URL}/color_configs",
-                params={"employee_ids": employee_ids_str},
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            if resp.status_code == 200:
-                data = resp.json()
-                # 设置全局线形图颜色
-                global_line_color = data.get("global_line_color", "#FFA500")
-                self.color_configs['__global__'] = {
-                    'line': global_line_color
-                }
-                # 更新全局线形图颜色按钮
-                if hasattr(self, 'global_line_color_btn'):
-                    self.global_line_color_btn.setStyleSheet(f"background-color: {global_line_color}; min-width: 100px; min-height: 30px;")
-                
-                # 设置员工柱状图颜色
-                employee_colors = data.get("employee_colors", {})
-                for employee_id, color_data in employee_colors.items():
-                    if employee_id not in self.color_configs:
-                        self.color_configs[employee_id] = {}
-                    self.color_configs[employee_id]['bar'] = color_data.get("bar_color", "#4CAF50")
-        except Exception as e:
-            print(f"加载颜色配置错误: {e}")
+        # 1. 颜色配置
+        colors = dashboard.employee_colors
+        global_line_color = colors.get("global_line_color", "#FFA500")
+        self.color_configs['__global__'] = {
+            'line': global_line_color
+        }
+        # 更新全局线形图颜色按钮
+        if hasattr(self, 'global_line_color_btn'):
+            self.global_line_color_btn.setStyleSheet(f"background-color: {global_line_color}; min-width: 100px; min-height: 30px;")
+        
+        # 设置员工柱状图颜色
+        for employee_id, color_data in colors.get("employee_colors", {}).items():
+            if employee_id in employee_ids:
+                self.color_configs.setdefault(employee_id, {})['bar'] = color_data.get("bar_color", "#4CAF50")
+        
+        # 2. 排序配置
+        self.sort_orders = dict(dashboard.employee_order)
+        
+        # 3. 隐藏配置
+        for employee_id, item in dashboard.employee_visibility.items():
+            self.visibility_configs[employee_id] = {
+                'hidden': item['hidden'],
+                'is_manual': item['is_manual']
+            }
     
     def choose_color(self, employee_id, color_type, button):
         """选择颜色（预设颜色）"""
@@ -437,115 +569,65 @@ class EmployeeManagementDialog(QDialog):
             button.setStyleSheet("background-color: #4CAF50; color: white; font-weight: bold; min-width: 120px; min-height: 30px;")
     
     def save_all_configs(self):
-        """保存所有配置（颜色+排序+隐藏）"""
-        try:
-            # 1. 保存颜色配置
-            colors = []
-            for employee_id, config in self.color_configs.items():
-                if employee_id == '__global__':
-                    continue
-                bar_color = config.get('bar', '#4CAF50')
-                colors.append({
-                    "employee_id": employee_id,
-                    "bar_color": bar_color
-                })
-            
-            global_line_color = self.color_configs.get('__global__', {}).get('line', '#FFA500')
-            
-            resp = requests.post(
-                f"{SERVER_URL}/save_color_configs",
-                json={
-                    "colors": colors,
-                    "global_line_color": global_line_color
-                },
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            if resp.status_code != 200:
-                QMessageBox.warning(self, "警告", "保存颜色配置失败")
-                return
-            
-            # 2. 保存排序配置
-            orders = []
-            for employee_id, config in self.color_configs.items():
-                if employee_id == '__global__':
-                    continue
-                spinbox = config.get('sort_spinbox')
-                if spinbox:
-                    order = spinbox.value()
-                    orders.append({
-                        "employee_id": employee_id,
-                        "order": order
-                    })
-            
-            resp = requests.post(
-                f"{SERVER_URL}/save_employee_order",
-                json={"orders": orders},
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            if resp.status_code != 200:
-                QMessageBox.warning(self, "警告", "保存排序配置失败")
-                return
-            
-            # 3. 保存隐藏配置
-            visibility = []
-            for employee_id, vis_config in self.visibility_configs.items():
-                visibility.append({
+        """保存所有配置（颜色+排序+隐藏）：三个请求在后台依次发送，全部成功后关闭对话框"""
+        # 1. 颜色配置
+        colors = []
+        for employee_id, config in self.color_configs.items():
+            if employee_id == '__global__':
+                continue
+            bar_color = config.get('bar', '#4CAF50')
+            colors.append({
+                "employee_id": employee_id,
+                "bar_color": bar_color
+            })
+        
+        global_line_color = self.color_configs.get('__global__', {}).get('line', '#FFA500')
+        
+        # 2. 排序配置
+        orders = []
+        for employee_id, config in self.color_configs.items():
+            if employee_id == '__global__':
+                continue
+            spinbox = config.get('sort_spinbox')
+            if spinbox:
+                order = spinbox.value()
+                orders.append({
                     "employee_id": employee_id,
-                    "hidden": vis_config.get('hidden', False),
-                    "is_manual": vis_config.get('is_manual', True)
+                    "order": order
                 })
-            
-            resp = requests.post(
-                f"{SERVER_URL}/employee_visibility",
-                json={"visibility": visibility},
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            if resp.status_code != 200:
-                QMessageBox.warning(self, "警告", "保存隐藏配置失败")
-                return
-            
+        
+        # 3. 隐藏配置
+        visibility = []
+        for employee_id, vis_config in self.visibility_configs.items():
+            visibility.append({
+                "employee_id": employee_id,
+                "hidden": vis_config.get('hidden', False),
+                "is_manual": vis_config.get('is_manual', True)
+            })
+        
+        self.save_btn.setEnabled(False)
+        self._save_steps([
+            ("/save_color_configs", {"colors": colors, "global_line_color": global_line_color}, "保存颜色配置失败"),
+            ("/save_employee_order", {"orders": orders}, "保存排序配置失败"),
+            ("/employee_visibility", {"visibility": visibility}, "保存隐藏配置失败"),
+        ])
+    
+    def _save_steps(self, steps):
+        """发送第一个保存请求，成功后继续发送剩下的"""
+        if not steps:
             QMessageBox.information(self, "成功", "所有配置已保存")
             self.accept()
-        except Exception as e:
-            handle_request_error(self, e, "保存配置")
-    
-    async def _save_colors_async(self):
-        """异步保存颜色配置（通过API）"""
-        try:
-            # 准备颜色配置数据
-            colors = []
-            for employee_id, config in self.color_configs.items():
-                if employee_id == '__global__':
-                    continue  # 跳过全局设置
-                bar_color = config.get('bar', '#4CAF50')
-                colors.append({
-                    "employee_id": employee_id,
-                    "bar_color": bar_color
-                })
-            
-            global_line_color = self.color_configs.get('__global__', {}).get('line', '#FFA500')
-            
-            # 通过API保存颜色配置
-            resp = requests.post(
-                f"{SERVER_URL}/save_color_configs",
-                json={
-                    "colors": colors,
-                    "global_line_color": global_line_color
-                },
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            if resp.status_code == 200:
-                return True
+            return
+        path, body, failure_text = steps[0]
+        
+        def on_error(e):
+            self.save_btn.setEnabled(True)
+            if isinstance(e, RequestError):
+                QMessageBox.warning(self, "警告", failure_text)
             else:
-                print(f"保存颜色配置失败，状态码: {resp.status_code}")
-                return False
-        except Exception as e:
-            print(f"保存颜色配置错误: {e}")
-            return False
+                handle_request_error(self, e, "保存配置")
+        
+        request_executor.post(path, body, lambda result: self._save_steps(steps[1:]), on_error)
 
 if WEBCHANNEL_AVAILABLE:
     class ChartBridge(QObject):
@@ -724,9 +806,6 @@ class HistoryDialog(QDialog):
         # 兼容性：保留 self.web_view 指向当前显示的WebView
         self.web_view = self.web_view_overview
         
-        # 单员工图表初始化状态
-        self.single_chart_initialized = False  # 单员工图表是否已初始化
-        
         # 员工列表数据
         self.all_employees = []  # 所有员工数据
         
@@ -749,11 +828,6 @@ class HistoryDialog(QDialog):
             self.channel_single = None
             self.bridge = None
         
-        # 方案3：图表实例缓存复用 + 分模式复用
-        self.chart_initialized = False  # 图表是否已初始化
-        self.last_mode = None  # 上一次的模式：'overview' 或 'single'
-        self.last_data_json = None  # 上一次的数据JSON（用于避免重复更新）
-        
         # 月度数据缓存（预加载整月数据，实现快速切换）
         self.monthly_data_cache = {}  # {employee_id: [{"date": "2026-01-01", "total_consult": 10, "avg_reply": 5}, ...]}
         self.employee_name_cache = {}  # {employee_id: display_name} 员工显示名称缓存
@@ -870,80 +944,70 @@ class HistoryDialog(QDialog):
             self.preload_monthly_data()
     
     def preload_monthly_data(self):
-        """预加载当月所有员工的每日数据（提升响应速度）"""
-        try:
-            now = datetime.now()
-            year = now.year
-            month = now.month
-            
-            print(f"[预加载] 开始加载 {year}年{month}月 的所有员工每日数据...")
+        """预加载当月所有员工的每日数据（提升响应速度；请求在后台执行，加载完成前查询改为请求服务器）"""
+        now = datetime.now()
+        year = now.year
+        month = now.month
+        
+        print(f"[预加载] 开始加载 {year}年{month}月 的所有员工每日数据...")
+        
+        def on_loaded(data):
+            employees = data.get("employees", [])
             
-            resp = requests.get(
-                f"{SERVER_URL}/monthly_daily_stats",
-                params={"year": year, "month": month},
-                timeout=REQUEST_TIMEOUT
-            )
+            # 缓存每个员工的每日数据和显示名称
+            self.monthly_data_cache = {}
+            self.employee_name_cache = {}  # 缓存员工显示名称
             
-            if resp.status_code == 200:
-                data = resp.json()
-                employees = data.get("employees", [])
-                
-                # 缓存每个员工的每日数据和显示名称
-                self.monthly_data_cache = {}
-                self.employee_name_cache = {}  # 缓存员工显示名称
-                
-                for emp in employees:
-                    employee_id = emp.get("employee_id")
-                    employee_name = emp.get("employee_name", employee_id)
-                    daily_data = emp.get("daily_data", [])
-                    
-                    self.monthly_data_cache[employee_id] = daily_data
-                    self.employee_name_cache[employee_id] = employee_name
-                
-                self.monthly_data_loaded = True
-                self.cached_month = (year, month)
-                self.cached_date = now.date()  # 记录缓存加载的日期，用于检测跨天
+            for emp in employees:
+                employee_id = emp.get("employee_id")
+                employee_name = emp.get("employee_name", employee_id)
+                daily_data = emp.get("daily_data", [])
                 
-                total_records = sum(len(v) for v in self.monthly_data_cache.values())
-                print(f"[预加载] ✓ 成功加载 {len(employees)} 个员工的月度数据，共 {total_records} 条每日记录")
-            else:
-                print(f"[预加载] ✗ 服务器返回错误: {resp.status_code}")
-                self.monthly_data_loaded = False
-        except Exception as e:
+                self.monthly_data_cache[employee_id] = daily_data
+                self.employee_name_cache[employee_id] = employee_name
+            
+            self.monthly_data_loaded = True
+            self.cached_month = (year, month)
+            self.cached_date = now.date()  # 记录缓存加载的日期，用于检测跨天
+            
+            total_records = sum(len(v) for v in self.monthly_data_cache.values())
+            print(f"[预加载] ✓ 成功加载 {len(employees)} 个员工的月度数据，共 {total_records} 条每日记录")
+        
+        def on_error(e):
             print(f"[预加载] ✗ 加载月度数据失败: {e}")
             self.monthly_data_loaded = False
+        
+        request_executor.get(
+            "/monthly_daily_stats", on_loaded, on_error,
+            params={"year": year, "month": month}, key="monthly_data"
+        )
+    
+    def get_dashboard_app(self):
+        """返回已经同步了 /dashboard 元数据的主窗口（还没有同步时返回None，调用方使用默认值）"""
+        parent = self.parent()
+        if parent is not None and getattr(parent, "dashboard_loaded", False):
+            return parent
+        return None
+    
+    def set_color_cache(self, data):
+        """缓存颜色配置（data 的格式与 /color_configs 的返回值相同）"""
+        self.global_line_color_cache = data.get("global_line_color", "#FFA500")
+        employee_colors = data.get("employee_colors", {})
+        
+        # 缓存所有员工的颜色配置
+        self.color_cache = {}
+        for employee_id, color_data in employee_colors.items():
+            self.color_cache[employee_id] = {
+                "bar": color_data.get("bar_color", "#4CAF50"),
+                "line": self.global_line_color_cache
+            }
+        self.color_cache_loaded = True
     
     def preload_color_configs(self):
-        """预加载颜色配置（提升响应速度）"""
-        try:
-            print("[预加载] 开始加载颜色配置...")
-            
-            resp = requests.get(
-                f"{SERVER_URL}/color_configs",
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            if resp.status_code == 200:
-                data = resp.json()
-                self.global_line_color_cache = data.get("global_line_color", "#FFA500")
-                employee_colors = data.get("employee_colors", {})
-                
-                # 缓存所有员工的颜色配置
-                self.color_cache = {}
-                for employee_id, color_data in employee_colors.items():
-                    self.color_cache[employee_id] = {
-                        "bar": color_data.get("bar_color", "#4CAF50"),
-                        "line": self.global_line_color_cache
-                    }
-                
-                self.color_cache_loaded = True
-                print(f"[预加载] ✓ 成功加载 {len(self.color_cache)} 个员工的颜色配置")
-            else:
-                print(f"[预加载] ✗ 颜色配置加载失败: {resp.status_code}")
-                self.color_cache_loaded = False
-        except Exception as e:
-            print(f"[预加载] ✗ 颜色配置加载失败: {e}")
-            self.color_cache_loaded = False
+        """预加载颜色配置（使用主窗口从 /dashboard 同步的颜色，还没有同步时使用默认颜色）"""
+        app = self.get_dashboard_app()
+        if app is not None:
+            self.set_color_cache(app.employee_colors)
     
     def extract_data_from_monthly_cache(self, period, start_date=None, end_date=None):
         """从月度缓存中提取指定时间段的数据（快速响应，无需请求服务器）
@@ -1031,165 +1095,46 @@ class HistoryDialog(QDialog):
         return result
     
     def init_chart(self):
-        """初始化ECharts图表HTML"""
-        html_content = self.get_chart_html([], "", "")
-        self.web_view_overview.setHtml(html_content)
+        """加载图表页面：每个WebView只加载一次，之后的查询都通过 runJavaScript 更新数据"""
+        self.chart_page_ready = {False: False, True: False}  # {single_mode: 页面是否已加载完成}
+        self.pending_chart_data = {}  # {single_mode: 页面加载完成前收到的最新数据}
+        base_url = QUrl.fromLocalFile(os.path.join(self.get_echarts_dir(), ''))
+        for single_mode in (False, True):
+            web_view = self.get_chart_view(single_mode)
+            web_view.loadFinished.connect(lambda ok, mode=single_mode: self.on_chart_page_loaded(mode, ok))
+            # 以ECharts所在目录为基准URL，页面通过相对路径引用 echarts.min.js（由浏览器加载和缓存，不再内联到HTML中）
+            web_view.setHtml(self.get_chart_page_html(single_mode), base_url)
     
-    def get_echarts_script(self):
-        """获取ECharts脚本（优先本地，fallback到CDN）"""
-        # 尝试从本地加载ECharts
-        local_echarts_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'echarts.min.js')
-        
-        # 打包后的路径
+    def get_chart_view(self, single_mode):
+        return self.web_view_single if single_mode else self.web_view_overview
+    
+    def get_echarts_dir(self):
+        """echarts.min.js 所在目录（打包后为解压目录）"""
         if getattr(sys, 'frozen', False):
             # 运行在打包后的exe中
-            bundle_dir = sys._MEIPASS
-            local_echarts_path = os.path.join(bundle_dir, 'echarts.min.js')
-        
-        if os.path.exists(local_echarts_path):
-            try:
-                with open(local_echarts_path, 'r', encoding='utf-8') as f:
-                    echarts_code = f.read()
-                print("[本地ECharts] 使用本地ECharts库（秒加载）")
-                return f'<script>{echarts_code}</script>'
-            except Exception as e:
-                print(f"[本地ECharts] 读取失败: {e}，fallback到CDN")
-        
+            return sys._MEIPASS
+        return os.path.dirname(os.path.abspath(__file__))
+    
+    def get_echarts_src(self):
+        """ECharts脚本地址（优先本地文件，fallback到CDN）"""
+        if os.path.exists(os.path.join(self.get_echarts_dir(), 'echarts.min.js')):
+            print("[本地ECharts] 使用本地ECharts库")
+            return 'echarts.min.js'
         print("[CDN ECharts] 使用CDN加载ECharts")
-        return '<script src="https://cdn.jsdelivr.net/npm/echarts@5.4.3/dist/echarts.min.js"></script>'
+        return 'https://cdn.jsdelivr.net/npm/echarts@5.4.3/dist/echarts.min.js'
     
-    def get_chart_html(self, data, period_name, date_range, single_mode=False):
-        """生成包含ECharts图表的HTML"""
-        # 获取ECharts脚本（本地或CDN）
-        echarts_script = self.get_echarts_script()
-        
-        if not data:
-            return '''
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <title>员工效率统计</title>
-    ''' + echarts_script + '''
-    <style>
-        body {
-            margin: 0;
-            padding: 10px;
-            font-family: "Microsoft YaHei", Arial, sans-serif;
-        }
-        #chart {
-            width: 100%;
-            height: 700px;
-        }
-        #loading {
-            text-align: center;
-            padding-top: 300px;
-            font-size: 16px;
-            color: #666;
-        }
-    </style>
-</head>
-<body>
-    <div id="loading">正在加载图表库...</div>
-    <div id="chart" style="width:100%;height:700px;display:none;"></div>
-    <script>
-        var loadStartTime = Date.now();
-        var maxLoadTime = 15000; // 15秒超时
-        
-        function initChart() {
-            // 检查超时
-            if (Date.now() - loadStartTime > maxLoadTime) {
-                var loading = document.getElementById('loading');
-                if (loading) {
-                    loading.innerHTML = '图表库加载超时，请检查网络连接';
-                    loading.style.color = 'red';
-                }
-                return;
-            }
-            
-            if (typeof echarts === 'undefined') {
-                setTimeout(initChart, 100);
-                return;
-            }
-            document.getElementById('loading').style.display = 'none';
-            document.getElementById('chart').style.display = 'block';
-            var chartDom = document.getElementById('chart');
-            var myChart = echarts.init(chartDom);
-            myChart.setOption({
-                title: {
-                    text: '暂无数据',
-                    left: 'center',
-                    top: 'middle',
-                    textStyle: { fontSize: 24, color: '#999' }
-                }
-            });
-        }
-        
-        // 等待ECharts加载完成后初始化图表
-        function tryInitChart() {
-            if (typeof echarts !== 'undefined') {
-                initChart();
-            } else {
-                // 检查超时
-                if (Date.now() - loadStartTime > maxLoadTime) {
-                    var loading = document.getElementById('loading');
-                    if (loading) {
-                        loading.innerHTML = '图表库加载超时，请检查网络连接';
-                        loading.style.color = 'red';
-                    }
-                    return;
-                }
-                setTimeout(tryInitChart, 100);
-            }
-        }
-        
-        // 如果ECharts已经加载，直接初始化
-        if (typeof echarts !== 'undefined') {
-            initChart();
-        } else {
-            // 等待加载
-            setTimeout(tryInitChart, 500);
-        }
-    </script>
-</body>
-</html>
-'''
-        
-        # 准备数据
-        employee_names = [item["employee_name"] for item in data]
-        employee_ids = [item.get("employee_id", item["employee_name"]) for item in data]
-        total_consults = [item["total_consult"] for item in data]
-        avg_replies = [item["avg_reply"] for item in data]
-        efficiencies = [item["efficiency"] for item in data]
-        
-        # 单员工模式标题调整
-        if single_mode and data:
-            title_suffix = f" - {employee_names[0]}"
-        else:
-            title_suffix = ""
-        
-        # 计算Y轴最大值（由于使用stack会叠加数据，需要手动设置最大值）
-        max_consult = max(total_consults) if total_consults and len(total_consults) > 0 else 100
-        y_axis_max = int(max_consult * 1.1) if max_consult > 0 else 110  # 留10%的边距
-        
-        # 获取员工自定义颜色配置
-        bar_colors, line_colors = self.get_employee_colors(employee_ids)
-        line_color = line_colors[0] if line_colors else '#FFA500'
-        
-        # 如果没有配置颜色，使用默认颜色循环
-        if not bar_colors or len(bar_colors) != len(employee_names):
-            bar_color_palette = ['#4CAF50', '#2196F3', '#F44336']
-            bar_colors = [bar_color_palette[i % 3] for i in range(len(employee_names))]
-        
-        # 构建柱状图数据（包含值和标签信息）
-        bar_data = []
-        for i, (consult, avg_reply) in enumerate(zip(total_consults, avg_replies)):
-            bar_data.append({
-                "value": consult,
-                "label": f"{consult}\\n({avg_reply}秒)"
-            })
-        
-        # 使用字符串格式化避免f-string中的嵌套问题
+    def on_chart_page_loaded(self, single_mode, ok):
+        """图表页面加载完成：显示加载期间收到的数据"""
+        if not ok:
+            print(f"[图表] 页面加载失败（{'单员工' if single_mode else '总览'}）")
+            return
+        self.chart_page_ready[single_mode] = True
+        pending = self.pending_chart_data.pop(single_mode, None)
+        if pending is not None:
+            self.render_chart(single_mode, pending)
+    
+    def get_chart_page_html(self, single_mode):
+        """生成图表页面（不含数据，数据由 render_chart 推送）"""
         # 如果 WebChannel 可用，加载相关脚本
         webchannel_script = '<script src="qrc:///qtwebchannel/qwebchannel.js"></script>' if WEBCHANNEL_AVAILABLE else ''
         
@@ -1200,7 +1145,7 @@ class HistoryDialog(QDialog):
     <meta charset="UTF-8">
     <title>员工效率统计</title>
     __WEBCHANNEL_SCRIPT__
-    ''' + echarts_script + '''
+    <script src="__ECHARTS_SRC__"></script>
     <style>
         body {
             margin: 0;
@@ -1220,65 +1165,32 @@ class HistoryDialog(QDialog):
     </style>
 </head>
 <body>
-    <div id="loading">正在加载图表库...</div>
+    <div id="loading">正在加载图表...</div>
     <div id="chart" style="width:100%;height:700px;display:none;"></div>
     <script>
-        var employeeNames = __EMPLOYEE_NAMES__;
-        var employeeIds = __EMPLOYEE_IDS__;
-        var totalConsults = __TOTAL_CONSULTS__;
-        var avgReplies = __AVG_REPLIES__;
-        var efficiencies = __EFFICIENCIES__;
-        var barColors = __BAR_COLORS__;
-        var lineColor = __LINE_COLOR__;
-        var loadStartTime = Date.now();
-        var maxLoadTime = 15000; // 15秒超时
+        var singleMode = __SINGLE_MODE__;
+        var employeeNames = [];
+        var employeeIds = [];
+        var totalConsults = [];
+        var avgReplies = [];
+        var myChart = null;
+        var hasData = false;  // 当前是否显示的是完整图表（否则是"暂无数据"）
         
         // 初始化 WebChannel（如果可用）
-        var bridge = null;
-        var webChannelReady = false;
         if (typeof QWebChannel !== 'undefined' && typeof qt !== 'undefined') {
             try {
                 new QWebChannel(qt.webChannelTransport, function(channel) {
-                    bridge = channel.objects.bridge;
-                    window.bridge = bridge;
-                    webChannelReady = true;
+                    window.bridge = channel.objects.bridge;
                 });
             } catch (e) {
             }
         }
         
-        function initChart() {
-            // 检查超时
-            if (Date.now() - loadStartTime > maxLoadTime) {
-                var loading = document.getElementById('loading');
-                if (loading) {
-                    loading.innerHTML = '图表库加载超时，请检查网络连接';
-                    loading.style.color = 'red';
-                }
-                return;
-            }
-            
-            // 检查echarts是否已加载
-            if (typeof echarts === 'undefined') {
-                setTimeout(initChart, 100);
-                return;
-            }
-            
-            // 隐藏加载提示，显示图表
-            document.getElementById('loading').style.display = 'none';
-            document.getElementById('chart').style.display = 'block';
-            
-            var chartDom = document.getElementById('chart');
-            // 使用暗色主题或默认主题，加快渲染
-            var myChart = echarts.init(chartDom, null, {
-                renderer: 'canvas',
-                useDirtyRect: false  // 禁用脏矩形优化，加快首次渲染
-            });
-            
-            var option = {
+        function buildOption(chartData) {
+            return {
                 title: {
-                    text: '员工工作效率统计 - __PERIOD_NAME__',
-                    subtext: '__DATE_RANGE__',
+                    text: '员工工作效率统计 - ' + chartData.periodName,
+                    subtext: chartData.dateRange,
                     left: 'center',
                     top: 15,
                     textStyle: { 
@@ -1322,7 +1234,7 @@ class HistoryDialog(QDialog):
                                 result += '<div style="margin: 3px 0; margin-left: 20px;"><span style="color: #fff; font-size: 13px;">平均回复时长: <strong>' + avgReply + '</strong> 秒</span></div>';
                             } else if (item.seriesName === '效率指标') {
                                 // 效率指标（根据时间周期显示不同文字）
-                                result += '<div style="margin: 3px 0;">' + item.marker + '<span style="margin-left: 5px; color: #fff; font-size: 13px;">__PERIOD_TOOLTIP__效率指标: <strong>' + item.value.toFixed(2) + '</strong></span></div>';
+                                result += '<div style="margin: 3px 0;">' + item.marker + '<span style="margin-left: 5px; color: #fff; font-size: 13px;">' + chartData.periodTooltip + '效率指标: <strong>' + item.value.toFixed(2) + '</strong></span></div>';
                             }
                             // 跳过"标签层"
                         });
@@ -1393,7 +1305,7 @@ class HistoryDialog(QDialog):
                         },
                         scale: false,  // 不从0开始，更清晰显示差异
                         // 手动设置最大值，避免stack导致的数据叠加影响Y轴范围
-                        max: __Y_AXIS_MAX__
+                        max: chartData.yAxisMax
                     },
                     {
                         type: 'value',
@@ -1422,7 +1334,7 @@ class HistoryDialog(QDialog):
                         data: totalConsults.map(function(value, index) {
                             return {
                                 value: value,
-                                itemStyle: { color: barColors[index] }
+                                itemStyle: { color: chartData.barColors[index] }
                             };
                         }),
                         label: {
@@ -1440,14 +1352,14 @@ class HistoryDialog(QDialog):
                         name: '效率指标',
                         type: 'line',
                         yAxisIndex: 1,
-                        data: efficiencies,
+                        data: chartData.efficiencies,
                         z: 2,  // 折线图在中间层（显示在柱状图前面）
                         lineStyle: {
                             width: 3,
-                            color: lineColor
+                            color: chartData.lineColor
                         },
                         itemStyle: {
-                            color: lineColor,
+                            color: chartData.lineColor,
                             borderWidth: 2,
                             borderColor: '#fff'
                         },
@@ -1515,8 +1427,18 @@ class HistoryDialog(QDialog):
                     }
                 ]
             };
+        }
+        
+        function initChart() {
+            // 隐藏加载提示，显示图表
+            document.getElementById('loading').style.display = 'none';
+            document.getElementById('chart').style.display = 'block';
             
-            myChart.setOption(option);
+            var chartDom = document.getElementById('chart');
+            myChart = echarts.init(chartDom, null, {
+                renderer: 'canvas',
+                useDirtyRect: false  // 禁用脏矩形优化，加快首次渲染
+            });
             
             // 禁用图表右键菜单
             chartDom.oncontextmenu = function(e) {
@@ -1525,7 +1447,6 @@ class HistoryDialog(QDialog):
             };
             
             // 添加双击事件监听（支持双向切换 + 防抖）
-            var singleMode = __SINGLE_MODE__;
             var doubleClickLocked = false;  // 防抖锁
             
             myChart.on('dblclick', function(params) {
@@ -1574,129 +1495,48 @@ class HistoryDialog(QDialog):
             window.addEventListener('resize', function() {
                 myChart.resize();
             });
-            
-            // 将图表实例暴露为全局变量（方案3：图表实例复用）
-            window.chartInstance = myChart;
         }
         
-        // 方案3：只更新数据的函数（不重新创建图表）
-        window.updateChartData = function(newData) {
-            if (!window.chartInstance) return;
-            
-            // 更新全局变量
-            employeeNames = newData.employeeNames;
-            employeeIds = newData.employeeIds;
-            totalConsults = newData.totalConsults;
-            avgReplies = newData.avgReplies;
-            efficiencies = newData.efficiencies;
-            barColors = newData.barColors;
-            lineColor = newData.lineColor;
-            
-            // 只更新数据，不重新创建图表
-            window.chartInstance.setOption({
-                title: {
-                    text: '员工工作效率统计 - ' + newData.periodName,
-                    subtext: newData.dateRange
-                },
-                xAxis: {
-                    data: employeeNames
-                },
-                yAxis: [
-                    {
-                        max: newData.yAxisMax
-                    },
-                    {}
-                ],
-                series: [
-                    {
-                        data: totalConsults.map(function(value, index) {
-                            return {
-                                value: value,
-                                itemStyle: { color: barColors[index] }
-                            };
-                        })
-                    },
-                    {
-                        data: efficiencies,
-                        lineStyle: {
-                            color: lineColor
-                        },
-                        itemStyle: {
-                            color: lineColor
-                        }
-                    },
-                    {
-                        data: totalConsults.map(function(value, index) {
-                            return {
-                                value: value,
-                                itemStyle: { 
-                                    color: 'transparent',
-                                    borderColor: 'transparent',
-                                    borderWidth: 0
-                                }
-                            };
-                        })
-                    }
-                ]
-            });
-        };
-        
-        // 等待ECharts加载完成后初始化图表
-        function tryInitChart() {
-            if (typeof echarts !== 'undefined') {
+        // 更新图表数据（由Python通过runJavaScript调用，不重新加载页面）
+        window.renderChart = function(chartData) {
+            if (typeof echarts === 'undefined') {
+                var loading = document.getElementById('loading');
+                loading.innerHTML = '图表库加载失败，请检查 echarts.min.js 或网络连接';
+                loading.style.color = 'red';
+                return;
+            }
+            if (!myChart) {
                 initChart();
-            } else {
-                // 检查超时
-                if (Date.now() - loadStartTime > maxLoadTime) {
-                    var loading = document.getElementById('loading');
-                    if (loading) {
-                        loading.innerHTML = '图表库加载超时，请检查网络连接';
-                        loading.style.color = 'red';
+            }
+            
+            employeeNames = chartData.employeeNames;
+            employeeIds = chartData.employeeIds;
+            totalConsults = chartData.totalConsults;
+            avgReplies = chartData.avgReplies;
+            
+            if (employeeNames.length === 0) {
+                myChart.setOption({
+                    title: {
+                        text: '暂无数据',
+                        left: 'center',
+                        top: 'middle',
+                        textStyle: { fontSize: 24, color: '#999' }
                     }
-                    return;
-                }
-                setTimeout(tryInitChart, 100);
+                }, true);
+                hasData = false;
+                return;
             }
-        }
-        
-        // 如果ECharts已经加载，直接初始化
-        if (typeof echarts !== 'undefined') {
-            initChart();
-        } else {
-            // 等待加载
-            setTimeout(tryInitChart, 500);
-        }
+            // 已经显示图表时合并更新（保留动画），从"暂无数据"切换时完整替换
+            myChart.setOption(buildOption(chartData), !hasData);
+            hasData = true;
+        };
     </script>
 </body>
 </html>
 '''
-        # 使用format方法替换变量
-        # 使用字符串替换避免format方法的占位符问题
         html_content = html_template.replace('__WEBCHANNEL_SCRIPT__', webchannel_script)
-        html_content = html_content.replace('__EMPLOYEE_NAMES__', json.dumps(employee_names, ensure_ascii=False))
-        html_content = html_content.replace('__EMPLOYEE_IDS__', json.dumps(employee_ids, ensure_ascii=False))
-        html_content = html_content.replace('__TOTAL_CONSULTS__', json.dumps(total_consults))
-        html_content = html_content.replace('__AVG_REPLIES__', json.dumps(avg_replies))
-        html_content = html_content.replace('__EFFICIENCIES__', json.dumps(efficiencies))
-        html_content = html_content.replace('__BAR_COLORS__', json.dumps(bar_colors))
-        html_content = html_content.replace('__LINE_COLOR__', json.dumps(line_color))
-        html_content = html_content.replace('__Y_AXIS_MAX__', str(y_axis_max))
+        html_content = html_content.replace('__ECHARTS_SRC__', self.get_echarts_src())
         html_content = html_content.replace('__SINGLE_MODE__', 'true' if single_mode else 'false')
-        # 转义特殊字符，避免JavaScript语法错误
-        period_name_safe = (period_name + title_suffix).replace("'", "\\'").replace('"', '\\"')
-        date_range_safe = date_range.replace("'", "\\'").replace('"', '\\"')
-        
-        # 生成tooltip专用的时间周期文字
-        period_tooltip = period_name
-        if period_name == "今日":
-            period_tooltip = "当日"
-        elif period_name == "自定义":
-            period_tooltip = "自定义时间"
-        # "本周"和"本月"保持不变
-        
-        html_content = html_content.replace('__PERIOD_NAME__', period_name_safe)
-        html_content = html_content.replace('__PERIOD_TOOLTIP__', period_tooltip)
-        html_content = html_content.replace('__DATE_RANGE__', date_range_safe)
         return html_content
     
     def back_to_overview(self):
@@ -1743,16 +1583,16 @@ class HistoryDialog(QDialog):
     
     def load_employee_list(self):
         """修复1：加载所有员工列表"""
+        # 从缓存或服务器获取员工列表
+        if hasattr(self, 'parent') and self.parent() and hasattr(self.parent(), 'current_data'):
+            self.fill_employee_list(self.parent().current_data)
+        else:
+            request_executor.get("/employees", self.fill_employee_list, key="employee_list")
+    
+    def fill_employee_list(self, employees):
+        """把员工添加到列表"""
         try:
             self.employee_list.clear()
-            # 从缓存或服务器获取员工列表
-            if hasattr(self, 'parent') and self.parent() and hasattr(self.parent(), 'current_data'):
-                employees = self.parent().current_data
-            else:
-                # 从服务器获取
-                resp = requests.get(f"{SERVER_URL}/employees", timeout=REQUEST_TIMEOUT)
-                employees = resp.json() if resp.status_code == 200 else []
-            
             self.all_employees = employees
             
             # 添加到列表
@@ -1761,6 +1601,10 @@ class HistoryDialog(QDialog):
                 item = QListWidgetItem(item_text)
                 item.setData(Qt.UserRole, emp.get("employee_name", ""))  # 存储employee_id
                 self.employee_list.addItem(item)
+            
+            # 列表是异步加载时，加载完成后再选中当前员工
+            if self.current_employee_id:
+                self.select_employee_in_list(self.current_employee_id)
                 
             print(f"[员工列表] 加载了 {len(employees)} 个员工")
         except Exception as e:
@@ -1802,7 +1646,6 @@ class HistoryDialog(QDialog):
             self.query_stats()
         except Exception as e:
             print(f"[查询失败] {e}")
-            import traceback
             traceback.print_exc()
             # 不显示错误框，只是打印日志
     
@@ -1917,18 +1760,30 @@ class HistoryDialog(QDialog):
             # 如果缓存不可用或提取失败，从服务器请求（兼容模式）
             if data is None:
                 print(f"[服务器模式] 从服务器请求 {period_name} 数据...")
-                resp = requests.get(f"{SERVER_URL}/stats_by_employee", params=params, timeout=REQUEST_TIMEOUT)
-                data = resp.json() if resp.status_code == 200 else []
-                elapsed = (time.time() - start_time) * 1000
-                print(f"[服务器模式] 请求完成，耗时 {elapsed:.1f}ms")
+                
+                def on_loaded(data):
+                    elapsed = (time.time() - start_time) * 1000
+                    print(f"[服务器模式] 请求完成，耗时 {elapsed:.1f}ms")
+                    self.show_overview_stats(data, period_name, date_range, "服务器")
+                
+                def on_error(e):
+                    QMessageBox.critical(self, "错误", f"查询总览数据失败: {str(e)}")
+                
+                # 同一时间只保留最后一次图表查询，先返回的旧结果不会覆盖新结果
+                request_executor.get("/stats_by_employee", on_loaded, on_error, params=params, key="chart_stats")
+                return
             
+            request_executor.cancel("chart_stats")
+            self.show_overview_stats(data, period_name, date_range, "缓存" if use_cache else "服务器")
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"查询总览数据失败: {str(e)}")
+    
+    def show_overview_stats(self, data, period_name, date_range, mode_text):
+        """排序、过滤后把总览数据推送到图表"""
+        try:
             if not data:
-                # 没有数据时，显示空数据HTML，但重置chart_initialized，下次有数据时重新加载
-                html_content = self.get_chart_html([], period_name, date_range)
-                self.web_view_overview.setHtml(html_content)
-                self.chart_initialized = False  # 重置标志，下次有数据时重新加载完整HTML
-                self.last_mode = 'overview'
                 print("[提示] 当前时间段没有数据")
+                self.update_chart_data_only([], period_name, date_range)
                 return
             
             # 应用排序
@@ -1938,20 +1793,9 @@ class HistoryDialog(QDialog):
             if self.period_group.checkedId() == 0:  # 今日
                 data = self.apply_visibility_filter(data)
             
-            # 分模式复用逻辑
-            if not self.chart_initialized or self.last_mode != 'overview':
-                # 首次加载 或 模式切换 或 上次数据为空 → 重新加载完整HTML
-                mode_text = "缓存" if use_cache else "服务器"
-                print(f"[总览-{mode_text}] 重新加载完整HTML")
-                html_content = self.get_chart_html(data, period_name, date_range)
-                self.web_view_overview.setHtml(html_content)
-                self.chart_initialized = True
-                self.last_mode = 'overview'
-            else:
-                # 同一模式内切换时间周期 → 只更新数据（0.1秒）
-                mode_text = "缓存" if use_cache else "服务器"
-                print(f"[总览-{mode_text}] 快速更新数据")
-                self.update_chart_data_only(data, period_name, date_range, single_mode=False)
+            # 只推送数据，不重新加载页面
+            print(f"[总览-{mode_text}] 更新图表数据")
+            self.update_chart_data_only(data, period_name, date_range, single_mode=False)
         except Exception as e:
             QMessageBox.critical(self, "错误", f"查询总览数据失败: {str(e)}")
     
@@ -2008,46 +1852,38 @@ class HistoryDialog(QDialog):
             # 如果缓存不可用，从服务器请求
             if all_data is None:
                 print(f"[单员工-服务器模式] 从服务器请求数据...")
-                resp = requests.get(f"{SERVER_URL}/stats_by_employee", params=params, timeout=REQUEST_TIMEOUT)
-                all_data = resp.json() if resp.status_code == 200 else []
-                elapsed = (time.time() - start_time) * 1000
-                print(f"[单员工-服务器模式] 请求完成，耗时 {elapsed:.1f}ms")
-            
-            # 筛选出当前员工的数据
-            data = [item for item in all_data if item.get("employee_id") == self.current_employee_id]
-            
-            if not data:
-                print("[单员工] 当前时间段没有数据")
-                # 显示空数据
-                if not self.single_chart_initialized:
-                    html_content = self.get_chart_html([], period_name, date_range, single_mode=True)
-                    self.web_view_single.setHtml(html_content)
-                    self.single_chart_initialized = True
+                
+                def on_loaded(all_data):
+                    elapsed = (time.time() - start_time) * 1000
+                    print(f"[单员工-服务器模式] 请求完成，耗时 {elapsed:.1f}ms")
+                    self.show_single_employee_stats(all_data, period_name, date_range, "服务器")
+                
+                def on_error(e):
+                    print(f"[错误] 查询单员工数据失败: {e}")
+                
+                request_executor.get("/stats_by_employee", on_loaded, on_error, params=params, key="chart_stats")
                 return
             
-            # 首次加载或模式切换：加载完整HTML
-            if not self.single_chart_initialized:
-                mode_text = "缓存" if use_cache else "服务器"
-                print(f"[单员工-{mode_text}] 首次加载，生成完整HTML")
-                html_content = self.get_chart_html(data, period_name, date_range, single_mode=True)
-                self.web_view_single.setHtml(html_content)
-                self.single_chart_initialized = True
-            else:
-                # 已初始化：只更新数据（快速模式）
-                mode_text = "缓存" if use_cache else "服务器"
-                print(f"[单员工-{mode_text}] 快速更新数据")
-                self.update_chart_data_only(data, period_name, date_range, single_mode=True)
+            request_executor.cancel("chart_stats")
+            self.show_single_employee_stats(all_data, period_name, date_range, "缓存" if use_cache else "服务器")
         
         except Exception as e:
             print(f"[错误] 查询单员工数据失败: {e}")
-            import traceback
             traceback.print_exc()
     
-    def update_chart_data_only(self, data, period_name, date_range, single_mode=False):
-        """只更新图表数据，不重新加载HTML（方案3：图表实例复用）"""
+    def show_single_employee_stats(self, all_data, period_name, date_range, mode_text):
+        """筛选出当前员工的数据推送到图表（没有数据时显示"暂无数据"）"""
+        data = [item for item in all_data if item.get("employee_id") == self.current_employee_id]
+        
         if not data:
-            return
+            print("[单员工] 当前时间段没有数据")
         
+        # 只推送数据，不重新加载页面
+        print(f"[单员工-{mode_text}] 更新图表数据")
+        self.update_chart_data_only(data, period_name, date_range, single_mode=True)
+    
+    def update_chart_data_only(self, data, period_name, date_range, single_mode=False):
+        """只更新图表数据，不重新加载页面（data为空时显示"暂无数据"）"""
         # 准备数据
         employee_names = [item["employee_name"] for item in data]
         employee_ids = [item.get("employee_id", item["employee_name"]) for item in data]
@@ -2055,21 +1891,30 @@ class HistoryDialog(QDialog):
         avg_replies = [item["avg_reply"] for item in data]
         efficiencies = [item["efficiency"] for item in data]
         
-        # 计算Y轴最大值
+        # 计算Y轴最大值（由于使用stack会叠加数据，需要手动设置最大值）
         max_consult = max(total_consults) if total_consults else 100
-        y_axis_max = int(max_consult * 1.1) if max_consult > 0 else 110
+        y_axis_max = int(max_consult * 1.1) if max_consult > 0 else 110  # 留10%的边距
         
         # 获取颜色配置
-        bar_colors, line_colors = self.get_employee_colors(employee_ids)
+        bar_colors, line_colors = self.get_employee_colors(employee_ids) if data else ([], [])
         line_color = line_colors[0] if line_colors else '#FFA500'
         
+        # 如果没有配置颜色，使用默认颜色循环
         if not bar_colors or len(bar_colors) != len(employee_names):
             bar_color_palette = ['#4CAF50', '#2196F3', '#F44336']
             bar_colors = [bar_color_palette[i % 3] for i in range(len(employee_names))]
         
-        # 构建JavaScript数据对象
-        import json
-        new_data = {
+        # 单员工模式标题调整
+        title_suffix = f" - {employee_names[0]}" if single_mode and data else ""
+        
+        # 生成tooltip专用的时间周期文字（"本周"和"本月"保持不变）
+        period_tooltip = period_name
+        if period_name == "今日":
+            period_tooltip = "当日"
+        elif period_name == "自定义":
+            period_tooltip = "自定义时间"
+        
+        self.render_chart(single_mode, {
             'employeeNames': employee_names,
             'employeeIds': employee_ids,
             'totalConsults': total_consults,
@@ -2077,23 +1922,30 @@ class HistoryDialog(QDialog):
             'efficiencies': efficiencies,
             'barColors': bar_colors,
             'lineColor': line_color,
-            'periodName': period_name,
+            'periodName': period_name + title_suffix,
+            'periodTooltip': period_tooltip,
             'dateRange': date_range,
             'yAxisMax': y_axis_max
-        }
-        
-        # 使用当前的WebView
-        target_webview = self.web_view
-        
-        # 调用JavaScript函数更新数据
-        js_code = f"if (window.updateChartData) {{ window.updateChartData({json.dumps(new_data)}); }}"
-        target_webview.page().runJavaScript(js_code)
+        })
+    
+    def render_chart(self, single_mode, chart_data):
+        """把数据推送到图表页面（页面还没加载完成时先保存，加载完成后再显示）"""
+        if not self.chart_page_ready[single_mode]:
+            self.pending_chart_data[single_mode] = chart_data
+            return
+        js_code = f"window.renderChart({json.dumps(chart_data, ensure_ascii=False)});"
+        self.get_chart_view(single_mode).page().runJavaScript(js_code)
     
     def get_employee_colors(self, employee_ids):
         """获取员工颜色配置（优先使用缓存）"""
         try:
+            # 主窗口每次刷新都会同步最新的颜色
+            app = self.get_dashboard_app()
+            if app is not None:
+                self.set_color_cache(app.employee_colors)
+            
             # 如果缓存已加载，直接从缓存获取（快速模式）
-            if self.color_cache_loaded and self.color_cache:
+            if self.color_cache_loaded:
                 bar_colors = []
                 for emp_id in employee_ids:
                     if emp_id in self.color_cache:
@@ -2106,37 +1958,8 @@ class HistoryDialog(QDialog):
                 
                 return bar_colors, line_colors
             
-            # 缓存未加载，从服务器获取（兼容模式）
-            print("[颜色配置] 缓存未加载，从服务器获取...")
-            employee_ids_str = ",".join(employee_ids)
-            resp = requests.get(
-                f"{SERVER_URL}/color_configs",
-                params={"employee_ids": employee_ids_str},
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            if resp.status_code == 200:
-                data = resp.json()
-                global_line_color = data.get("global_line_color", "#FFA500")
-                employee_colors = data.get("employee_colors", {})
-                
-                # 构建柱状图颜色列表
-                bar_colors = []
-                for emp_id in employee_ids:
-                    if emp_id in employee_colors:
-                        bar_colors.append(employee_colors[emp_id].get("bar_color", "#4CAF50"))
-                    else:
-                        bar_colors.append("#4CAF50")  # 默认绿色
-                
-                # 所有员工使用统一的线形图颜色
-                line_colors = [global_line_color] * len(employee_ids)
-                
-                return bar_colors, line_colors
-            else:
-                # API调用失败，使用默认颜色
-                default_bar = '#4CAF50'
-                default_line = '#FFA500'
-                return [default_bar] * len(employee_ids), [default_line] * len(employee_ids)
+            # 还没有同步颜色配置，使用默认颜色
+            return ['#4CAF50'] * len(employee_ids), ['#FFA500'] * len(employee_ids)
         except Exception as e:
             print(f"获取颜色配置错误: {e}")
             # 如果获取失败，使用默认颜色
@@ -2144,59 +1967,24 @@ class HistoryDialog(QDialog):
             default_line = '#FFA500'
             return [default_bar] * len(employee_ids), [default_line] * len(employee_ids)
     
-    async def _get_colors_async(self, employee_ids):
-        """异步获取员工颜色（通过API）"""
-        try:
-            # 通过API获取颜色配置
-            employee_ids_str = ",".join(employee_ids)
-            resp = requests.get(
-                f"{SERVER_URL}/color_configs",
-                params={"employee_ids": employee_ids_str},
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            if resp.status_code == 200:
-                data = resp.json()
-                global_line_color = data.get("global_line_color", "#FFA500")
-                employee_colors = data.get("employee_colors", {})
-                
-                # 构建柱状图颜色列表
-                bar_colors = []
-                for emp_id in employee_ids:
-                    if emp_id in employee_colors:
-                        bar_colors.append(employee_colors[emp_id].get("bar_color", "#4CAF50"))
-                    else:
-                        bar_colors.append("#4CAF50")  # 默认绿色
-                
-                # 所有员工使用统一的线形图颜色
-                line_colors = [global_line_color] * len(employee_ids)
-                
-                return bar_colors, line_colors
-            else:
-                # API调用失败，返回默认颜色
-                default_bar = '#4CAF50'
-                default_line = '#FFA500'
-                return [default_bar] * len(employee_ids), [default_line] * len(employee_ids)
-        except Exception as e:
-            print(f"获取颜色配置错误: {e}")
-            # 返回默认颜色
-            default_bar = '#4CAF50'
-            default_line = '#FFA500'
-            return [default_bar] * len(employee_ids), [default_line] * len(employee_ids)
-    
     def open_employee_management_dialog(self):
         """打开员工管理对话框（颜色+排序+隐藏）"""
         try:
-            # 获取当前员工列表
-            resp = requests.get(f"{SERVER_URL}/employees", timeout=REQUEST_TIMEOUT)
-            employees = resp.json() if resp.status_code == 200 else []
+            # 员工列表和现有配置都使用主窗口从 /dashboard 同步的数据
+            app = self.get_dashboard_app()
+            if app is None:
+                QMessageBox.information(self, "提示", "正在从服务器同步数据，请稍后再试")
+                return
+            employees = app.apply_employee_sort(list(app.employee_rows.values()))
             
             if not employees:
                 QMessageBox.information(self, "提示", "当前没有员工记录")
                 return
             
-            dialog = EmployeeManagementDialog(self, employees)
+            dialog = EmployeeManagementDialog(self, employees, app)
             if dialog.exec_() == QDialog.Accepted:
+                # 主窗口从服务器同步修改后的排序、可见性和颜色
+                app.update_realtime(force=True)
                 # 刷新缓存（颜色配置可能已更改）
                 self.preload_color_configs()
                 self.preload_monthly_data()  # 也刷新月度数据（可能有名称变更）
@@ -2209,56 +1997,46 @@ class HistoryDialog(QDialog):
     
     def toggle_hidden_employees(self):
         """切换展示/隐藏员工状态"""
-        try:
-            # 获取当前全局显示模式
-            resp = requests.get(f"{SERVER_URL}/global_visibility_mode", timeout=REQUEST_TIMEOUT)
-            current_mode = resp.json() if resp.status_code == 200 else {"show_all": False}
-            current_show_all = current_mode.get("show_all", False)
-            
-            # 切换状态
-            new_show_all = not current_show_all
-            
-            # 保存到服务器
-            resp = requests.post(
-                f"{SERVER_URL}/global_visibility_mode",
-                json={"show_all": new_show_all},
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            if resp.status_code == 200:
-                # 更新按钮文本
-                self.update_toggle_button_text()
-                # 刷新图表（只在今日模式）
-                if self.period_group.checkedId() == 0:  # 今日
-                    self.query_stats()
-            else:
+        app = self.get_dashboard_app()
+        if app is None:
+            QMessageBox.information(self, "提示", "正在从服务器同步数据，请稍后再试")
+            return
+        
+        # 切换状态
+        new_show_all = not app.show_all
+        
+        def on_saved(result):
+            app.show_all = new_show_all  # 下一次 /dashboard 响应之前先使用本地值
+            # 更新按钮文本
+            self.update_toggle_button_text()
+            # 刷新图表（只在今日模式）
+            if self.period_group.checkedId() == 0:  # 今日
+                self.query_stats()
+        
+        def on_error(e):
+            if isinstance(e, RequestError):
                 QMessageBox.warning(self, "警告", "更新显示模式失败")
-        except Exception as e:
-            handle_request_error(self, e, "切换显示模式")
+            else:
+                handle_request_error(self, e, "切换显示模式")
+        
+        # 保存到服务器
+        request_executor.post("/global_visibility_mode", {"show_all": new_show_all}, on_saved, on_error)
     
     def update_toggle_button_text(self):
         """更新展示/隐藏按钮的文本"""
-        try:
-            resp = requests.get(f"{SERVER_URL}/global_visibility_mode", timeout=REQUEST_TIMEOUT)
-            mode = resp.json() if resp.status_code == 200 else {"show_all": False}
-            show_all = mode.get("show_all", False)
-            
-            if show_all:
-                self.toggle_hidden_btn.setText("隐藏员工")
-            else:
-                self.toggle_hidden_btn.setText("展示隐藏员工")
-        except Exception as e:
-            print(f"更新按钮文本失败: {e}")
+        app = self.get_dashboard_app()
+        show_all = app.show_all if app is not None else False
+        
+        if show_all:
+            self.toggle_hidden_btn.setText("隐藏员工")
+        else:
+            self.toggle_hidden_btn.setText("展示隐藏员工")
     
     def apply_employee_order(self, data):
-        """应用员工排序"""
+        """应用员工排序（使用主窗口同步的排序配置）"""
         try:
-            # 获取排序配置
-            resp = requests.get(f"{SERVER_URL}/employee_order", timeout=REQUEST_TIMEOUT)
-            order_data = resp.json() if resp.status_code == 200 else []
-            
-            # 构建排序字典
-            order_dict = {item['employee_id']: item['order'] for item in order_data}
+            app = self.get_dashboard_app()
+            order_dict = app.employee_order if app is not None else {}
             
             # 对数据排序
             def get_sort_key(item):
@@ -2272,32 +2050,25 @@ class HistoryDialog(QDialog):
             return data  # 如果排序失败，返回原始数据
     
     def apply_visibility_filter(self, data):
-        """应用员工可见性过滤（只在今日模式）- 新版自动隐藏逻辑"""
+        """应用员工可见性过滤（只在今日模式）- 新版自动隐藏逻辑
+
+        全局显示模式、实时在线状态和隐藏配置都使用主窗口从 /dashboard 同步的数据，不请求服务器；
+        还没有同步时不过滤。
+        """
         try:
-            # 获取全局显示模式
-            resp = requests.get(f"{SERVER_URL}/global_visibility_mode", timeout=REQUEST_TIMEOUT)
-            mode = resp.json() if resp.status_code == 200 else {"show_all": False}
-            show_all = mode.get("show_all", False)
+            app = self.get_dashboard_app()
+            if app is None:
+                print("[可见性] 还没有同步可见性配置，暂不过滤")
+                return data
             
-            if show_all:
+            if app.show_all:
                 # 显示所有员工，不过滤
                 print("[可见性] 显示所有员工")
                 return data
             
-            # 获取实时在线状态（从/employees接口）
-            try:
-                resp_realtime = requests.get(f"{SERVER_URL}/employees", timeout=REQUEST_TIMEOUT)
-                realtime_data = resp_realtime.json() if resp_realtime.status_code == 200 else []
-                online_dict = {emp.get("employee_name", ""): emp.get("online", False) for emp in realtime_data}
-                print(f"[可见性] 获取到 {len(online_dict)} 个员工的实时在线状态")
-            except Exception as e:
-                print(f"[可见性] 获取实时在线状态失败: {e}，默认所有员工在线")
-                online_dict = {}
-            
-            # 获取员工隐藏配置
-            resp = requests.get(f"{SERVER_URL}/employee_visibility", timeout=REQUEST_TIMEOUT)
-            visibility_data = resp.json() if resp.status_code == 200 else []
-            hidden_dict = {item['employee_id']: item['hidden'] for item in visibility_data}
+            # 实时在线状态和员工隐藏配置
+            online_dict = {employee_id: emp.get("online", False) for employee_id, emp in app.employee_rows.items()}
+            hidden_dict = {employee_id: item['hidden'] for employee_id, item in app.employee_visibility.items()}
             
             # 收集需要更新状态的员工（批量处理）
             visibility_updates = []
@@ -2356,67 +2127,214 @@ class HistoryDialog(QDialog):
                 if not is_hidden:
                     filtered_data.append(item)
             
-            # 批量保存状态更新到服务器
+            # 批量保存状态更新到服务器（后台发送，不阻塞界面）
             if visibility_updates:
-                try:
-                    requests.post(
-                        f"{SERVER_URL}/employee_visibility",
-                        json={"visibility": visibility_updates},
-                        timeout=REQUEST_TIMEOUT
-                    )
-                    print(f"[可见性] 批量更新 {len(visibility_updates)} 个员工状态")
-                except Exception as e:
-                    print(f"[可见性] 批量保存失败: {e}")
+                # 先更新本地配置，避免下一次 /dashboard 响应之前重复提交
+                for update in visibility_updates:
+                    app.employee_visibility[update["employee_id"]] = {
+                        "hidden": update["hidden"], "is_manual": update["is_manual"]
+                    }
+                request_executor.post(
+                    "/employee_visibility", {"visibility": visibility_updates},
+                    lambda result, count=len(visibility_updates): print(f"[可见性] 批量更新 {count} 个员工状态"),
+                    lambda e: print(f"[可见性] 批量保存失败: {e}")
+                )
             
             print(f"[可见性] 过滤后显示 {len(filtered_data)}/{len(data)} 个员工")
             return filtered_data
-        except requests.exceptions.Timeout:
-            print(f"[可见性] 请求超时，返回原始数据")
-            return data
         except Exception as e:
             print(f"应用可见性过滤失败: {e}")
             return data  # 如果过滤失败，返回原始数据
 
-class NetworkWorker(QThread):
-    """网络请求工作线程，避免阻塞UI"""
-    data_ready = pyqtSignal(list)  # 数据准备好的信号
-    error_occurred = pyqtSignal(str)  # 错误信号
+class DashboardPoller(QThread):
+    """轮询 /dashboard 的常驻线程
+
+    整个程序只有这一个轮询线程，使用一个保持连接的 requests.Session，同一时间最多只有一个请求。
+    间隔自适应：返回了新数据时回到最短间隔，304（没有变化）或请求失败时逐步放慢到最长间隔；
+    推送流连接时员工数据由推送流更新，固定按 DASHBOARD_REFRESH_INTERVAL 同步元数据。
+
+    since/epoch/etag 由主窗口在处理完响应（或推送流的增量）后更新。
+    """
+    payload_ready = pyqtSignal(dict, bool, float)  # (/dashboard 响应, 是否强制刷新, 请求开始时间)
+    error_occurred = pyqtSignal(str)
+    stats_ready = pyqtSignal(dict)  # 每次轮询后的延迟统计
+    
+    LATENCY_WINDOW = 100  # 延迟统计使用最近多少次请求
     
-    def __init__(self, url, timeout=REQUEST_TIMEOUT):
+    def __init__(self):
         super().__init__()
-        self.url = url
-        self.timeout = timeout
-        self._is_cancelled = False
+        self.session = requests.Session()
+        self.since = 0  # 已同步到的服务器快照序号
+        self.epoch = None  # 快照序号所属的进程标识
+        self.etag = None  # 上次 /dashboard 响应的版本号，用于 If-None-Match
+        self.stream_connected = False
+        self.interval = POLL_MIN_INTERVAL
+        self._wake = threading.Event()
+        self._force = False
+        self._is_stopped = False
+        self._latencies = deque(maxlen=self.LATENCY_WINDOW)
+        self.poll_count = 0
+        self.error_count = 0
     
-    def cancel(self):
-        """取消当前请求"""
-        self._is_cancelled = True
+    def poll_now(self, force=False):
+        """立即轮询一次（force=True 时请求全量数据）；已有请求在进行时，在它完成后立即开始"""
+        if force:
+            self._force = True
+        self._wake.set()
+    
+    def stop(self):
+        self._is_stopped = True
+        self._wake.set()
     
     def run(self):
-        """在后台线程中执行网络请求"""
-        if self._is_cancelled:
-            return
-        
-        try:
-            resp = requests.get(self.url, timeout=self.timeout)
-            
-            if self._is_cancelled:
-                return
-            
-            if resp.status_code == 200:
-                employees = resp.json()
-                self.data_ready.emit(employees)
+        while not self._is_stopped:
+            force, self._force = self._force, False
+            self._wake.clear()
+            changed = self._poll(force)
+            
+            if self.stream_connected:
+                self.interval = DASHBOARD_REFRESH_INTERVAL
+            elif changed:
+                self.interval = POLL_MIN_INTERVAL
             else:
-                self.error_occurred.emit(f"HTTP {resp.status_code}")
+                self.interval = min(max(self.interval, POLL_MIN_INTERVAL) * POLL_BACKOFF, POLL_MAX_INTERVAL)
+            self.stats_ready.emit(self.stats(ok=changed is not None))
+            self._wake.wait(self.interval)
+        self.session.close()
+    
+    def _poll(self, force):
+        """请求一次 /dashboard：返回是否有新数据（失败时返回None）"""
+        params = {"since": 0 if force else self.since, "epoch": self.epoch or ""}
+        headers = {"If-None-Match": f'"{self.etag}"'} if self.etag and not force else {}
+        request_time = time.time()
+        start = time.perf_counter()
+        try:
+            resp = self.session.get(f"{SERVER_URL}/dashboard", params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+            self._latencies.append((time.perf_counter() - start) * 1000)
+            self.poll_count += 1
+            if resp.status_code == 304:
+                return False  # 员工数据和元数据都没有变化
+            if resp.status_code != 200:
+                raise Exception(f"HTTP {resp.status_code}")
+            self.payload_ready.emit(resp.json(), force, request_time)
+            return True
         except requests.exceptions.Timeout:
-            if not self._is_cancelled:
-                self.error_occurred.emit("请求超时")
+            message = "请求超时"
         except requests.exceptions.ConnectionError:
-            if not self._is_cancelled:
-                self.error_occurred.emit("连接失败")
+            message = "连接失败"
         except Exception as e:
-            if not self._is_cancelled:
-                self.error_occurred.emit(str(e))
+            message = str(e)
+        self.error_count += 1
+        if not self._is_stopped:
+            self.error_occurred.emit(message)
+        return None
+    
+    def stats(self, ok=True):
+        """延迟统计（毫秒）：最近一次、平均值和P95"""
+        latencies = sorted(self._latencies)
+        return {
+            "ok": ok,
+            "polls": self.poll_count,
+            "errors": self.error_count,
+            "interval": self.interval,
+            "last_ms": self._latencies[-1] if self._latencies else 0,
+            "avg_ms": sum(latencies) / len(latencies) if latencies else 0,
+            "p95_ms": latencies[int(len(latencies) * 0.95)] if latencies else 0
+        }
+
+class EmployeeStreamWorker(QThread):
+    """推送流工作线程：保持一个到 /employees/stream 的长连接，收到员工数据变化时发出信号
+
+    连接断开后自动重连（重连时带上已同步的快照序号，只补发缺少的变化）。
+    推送流不可用时，主窗口继续使用定时轮询。
+    connection_changed 只在连接状态真正变化时发出；一直连不上时重连间隔逐步加长，
+    服务器返回404（旧版服务器没有推送流）时很久才重试一次，不再频繁打断轮询的退避。
+    """
+    delta_ready = pyqtSignal(dict)  # 收到增量数据
+    connection_changed = pyqtSignal(bool)  # 推送流连接/断开
+    
+    RECONNECT_DELAY = 3  # 断开后重连的等待时间（秒）
+    MAX_RECONNECT_DELAY = 60  # 连续连接失败时重连间隔的上限（秒）
+    UNSUPPORTED_RETRY_DELAY = 300  # 服务器不支持推送流（404）时的重试间隔（秒）
+    READ_TIMEOUT = 40  # 超过该时间没有收到任何数据（包括服务器每15秒的心跳）视为连接已断开
+    
+    def __init__(self):
+        super().__init__()
+        self._is_stopped = False
+        self._response = None
+        self.connected = False
+        self.since = 0
+        self.epoch = None
+    
+    def stop(self):
+        """停止推送流（关闭连接以打断阻塞的读取）"""
+        self._is_stopped = True
+        response = self._response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+    
+    def run(self):
+        delay = self.RECONNECT_DELAY
+        while not self._is_stopped:
+            try:
+                self._response = requests.get(
+                    f"{SERVER_URL}/employees/stream",
+                    params={"since": self.since, "epoch": self.epoch or ""},
+                    stream=True,
+                    timeout=(REQUEST_TIMEOUT, self.READ_TIMEOUT)
+                )
+                if self._response.status_code == 404:
+                    delay = self.UNSUPPORTED_RETRY_DELAY
+                    raise Exception(f"服务器不支持推送流，{delay}秒后重试")
+                if self._response.status_code != 200:
+                    raise Exception(f"HTTP {self._response.status_code}")
+                self.connected = True
+                delay = self.RECONNECT_DELAY
+                self.connection_changed.emit(True)
+                print("[推送流] 已连接")
+                
+                data_lines = []
+                for line in self._response.iter_lines(decode_unicode=True):
+                    if self._is_stopped:
+                        break
+                    if line is None:
+                        continue
+                    if line.startswith("data:"):
+                        data_lines.append(line[5:].strip())
+                    elif line == "" and data_lines:
+                        # 空行表示一条事件结束
+                        delta = json.loads("\n".join(data_lines))
+                        data_lines = []
+                        self.since = delta.get("version", 0)
+                        self.epoch = delta.get("epoch")
+                        self.delta_ready.emit(delta)
+            except Exception as e:
+                if not self._is_stopped:
+                    print(f"[推送流] 连接断开: {e}")
+            finally:
+                if self._response is not None:
+                    self._response.close()
+                    self._response = None
+            
+            if self._is_stopped:
+                break
+            if self.connected:
+                self.connected = False
+                self.connection_changed.emit(False)
+                self._sleep(delay)
+            else:
+                # 本次没有连上：不通知主窗口（轮询照常按自己的间隔进行），并加长下一次的重连间隔
+                self._sleep(delay)
+                delay = min(delay * 2, max(delay, self.MAX_RECONNECT_DELAY))
+    
+    def _sleep(self, seconds):
+        """分段休眠，stop() 后能及时退出"""
+        deadline = time.time() + seconds
+        while not self._is_stopped and time.time() < deadline:
+            self.msleep(200)
 
 class CustomTextEdit(QTextEdit):
     """修复3：自定义文本框，支持回车发送，CTRL+回车换行"""
@@ -2470,6 +2388,163 @@ class MessageInputDialog(QDialog):
         """获取输入的消息内容"""
         return self.text_edit.toPlainText().strip()
 
+class EmployeeTableModel(QAbstractTableModel):
+    """实时状态表格的数据模型（按员工ID记录每一行）
+
+    set_rows 传入排好序的员工列表，与当前数据逐个单元格比较，只对变化的单元格发出 dataChanged；
+    上下线、新增、删除引起的行变化使用插入/删除行和 layoutChanged，其余行保持不动。
+    界面重绘量只与变化的数量有关，与员工总数无关。
+    """
+    
+    HEADERS = ["员工名", "顾客数", "接待窗口", "店铺列表", "今日咨询", "平均回复(秒)", "状态"]
+    SHOPS_COLUMN = 3
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._ids = []  # 每一行对应的员工ID
+        self._row_of = {}  # {employee_id: 行号}
+        self._rows = {}  # {employee_id: 员工行数据}
+        self._cells = {}  # {employee_id: 各列显示的文字}
+    
+    @staticmethod
+    def cells_for(emp):
+        """员工行数据 -> 各列显示的文字"""
+        online = emp["online"]
+        customers = str(emp["total_customers"]) if online else ""
+        shops = str(emp["total_shops"]) if online else ""
+        
+        # 排序店铺列表：未知店铺排在已知店铺后面
+        raw_shops = emp.get("shops_list", [])
+        if raw_shops:
+            known_shops = [s for s in raw_shops if not s.startswith("未知店铺")]
+            unknown_shops = [s for s in raw_shops if s.startswith("未知店铺")]
+            shop_list = "\n".join(known_shops + unknown_shops)
+        else:
+            shop_list = "无店铺" if online else ""
+        
+        status = "🟢在线" if online else "🔴离线"
+        return (emp["display_name"], customers, shops, shop_list, str(emp["today_consult"]), str(emp["avg_reply"]), status)
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._ids)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+    
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        employee_id = self._ids[index.row()]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            return self._cells[employee_id][column]
+        if role == Qt.TextAlignmentRole:
+            return int(Qt.AlignLeft | Qt.AlignTop) if column == self.SHOPS_COLUMN else int(Qt.AlignCenter)
+        if role == Qt.ForegroundRole and column in (1, 2):
+            # 顾客数、接待窗口数：3以内黑色，5以内蓝色，超过5红色
+            emp = self._rows[employee_id]
+            if not emp["online"]:
+                return QColor("black")
+            value = emp["total_customers"] if column == 1 else emp["total_shops"]
+            return QColor("black") if value <= 3 else QColor("blue") if value <= 5 else QColor("red")
+        if role == Qt.UserRole:
+            return employee_id  # 原始ID
+        return None
+    
+    def employee_id(self, row):
+        return self._ids[row]
+    
+    def set_rows(self, employees, changed_ids=None):
+        """更新为 employees（已排好序）
+
+        changed_ids 为可能变化的员工ID集合：行没有增删、顺序也没变时只比较这些员工；为None时比较所有行。
+        返回内容有变化（需要重新计算行高）的行号列表。
+        """
+        new_ids = [emp["employee_name"] for emp in employees]
+        new_rows = {emp["employee_name"]: emp for emp in employees}
+        changed_rows = []
+        if new_ids != self._ids:
+            changed_rows = self._apply_structure(new_ids, new_rows)
+            changed_ids = None
+        
+        check_ids = self._ids if changed_ids is None else [employee_id for employee_id in changed_ids if employee_id in new_rows]
+        for employee_id in check_ids:
+            emp = new_rows[employee_id]
+            self._rows[employee_id] = emp
+            cells = self.cells_for(emp)
+            old_cells = self._cells[employee_id]
+            if cells == old_cells:
+                continue
+            self._cells[employee_id] = cells
+            row = self._row_of[employee_id]
+            for column, (old, new) in enumerate(zip(old_cells, cells)):
+                if old != new:
+                    index = self.index(row, column)
+                    self.dataChanged.emit(index, index)
+            changed_rows.append(row)
+        return changed_rows
+    
+    def _apply_structure(self, new_ids, new_rows):
+        """删除、重排、插入行，使行的顺序与 new_ids 一致；返回新插入的行号"""
+        new_id_set = set(new_ids)
+        
+        # 1. 删除不再显示的行（从下往上，连续的行一次删除）
+        row = len(self._ids) - 1
+        while row >= 0:
+            if self._ids[row] in new_id_set:
+                row -= 1
+                continue
+            last = row
+            while row >= 0 and self._ids[row] not in new_id_set:
+                row -= 1
+            self.beginRemoveRows(QModelIndex(), row + 1, last)
+            for employee_id in self._ids[row + 1:last + 1]:
+                del self._rows[employee_id]
+                del self._cells[employee_id]
+            del self._ids[row + 1:last + 1]
+            self.endRemoveRows()
+        
+        # 2. 保留下来的行按新的相对顺序排列（例如员工上下线、修改排序）
+        kept_ids = [employee_id for employee_id in new_ids if employee_id in self._rows]
+        if kept_ids != self._ids:
+            self.layoutAboutToBeChanged.emit()
+            old_ids = self._ids
+            self._ids = kept_ids
+            kept_row_of = {employee_id: row for row, employee_id in enumerate(kept_ids)}
+            persistent = self.persistentIndexList()
+            self.changePersistentIndexList(persistent, [
+                self.index(kept_row_of[old_ids[index.row()]], index.column()) for index in persistent
+            ])
+            self.layoutChanged.emit()
+        
+        # 3. 按新顺序插入新增的行（连续的行一次插入）；保留的行已经是新的相对顺序，所以从前往后插入即可
+        inserted_rows = []
+        row = 0
+        while row < len(new_ids):
+            if new_ids[row] in self._rows:
+                row += 1
+                continue
+            end = row
+            while end < len(new_ids) and new_ids[end] not in self._rows:
+                end += 1
+            block = new_ids[row:end]
+            self.beginInsertRows(QModelIndex(), row, end - 1)
+            self._ids[row:row] = block
+            for employee_id in block:
+                self._rows[employee_id] = new_rows[employee_id]
+                self._cells[employee_id] = self.cells_for(new_rows[employee_id])
+            self.endInsertRows()
+            inserted_rows.extend(range(row, end))
+            row = end
+        
+        self._row_of = {employee_id: row for row, employee_id in enumerate(self._ids)}
+        return inserted_rows
+
 class ManagerApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -2503,12 +2578,10 @@ class ManagerApp(QMainWindow):
         title_label.setAlignment(Qt.AlignCenter)
         main_layout.addWidget(title_label)
         
-        self.table = QTableWidget()
-        self.table.setColumnCount(7)
-        self.table.setHorizontalHeaderLabels([
-            "员工名", "顾客数", "接待窗口", "店铺列表", 
-            "今日咨询", "平均回复(秒)", "状态"
-        ])
+        # 表格使用数据模型：数据变化时只重绘变化的单元格
+        self.table_model = EmployeeTableModel(self)
+        self.table = QTableView()
+        self.table.setModel(self.table_model)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
         self.table.horizontalHeader().setStretchLastSection(True)
         self.table.setColumnWidth(0, 150)
@@ -2519,11 +2592,12 @@ class ManagerApp(QMainWindow):
         self.table.setColumnWidth(5, 120)
         self.table.setColumnWidth(6, 80)
         self.table.setWordWrap(True)
-        self.table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        # 行高只在该行内容变化时重新计算（ResizeToContents 模式下任何变化都会重新计算所有行）
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Interactive)
         self.table.horizontalHeader().setDefaultAlignment(Qt.AlignCenter)
-        self.table.setSelectionBehavior(QTableWidget.SelectItems)
-        self.table.setSelectionMode(QTableWidget.NoSelection)
-        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableView.SelectItems)
+        self.table.setSelectionMode(QTableView.NoSelection)
+        self.table.setEditTriggers(QTableView.NoEditTriggers)
         main_layout.addWidget(self.table)
         
         button_layout = QHBoxLayout()
@@ -2549,26 +2623,42 @@ class ManagerApp(QMainWindow):
         self.sort_btn.clicked.connect(self.open_sort_dialog)
         self.reconnect_btn.clicked.connect(self.reconnect_server)
         
+        # 状态栏显示轮询延迟统计
+        self.poll_stats_label = QLabel("轮询延迟：--")
+        self.statusBar().addPermanentWidget(self.poll_stats_label)
+        
         self.rename_mode = False
         self.show_offline = True
         self.last_update_time = 0
-        self.last_request_time = 0  # 记录最后一次请求的时间戳，用于判断是否处理响应
+        self.last_request_time = 0  # 最后一次采用的数据（轮询响应的请求时间或推送流的到达时间），用于丢弃过期的轮询响应
         self.connected = False
         
-        # 网络工作线程
-        self.network_worker = None
-        
         # 连接双击事件（始终保持连接，通过rename_mode判断行为）
-        self.table.cellDoubleClicked.connect(self.on_double_click)
-        
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_realtime)
-        self.timer.start(500)  # 修复：改为500ms（0.5秒）刷新，提高实时性
-        
-        # 缓存上次数据，只在变化时更新
-        self.last_employees_data = None
-        
-        self.update_realtime()
+        self.table.doubleClicked.connect(self.on_double_click)
+        
+        # 本地员工数据（按增量更新），只在变化时更新表格
+        self.employee_rows = {}  # {employee_id: 员工行数据}
+        self.current_data = []  # 当前员工列表（历史统计对话框也会使用）
+        
+        # 元数据（来自 /dashboard，每次刷新随员工数据一起返回）：表格在本地排序，历史统计对话框在本地过滤
+        self.dashboard_loaded = False
+        self.employee_order = {}  # {employee_id: 排序序号}
+        self.employee_visibility = {}  # {employee_id: {"hidden": ..., "is_manual": ...}}
+        self.show_all = False  # 全局显示模式
+        self.employee_colors = {"global_line_color": "#2196F3", "employee_colors": {}}
+        
+        # 轮询线程：推送流断开时是员工数据的唯一来源，连接时只用于同步元数据
+        self.poller = DashboardPoller()
+        self.poller.payload_ready.connect(self.on_dashboard_received)
+        self.poller.error_occurred.connect(self.on_network_error)
+        self.poller.stats_ready.connect(self.on_poll_stats)
+        self.poller.start()
+        
+        # 推送流：员工数据变化时由服务器主动推送
+        self.stream_worker = EmployeeStreamWorker()
+        self.stream_worker.delta_ready.connect(self.on_stream_delta)
+        self.stream_worker.connection_changed.connect(self.on_stream_connection_changed)
+        self.stream_worker.start()
     
     def reconnect_server(self):
         self.update_realtime(force=True)
@@ -2582,17 +2672,13 @@ class ManagerApp(QMainWindow):
             self.rename_btn.setText("启用改名")
             self.rename_btn.setStyleSheet("")
     
-    def on_double_click(self, row, column):
+    def on_double_click(self, index):
         # 双击员工名（第0列）
-        if column != 0:
+        if not index.isValid() or index.column() != 0:
             return
         
-        # 从表格项的data中获取原始ID
-        name_item = self.table.item(row, 0)
-        if not name_item:
-            return
-        original_id = name_item.data(Qt.UserRole)  # 获取存储的原始ID
-        current_display_name = name_item.text()
+        original_id = index.data(Qt.UserRole)  # 获取原始ID
+        current_display_name = index.data(Qt.DisplayRole)
         
         # 如果处于改名模式，执行改名操作
         if self.rename_mode:
@@ -2600,36 +2686,33 @@ class ManagerApp(QMainWindow):
                 self, "修改员工名", "请输入新名称:", text=current_display_name
             )
             if ok and new_name.strip() and new_name.strip() != current_display_name:
-                try:
-                    resp = requests.post(
-                        f"{SERVER_URL}/rename_employee",
-                        json={"original_id": original_id, "new_name": new_name.strip()},
-                        timeout=REQUEST_TIMEOUT
-                    )
-                    if resp.status_code == 200:
-                        self.update_realtime()
-                    else:
-                        QMessageBox.critical(self, "错误", "改名失败，请重试")
-                except Exception as ex:
-                    QMessageBox.critical(self, "网络错误", f"无法连接服务器:\n{str(ex)}")
+                request_executor.post(
+                    "/rename_employee",
+                    {"original_id": original_id, "new_name": new_name.strip()},
+                    lambda result: self.update_realtime(),
+                    self.on_action_error("改名失败，请重试")
+                )
         else:
             # 非改名模式，发送消息给员工
             dialog = MessageInputDialog(current_display_name, self)
             if dialog.exec_() == QDialog.Accepted:
                 message = dialog.get_message()
                 if message:
-                    try:
-                        resp = requests.post(
-                            f"{SERVER_URL}/send_message",
-                            json={"employee_id": original_id, "message": message},
-                            timeout=REQUEST_TIMEOUT
-                        )
-                        if resp.status_code == 200:
-                            QMessageBox.information(self, "成功", f"消息已发送给 {current_display_name}")
-                        else:
-                            QMessageBox.critical(self, "错误", "消息发送失败，请重试")
-                    except Exception as ex:
-                        QMessageBox.critical(self, "网络错误", f"无法连接服务器:\n{str(ex)}")
+                    request_executor.post(
+                        "/send_message",
+                        {"employee_id": original_id, "message": message},
+                        lambda result: QMessageBox.information(self, "成功", f"消息已发送给 {current_display_name}"),
+                        self.on_action_error("消息发送失败，请重试")
+                    )
+    
+    def on_action_error(self, failure_text):
+        """返回改名、发送消息等操作的失败回调：服务器返回错误时提示 failure_text，网络错误时提示连接失败"""
+        def on_error(e):
+            if isinstance(e, RequestError):
+                QMessageBox.critical(self, "错误", failure_text)
+            else:
+                QMessageBox.critical(self, "网络错误", f"无法连接服务器:\n{str(e)}")
+        return on_error
     
     def open_history(self):
         dialog = HistoryDialog(self)
@@ -2638,33 +2721,29 @@ class ManagerApp(QMainWindow):
     def toggle_offline_display(self):
         self.show_offline = not self.show_offline
         self.offline_toggle_btn.setText("隐藏离线员工" if self.show_offline else "显示离线员工")
-        self.update_realtime()
+        self.refresh_table()
     
     def open_delete_dialog(self):
         """打开删除员工对话框"""
-        try:
-            # 获取当前员工列表
-            resp = requests.get(f"{SERVER_URL}/employees", timeout=REQUEST_TIMEOUT)
-            employees = resp.json() if resp.status_code == 200 else []
-            
-            if not employees:
-                QMessageBox.information(self, "提示", "当前没有员工记录")
-                return
-            
-            # 打开删除对话框
-            dialog = DeleteEmployeeDialog(self, employees)
-            if dialog.exec_() == QDialog.Accepted:
-                # 删除成功后刷新列表
-                self.update_realtime()
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"获取员工列表失败：\n{str(e)}")
+        # 当前员工列表使用本地数据
+        employees = self.apply_employee_sort(list(self.employee_rows.values()))
+        
+        if not employees:
+            QMessageBox.information(self, "提示", "当前没有员工记录")
+            return
+        
+        # 打开删除对话框
+        dialog = DeleteEmployeeDialog(self, employees)
+        if dialog.exec_() == QDialog.Accepted:
+            # 删除成功后刷新列表
+            self.update_realtime(force=True)
     
     def open_sort_dialog(self):
         """打开员工排序对话框"""
         try:
-            # 获取当前员工列表
-            resp = requests.get(f"{SERVER_URL}/employees", timeout=REQUEST_TIMEOUT)
-            employees = resp.json() if resp.status_code == 200 else []
+            # 当前员工列表和排序配置都使用本地数据（由 /dashboard 同步）
+            employees = self.apply_employee_sort(list(self.employee_rows.values()))
+            order_dict = self.employee_order
             
             if not employees:
                 QMessageBox.information(self, "提示", "当前没有员工记录")
@@ -2682,14 +2761,6 @@ class ManagerApp(QMainWindow):
             info_label.setFont(QFont("Arial", 10))
             layout.addWidget(info_label)
             
-            # 获取现有排序配置
-            try:
-                resp_order = requests.get(f"{SERVER_URL}/employee_order", timeout=REQUEST_TIMEOUT)
-                order_data = resp_order.json() if resp_order.status_code == 200 else []
-                order_dict = {item['employee_id']: item['order'] for item in order_data}
-            except:
-                order_dict = {}
-            
             # 创建表格
             table = QTableWidget()
             table.setColumnCount(4)
@@ -2742,33 +2813,34 @@ class ManagerApp(QMainWindow):
             dialog.setLayout(layout)
             
             def save_order():
-                try:
-                    orders = []
-                    for row in range(table.rowCount()):
-                        employee_id = table.item(row, 3).text()
-                        spinbox = table.cellWidget(row, 2)
-                        order = spinbox.value()
-                        orders.append({
-                            "employee_id": employee_id,
-                            "order": order
-                        })
-                    
-                    # 保存到服务器
-                    resp = requests.post(
-                        f"{SERVER_URL}/save_employee_order",
-                        json={"orders": orders},
-                        timeout=REQUEST_TIMEOUT
-                    )
-                    
-                    if resp.status_code == 200:
-                        QMessageBox.information(dialog, "成功", "排序配置已保存")
-                        dialog.accept()
-                        # 刷新表格
-                        self.update_realtime(force=True)
-                    else:
+                orders = []
+                for row in range(table.rowCount()):
+                    employee_id = table.item(row, 3).text()
+                    spinbox = table.cellWidget(row, 2)
+                    order = spinbox.value()
+                    orders.append({
+                        "employee_id": employee_id,
+                        "order": order
+                    })
+                
+                def on_saved(result):
+                    QMessageBox.information(dialog, "成功", "排序配置已保存")
+                    dialog.accept()
+                    # 先按新的排序刷新表格，再从服务器同步
+                    self.employee_order = {item["employee_id"]: item["order"] for item in orders}
+                    self.refresh_table()
+                    self.update_realtime(force=True)
+                
+                def on_error(e):
+                    save_btn.setEnabled(True)
+                    if isinstance(e, RequestError):
                         QMessageBox.warning(dialog, "失败", "保存排序配置失败")
-                except Exception as e:
-                    QMessageBox.critical(dialog, "错误", f"保存时发生错误：\n{str(e)}")
+                    else:
+                        QMessageBox.critical(dialog, "错误", f"保存时发生错误：\n{str(e)}")
+                
+                # 保存到服务器
+                save_btn.setEnabled(False)
+                request_executor.post("/save_employee_order", {"orders": orders}, on_saved, on_error)
             
             save_btn.clicked.connect(save_order)
             cancel_btn.clicked.connect(dialog.reject)
@@ -2779,59 +2851,75 @@ class ManagerApp(QMainWindow):
             QMessageBox.critical(self, "错误", f"打开排序对话框失败：\n{str(e)}")
     
     def apply_employee_sort(self, employees):
-        """应用员工排序（离线员工排在在线员工下面）"""
-        try:
-            # 获取排序配置
-            resp = requests.get(f"{SERVER_URL}/employee_order", timeout=REQUEST_TIMEOUT)
-            order_data = resp.json() if resp.status_code == 200 else []
-            order_dict = {item['employee_id']: item['order'] for item in order_data}
-            
-            # 分离在线和离线员工
-            online_employees = [emp for emp in employees if emp.get("online", False)]
-            offline_employees = [emp for emp in employees if not emp.get("online", False)]
-            
-            # 分别排序
-            def get_sort_key(emp):
-                employee_id = emp.get("employee_name", "")
-                return order_dict.get(employee_id, 9999)
-            
-            online_sorted = sorted(online_employees, key=get_sort_key)
-            offline_sorted = sorted(offline_employees, key=get_sort_key)
-            
-            # 在线员工在前，离线员工在后
-            return online_sorted + offline_sorted
-        except Exception as e:
-            print(f"应用员工排序失败: {e}")
-            return employees  # 失败时返回原始列表
+        """应用员工排序（离线员工排在在线员工下面；使用本地的排序配置，不请求服务器）"""
+        order_dict = self.employee_order
+        
+        # 分离在线和离线员工
+        online_employees = [emp for emp in employees if emp.get("online", False)]
+        offline_employees = [emp for emp in employees if not emp.get("online", False)]
+        
+        # 分别排序
+        def get_sort_key(emp):
+            employee_id = emp.get("employee_name", "")
+            return order_dict.get(employee_id, 9999)
+        
+        online_sorted = sorted(online_employees, key=get_sort_key)
+        offline_sorted = sorted(offline_employees, key=get_sort_key)
+        
+        # 在线员工在前，离线员工在后
+        return online_sorted + offline_sorted
+    
+    def on_stream_delta(self, delta):
+        """推送流收到增量数据（在主线程中执行）"""
+        # 推送的数据总是最新的，让还在进行中的轮询响应作废
+        self.last_request_time = time.time()
+        self.on_delta_received(delta)
+    
+    def on_stream_connection_changed(self, connected):
+        """推送流连接状态变化：连接时放慢轮询（只同步元数据），断开时立即恢复轮询"""
+        self.poller.stream_connected = connected
+        if not connected:
+            self.update_realtime()
     
     def update_realtime(self, force=False):
-        """非阻塞的实时数据更新"""
-        # 修复：如果有正在运行的任务，取消旧的请求，启动新的请求
-        # 这样可以确保总是获取最新的数据，避免延迟累积
-        if self.network_worker and self.network_worker.isRunning():
-            print("[实时更新] 检测到前一个请求还在运行，取消旧请求，启动新请求")
-            self.network_worker.cancel()  # 取消旧的请求
-            self.network_worker.quit()  # 退出线程
-            self.network_worker.wait(50)  # 等待线程退出（最多等待50ms，不阻塞太久）
-            # 如果50ms内没有退出，强制终止（但这样可能会导致资源泄漏，所以避免）
-            if self.network_worker.isRunning():
-                print("[实时更新] 警告：前一个请求仍在运行，将直接启动新请求（旧请求会被忽略）")
-        
-        # 创建新的工作线程（使用请求时间戳来标识最新的请求）
-        self.network_worker = NetworkWorker(f"{SERVER_URL}/employees")
-        # 使用lambda捕获当前时间戳，确保只处理最新的响应
-        # 注意：使用默认参数来避免闭包问题
-        request_time = time.time()
-        # 先更新请求时间（确保后续响应能正确判断）
-        self.last_request_time = request_time
-        self.network_worker.data_ready.connect(
-            lambda employees, rt=request_time, f=force: self.on_data_received(employees, f, rt)
+        """让轮询线程立即刷新一次（一次 /dashboard 请求同时获取员工数据和元数据）"""
+        self.poller.poll_now(force)
+    
+    def on_poll_stats(self, stats):
+        """在状态栏显示轮询延迟统计"""
+        if stats["ok"] and not self.connected:
+            self.connected = True
+            self.connection_status.setText("✅️ 已连接")
+        self.poll_stats_label.setText(
+            f"轮询 {stats['polls']} 次（失败 {stats['errors']}）  "
+            f"延迟 最近 {stats['last_ms']:.0f}ms / 平均 {stats['avg_ms']:.0f}ms / P95 {stats['p95_ms']:.0f}ms  "
+            f"间隔 {stats['interval']:.1f}s"
         )
-        self.network_worker.error_occurred.connect(self.on_network_error)
-        self.network_worker.start()
     
-    def on_data_received(self, employees, force=False, request_time=None):
-        """数据接收完成（在主线程中执行UI更新）"""
+    def on_dashboard_received(self, payload, force=False, request_time=None):
+        """/dashboard 响应（在主线程中执行）：先保存元数据，再合并员工数据"""
+        order_changed = self.apply_dashboard_meta(payload)
+        if request_time is not None and request_time < self.last_request_time:
+            # 推送流已经送来更新的员工数据，只使用元数据部分
+            if order_changed:
+                self.refresh_table()
+            return
+        self.on_delta_received(payload.get("employees", {}), force or order_changed, request_time)
+    
+    def apply_dashboard_meta(self, payload):
+        """保存 /dashboard 返回的元数据，返回排序配置是否变化（变化时表格需要重新排序）"""
+        order = payload.get("order", {})
+        order_changed = order != self.employee_order
+        self.employee_order = order
+        self.employee_visibility = payload.get("visibility", {})
+        self.show_all = payload.get("show_all", False)
+        self.employee_colors = payload.get("colors", self.employee_colors)
+        self.poller.etag = payload.get("version")
+        self.dashboard_loaded = True
+        return order_changed
+    
+    def on_delta_received(self, delta, force=False, request_time=None):
+        """增量数据接收完成（在主线程中执行UI更新）"""
         try:
             # 修复：如果这不是最新的请求响应，忽略它（避免处理过期的数据）
             if request_time is not None:
@@ -2841,12 +2929,28 @@ class ManagerApp(QMainWindow):
                 # 这是最新的响应，更新请求时间
                 self.last_request_time = request_time
             
-            # 数据对比，只在变化时更新UI
-            employees_str = json.dumps(employees, sort_keys=True)
-            if not force and employees_str == self.last_employees_data:
-                return  # 数据未变化，不更新UI
+            self.poller.epoch = delta.get("epoch")
+            self.poller.since = delta.get("version", 0)
+            
+            # 合并增量数据，记录变化的员工
+            if delta.get("full"):
+                new_rows = {emp["employee_name"]: emp for emp in delta.get("changed", [])}
+                if not force and new_rows == self.employee_rows:
+                    return  # 数据未变化，不更新UI
+                self.employee_rows = new_rows
+                changed_ids = None  # 全量数据：重绘所有行
+            else:
+                changed_ids = set(delta.get("removed", []))
+                for emp in delta.get("changed", []):
+                    self.employee_rows[emp["employee_name"]] = emp
+                    changed_ids.add(emp["employee_name"])
+                for employee_id in delta.get("removed", []):
+                    self.employee_rows.pop(employee_id, None)
+                if not force and not changed_ids:
+                    return  # 数据未变化，不更新UI
+                if force:
+                    changed_ids = None
             
-            self.last_employees_data = employees_str
             self.connected = True
             self.connection_status.setText("✅️ 已连接")
             self.last_update_time = time.time()
@@ -2855,74 +2959,34 @@ class ManagerApp(QMainWindow):
             time_str = current_time.strftime("%H.%M.%S")
             self.last_update_label.setText(f"最新收到数据时间：{time_str}")
             
-            filtered_employees = [
-                emp for emp in employees
-                if self.show_offline or emp["online"]
-            ]
-            
-            # 应用员工排序（离线员工排在在线员工下面）
-            filtered_employees = self.apply_employee_sort(filtered_employees)
-            
-            self.table.setRowCount(len(filtered_employees))
-            
-            for row, emp in enumerate(filtered_employees):
-                name = emp["display_name"]
-                original_id = emp["employee_name"]  # 获取原始ID
-                customers = str(emp["total_customers"]) if emp["online"] else ""
-                shops = str(emp["total_shops"]) if emp["online"] else ""
-                
-                # 排序店铺列表：未知店铺排在已知店铺后面
-                raw_shops = emp.get("shops_list", [])
-                if raw_shops:
-                    known_shops = [s for s in raw_shops if not s.startswith("未知店铺")]
-                    unknown_shops = [s for s in raw_shops if s.startswith("未知店铺")]
-                    sorted_shops = known_shops + unknown_shops
-                    shop_list = "\n".join(sorted_shops)
-                else:
-                    shop_list = "无店铺" if emp["online"] else ""
-                
-                consult = str(emp["today_consult"])
-                avg_reply = str(emp["avg_reply"])  # 已是整数
-                status = "🟢在线" if emp["online"] else "🔴离线"
-                
-                # 设置员工名称，并存储原始ID
-                name_item = QTableWidgetItem(name)
-                name_item.setTextAlignment(Qt.AlignCenter)
-                name_item.setData(Qt.UserRole, original_id)  # 存储原始ID到UserRole
-                self.table.setItem(row, 0, name_item)
-                self._set_table_item(row, 1, customers, align=Qt.AlignCenter)
-                self._set_table_item(row, 2, shops, align=Qt.AlignCenter)
-                self._set_table_item(row, 3, shop_list, align=Qt.AlignLeft | Qt.AlignTop)
-                self._set_table_item(row, 4, consult, align=Qt.AlignCenter)
-                self._set_table_item(row, 5, avg_reply, align=Qt.AlignCenter)
-                self._set_table_item(row, 6, status, align=Qt.AlignCenter)
-                self.table.resizeRowToContents(row)
-                
-                if emp["online"]:
-                    cust_val = emp["total_customers"]
-                    color = QColor("black") if cust_val <= 3 else QColor("blue") if cust_val <= 5 else QColor("red")
-                    self.table.item(row, 1).setForeground(color)
-                    shop_val = emp["total_shops"]
-                    color = QColor("black") if shop_val <= 3 else QColor("blue") if shop_val <= 5 else QColor("red")
-                    self.table.item(row, 2).setForeground(color)
-                else:
-                    self.table.item(row, 1).setForeground(QColor("black"))
-                    self.table.item(row, 2).setForeground(QColor("black"))
+            self.refresh_table(changed_ids)
         except Exception as e:
             print(f"[UI更新错误] {e}")
             self.connected = False
             self.connection_status.setText("❌️ 数据处理失败")
     
+    def refresh_table(self, changed_ids=None):
+        """根据本地员工数据刷新表格
+
+        changed_ids 为变化的员工ID集合，为None时比较所有行；表格模型只更新内容真正变化的单元格。
+        """
+        self.current_data = list(self.employee_rows.values())
+        filtered_employees = [
+            emp for emp in self.current_data
+            if self.show_offline or emp["online"]
+        ]
+        
+        # 应用员工排序（离线员工排在在线员工下面）
+        filtered_employees = self.apply_employee_sort(filtered_employees)
+        
+        for row in self.table_model.set_rows(filtered_employees, changed_ids):
+            self.table.resizeRowToContents(row)
+    
     def on_network_error(self, error_msg):
         """网络错误处理（在主线程中执行）"""
         self.connected = False
         self.connection_status.setText(f"❌️ {error_msg}")
 
-    def _set_table_item(self, row, col, text, align=Qt.AlignCenter):
-        item = QTableWidgetItem(str(text) if text is not None else "")
-        item.setTextAlignment(align)
-        self.table.setItem(row, col, item)
-    
     def restore_window_geometry(self):
         """恢复主窗口大小和位置（从Windows注册表读取）"""
         # 恢复窗口大小
@@ -2957,6 +3021,11 @@ class ManagerApp(QMainWindow):
     def closeEvent(self, event):
         """主窗口关闭时保存配置"""
         self.save_window_geometry()
+        self.stream_worker.stop()
+        self.stream_worker.wait(1000)
+        self.poller.stop()
+        self.poller.wait(REQUEST_TIMEOUT * 1000)
+        request_executor.shutdown()
         event.accept()
 
 if __name__ == "__main__":
@@ -2966,12 +3035,15 @@ if __name__ == "__main__":
         QApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
         
         app = QApplication(sys.argv)
+        request_executor = RequestExecutor()
+        if UI_STALL_WATCHDOG:
+            stall_watchdog = UIStallWatchdog()
+            stall_watchdog.start()
         window = ManagerApp()
         window.show()
         sys.exit(app.exec_())
     except Exception as e:
         # 如果出错，显示错误信息
-        import traceback
         print("\n" + "=" * 60)
         print("程序启动失败！")
         print("=" * 60)